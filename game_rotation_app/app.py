@@ -1,10 +1,28 @@
-from shiny import App, Inputs, Outputs, Session, render, ui, reactive
+from shiny import App, Inputs, Outputs, Session, render, ui, reactive, req
 
 import numpy as np
 import pandas as pd
 import os
-from load_data_utils import get_gr, get_pbp
-from plot_utils import make_final_fig, diverging_cmaps, sequential_cmaps
+import time
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.concurrency import run_in_threadpool
+from load_data_utils import LeagueGameLogStore, season_strs
+from plot_utils import diverging_cmaps, sequential_cmaps, use_offscreen_backend
+from img_utils import get_render_size, write_img_file, record_render_stats, img_format
+from rotation_endpoint import make_rotation_route
+from game_cache import get_governed_img, prefetch_games, prefetch_n_games, prefetch_n_neighbors, start_warm_up, render_lock
+from similarity_utils import find_similar_games
+from profile_utils import profiled, is_profile_requested
+from series_utils import get_playoff_series, get_series_img
+from sparkline_utils import make_gallery_tiles, make_sparkline_route
+from leaderboard_utils import has_leaderboard, get_leaderboard
+from game_search_utils import search_games, search_orders, search_note_formats
+from shot_chart_utils import has_shot_data, get_shot_chart, get_shooters, draw_shot_chart
+from player_stint_utils import get_player_stints, get_stint_players, draw_player_stints
+from lgl_index_utils import get_lgl_index
+from memory_utils import tracked, start_session, make_memory_route
+from render_quality import make_quality_route
 
 ### SOMETHING BROKEN WITH 2024-02-25: SAS @ UTA
 # (0022300825)
@@ -13,34 +31,41 @@ from plot_utils import make_final_fig, diverging_cmaps, sequential_cmaps
 
 # load relevant data
 data_dir = './data/'
-df_team_info = pd.read_csv(os.path.join(data_dir, 'df_team_info.csv'))
 
-tms_byalphabet = np.sort(df_team_info['TEAM_ABBREVIATION'].values)
+# when served by multiple worker processes (see serve.py), 
+# the season data is memory mapped from files shared by all workers,
+# instead of each worker reading in its own copy,
+# and the game logs move to the new versions serve.py writes
+# as the nightly update's new rows are saved (see shared_data.py)
+shared_data_dir = os.environ.get('ROTATION_SHARED_DATA_DIR')
+if shared_data_dir:
+    from shared_data import read_shared_frame, SharedLeagueGameLogs
+    df_team_info = read_shared_frame('df_team_info', shared_data_dir)
+    lgl_store = SharedLeagueGameLogs(shared_data_dir)
+else:
+    df_team_info = pd.read_csv(os.path.join(data_dir, 'df_team_info.csv'))
+    # the game logs pick up the nightly update's new rows as they're saved
+    # (see load_data_utils.LeagueGameLogStore)
+    lgl_store = LeagueGameLogStore(season_strs, data_dir)
+
+# how often (in seconds) sessions check the saved game logs for new rows
+lgl_poll_secs = 60
+
+def get_lgl_file_states():
+    return lgl_store.get_file_states()
+
+def get_cur_lgls():
+    '''
+    The current team and player league game logs
+    (with any new rows saved since the app started)
+    '''
+    lgl_store.refresh()
+    return lgl_store.get_lgls()
 
-# TO-DO: ADD MORE YEARS!
-season_end_yrs = [2024, 2023]
-season_strs = ['{}-{}'.format(season_end_year-1, str(season_end_year)[-2:]) for season_end_year in season_end_yrs]
-
-df_lgl_T_all = []
-df_lgl_P_all = []
-for s_str in season_strs:
-    for s_type in ['', '_po', '_pi']:
-        fpathT = os.path.join(data_dir, f'lgls/df_lgl_T_{s_str}{s_type}.csv')
-        if os.path.exists(fpathT):
-            cur_lgl_T = pd.read_csv(fpathT, 
-                                    dtype={'GAME_ID': str},
-                                    index_col=0)
-            cur_lgl_T['season_str'] = s_str
-            df_lgl_T_all.append(cur_lgl_T)
-        fpathP = os.path.join(data_dir, f'lgls/df_lgl_P_{s_str}{s_type}.csv')
-        if os.path.exists(fpathP):
-            cur_lgl_P = pd.read_csv(fpathP,
-                                    dtype={'GAME_ID': str},
-                                    index_col=0)
-            cur_lgl_P['season_str'] = s_str
-            df_lgl_P_all.append(cur_lgl_P)
-df_lgl_T_all = pd.concat(df_lgl_T_all)
-df_lgl_P_all = pd.concat(df_lgl_P_all)
+# the final margin slider's top end means any margin
+max_search_margin = 60
+
+tms_byalphabet = np.sort(df_team_info['TEAM_ABBREVIATION'].values)
 
 tm_choices = np.concatenate((['All'], tms_byalphabet))
 
@@ -79,6 +104,22 @@ app_ui = ui.page_navbar(
                         ui.input_selectize('game_id',
                                         'Select the game:',
                                         {x: x for x in []}),
+                        ui.input_switch('gallery_mode',
+                                        'Browse games by margin', False),
+                    ),
+
+                    ui.accordion_panel('Game Search',
+                        ui.input_select('search_order',
+                                        'List games by',
+                                        {k: v[0] for k, v in search_orders.items()}),
+                        ui.input_slider('search_min_deficit',
+                                        'Comeback of at least (points)', 0, 30, 0),
+                        ui.input_slider('search_min_lead_changes',
+                                        'Lead changes, at least', 0, 30, 0),
+                        ui.input_slider('search_max_final_margin',
+                                        'Final margin of at most (points)', 1, max_search_margin, max_search_margin),
+                        ui.input_checkbox('search_ot_only',
+                                          'Overtime games only', False),
                     ),
 
                     ui.accordion_panel('Plot Settings',
@@ -103,12 +144,19 @@ app_ui = ui.page_navbar(
                 open='always'
             ),
 
+            ui.panel_conditional('input.gallery_mode',
+                ui.card(
+                    ui.card_header('Game Gallery (away - home margin, click to select)'),
+                    ui.output_ui('game_gallery'),
+                ),
+            ),
+
             ui.card(
                 ui.card_header('Rotation Plot'),
-                ui.output_plot("plot", 
-                               height='100%', 
-                               width='1200px'
-                               ),
+                ui.output_image("plot", 
+                                height='auto', 
+                                width='100%'
+                                ),
             ),
 
             ui.layout_columns(
@@ -121,9 +169,138 @@ app_ui = ui.page_navbar(
                     ui.output_data_frame('home_box')
                 )
             ),
+
+            ui.card(
+                ui.card_header('Games With A Similar Margin Flow'),
+                ui.output_data_frame('similar_games')
+            ),
         ),  
     ),
 
+    ui.nav_panel('Playoff Series',
+        ui.layout_sidebar(
+            ui.sidebar(
+                ui.input_selectize('series_season_str',
+                                   'Select a season:',
+                                   {x: x for x in season_strs}),
+                ui.input_selectize('series_id',
+                                   'Select the series:',
+                                   {x: x for x in []}),
+                ui.input_radio_buttons('series_stint_val',
+                                       label='Color stints by',
+                                       choices={'pm': 'team +/-',
+                                                'player_pts': 'player points',
+                                                'none': 'team colors'}),
+                open='always'
+            ),
+
+            ui.card(
+                ui.card_header('Rotations Over The Series'),
+                ui.output_image('series_plot',
+                                height='auto',
+                                width='100%'
+                                ),
+            ),
+        ),
+    ),
+
+    ui.nav_panel('Leaderboards',
+        ui.layout_sidebar(
+            ui.sidebar(
+                ui.input_selectize('lb_season_str',
+                                   'Select a season:',
+                                   {x: x for x in season_strs}),
+                ui.input_radio_buttons('lb_season_type',
+                                       label='',
+                                       choices={'Regular Season': 'regular season',
+                                                'PlayIn': 'play-in tournament',
+                                                'Playoffs': 'playoffs'}),
+                ui.input_radio_buttons('lb_level',
+                                       label='Leaders among',
+                                       choices={'players': 'players', 'teams': 'teams'}),
+                ui.input_numeric('lb_min_games', 'Minimum games played', 10, min=1),
+                open='always'
+            ),
+
+            ui.card(
+                ui.card_header('Stint Leaderboard (click a column to sort)'),
+                ui.output_text('leaderboard_note'),
+                ui.output_data_frame('leaderboard')
+            ),
+        ),
+    ),
+
+    ui.nav_panel('Shot Charts',
+        ui.layout_sidebar(
+            ui.sidebar(
+                ui.input_selectize('sc_season_str',
+                                   'Select a season:',
+                                   {x: x for x in season_strs}),
+                ui.input_radio_buttons('sc_season_type',
+                                       label='',
+                                       choices={'Regular Season': 'regular season',
+                                                'PlayIn': 'play-in tournament',
+                                                'Playoffs': 'playoffs'}),
+                ui.input_radio_buttons('sc_level',
+                                       label='Shots of',
+                                       choices={'team': "a team's season",
+                                                'player': "a player's season",
+                                                'game': "a team's game"}),
+                ui.input_selectize('sc_team',
+                                   'Team:',
+                                   {x: x for x in tms_byalphabet}),
+                ui.panel_conditional("input.sc_level === 'player'",
+                    ui.input_selectize('sc_player', 'Player:', {}),
+                ),
+                ui.panel_conditional("input.sc_level === 'game'",
+                    ui.input_selectize('sc_game_id', 'Game:', {}),
+                ),
+                open='always'
+            ),
+
+            ui.card(
+                ui.card_header('Shot Chart'),
+                ui.output_text('shot_chart_note'),
+                ui.output_image('shot_chart',
+                                height='auto',
+                                width='100%'
+                                ),
+            ),
+        ),
+    ),
+
+    ui.nav_panel('Player Stints',
+        ui.layout_sidebar(
+            ui.sidebar(
+                ui.input_selectize('ps_season_str',
+                                   'Select a season:',
+                                   {x: x for x in season_strs}),
+                ui.input_radio_buttons('ps_season_type',
+                                       label='',
+                                       choices={'Regular Season': 'regular season',
+                                                'PlayIn': 'play-in tournament',
+                                                'Playoffs': 'playoffs'}),
+                ui.input_selectize('ps_team',
+                                   'Team:',
+                                   {x: x for x in tms_byalphabet}),
+                ui.input_selectize('ps_player', 'Player:', {}),
+                ui.input_radio_buttons('ps_stint_val',
+                                       label='Color stints by',
+                                       choices={'pm': 'team +/-',
+                                                'player_pts': 'player points'}),
+                open='always'
+            ),
+
+            ui.card(
+                ui.card_header("Player's Season of Stints (one row per game)"),
+                ui.output_image('player_stints_plot',
+                                height='auto',
+                                width='100%'
+                                ),
+            ),
+        ),
+    ),
+
     ui.nav_panel('Info',
                  
         ui.card(
@@ -214,29 +391,98 @@ def server(input: Inputs, output: Outputs, session: Session):
         ui.update_radio_buttons('season_type', choices=avail_game_types)
     '''
 
+    start_session(session)
+
+    # the server is organized as layers of reactive calcs, 
+    # going from the league game log for a season, 
+    # to the game log filtered by the team selections,
+    # to the data for a selected game, to its plot and box scores,
+    # so that each output only reruns the layers whose inputs changed.
+    # the game logs are shared by all sessions, and only indexed into
+    # (see lgl_index_utils.py), so the calcs keep row positions rather than dataframes,
+    # and their memory use can be accounted for (see memory_utils.py)
+
+    # team and player league game logs, updated when new rows are saved
+    @reactive.poll(get_lgl_file_states, lgl_poll_secs)
+    def lgls():
+
+        return get_cur_lgls()
+
+    # the shared index of the current game logs
+    @reactive.calc
+    def lgl_index():
+
+        return get_lgl_index(*lgls())
+
+    # rows of the team league game log, one per game of the
+    # chosen season + regular season/play-in/playoffs, listed as AWAY @ HOME,
+    # sorted by most recent game first
+    @reactive.calc
+    @tracked
+    def season_games():
+
+        return lgl_index().get_season_games(input.season_str(), input.season_type())
+    
+    # games in the season involving team1 (home/away/either)
+    @reactive.calc
+    @tracked
+    def team1_games():
+
+        rows = season_games()
+        tm1 = input.team1()
+        tm1_homestat = input.team1_homestat()
+
+        if tm1 != 'All':
+            idx = lgl_index()
+            if tm1_homestat == 'home only':
+                rows = rows[idx.home_tms[rows] == tm1]
+            elif tm1_homestat == 'away only':
+                rows = rows[idx.away_tms[rows] == tm1]
+            else:
+                rows = rows[(idx.away_tms[rows] == tm1) | (idx.home_tms[rows] == tm1)]
+        
+        return rows
+    
+    # games above, further filtered by opponent,
+    # along with the game search's notes on them (None if not searching)
+    @reactive.calc
+    @tracked
+    def filtered_games():
+
+        idx = lgl_index()
+        rows = team1_games()
+        tm1 = input.team1()
+        tm2 = input.team2()
+
+        if tm1 != 'All' and tm2 != 'All':
+            rows = rows[idx.get_opponents(rows, tm1) == tm2]
+        
+        # then by the game search's score state filters and ordering (see game_search_utils.py)
+        order_by = input.search_order()
+        max_final_margin = input.search_max_final_margin()
+        search_kwargs = {'min_deficit_overcome': input.search_min_deficit(),
+                         'min_lead_changes': input.search_min_lead_changes(),
+                         'ot_only': input.search_ot_only(),
+                         'max_final_margin': None if max_final_margin >= max_search_margin else max_final_margin}
+        
+        notes = None
+        if order_by != 'date' or any(search_kwargs.values()):
+            game_ids, game_features = search_games(input.season_str(), input.season_type(),
+                                                   idx.game_ids[rows], order_by=order_by, **search_kwargs)
+            rows = rows[pd.Index(idx.game_ids[rows]).get_indexer(game_ids)]
+            if order_by != 'date':
+                note_format = ' (' + search_note_formats[order_by] + ')'
+                notes = [note_format.format(v) for v in game_features[order_by]]
+        
+        return rows, notes
+
     # next, given a choice of season + regular season/play-in/playoffs,
     # restrict team filter by the teams within that set of games
     # (so all 30 teams in regular season, only 16 in playoffs, etc.)
     @reactive.effect 
     def _():
 
-        input_season_str = input.season_str()
-        season_type = input.season_type()
-
-        suffix = ''
-        if season_type == 'Playoffs':
-            suffix = '_po'
-        elif season_type == 'PlayIn': 
-            suffix = '_pi'
-        fpath = os.path.join(data_dir, 
-                             'lgls/df_lgl_T_{}{}.csv'.format(input_season_str, suffix)
-                            )
-        
-        df_lgl = pd.read_csv(fpath, 
-            dtype={'GAME_ID': str},
-            index_col=0)
-
-        subset_tms = np.sort(df_lgl['TEAM_ABBREVIATION'].unique())
+        subset_tms = lgl_index().get_season_teams(input.season_str(), input.season_type())
         subset_choices = np.concatenate((['All'], subset_tms))
         ui.update_selectize('team1', choices={x:x for x in subset_choices})
 
@@ -246,38 +492,13 @@ def server(input: Inputs, output: Outputs, session: Session):
     @reactive.effect 
     def _():
             
-        input_season_str = input.season_str()
+        rows = team1_games()
         tm1 = input.team1()
-        tm1_homestat = input.team1_homestat()
-        
-        season_type = input.season_type()
-
-        suffix = ''
-        if season_type == 'Playoffs':
-            suffix = '_po'
-        elif season_type == 'PlayIn': 
-            suffix = '_pi'
-        fpath = os.path.join(data_dir, 
-                             'lgls/df_lgl_T_{}{}.csv'.format(input_season_str, suffix)
-                            )
-        df_lgl = pd.read_csv(fpath, 
-            dtype={'GAME_ID': str},
-            index_col=0)
-
-        df_lgl = df_lgl[df_lgl.MATCHUP.str.contains('@')]
-        df_sub = df_lgl.copy()
 
         if tm1 == 'All':
             ui.update_selectize('team2', choices={x:x for x in ['All']})
         else:
-            df_sub = df_sub[df_sub.MATCHUP.str.contains(tm1)]
-
-            if tm1_homestat == 'home only':
-                df_sub = df_sub[df_sub.MATCHUP.str.contains(f'@ {tm1}')]
-            elif tm1_homestat == 'away only':
-                df_sub = df_sub[df_sub.MATCHUP.str.contains(f'{tm1} @')]
-
-            opps = np.unique([x.replace(tm1, '').replace('@', '').strip() for x in df_sub.MATCHUP.values])
+            opps = np.unique(lgl_index().get_opponents(rows, tm1))
             opps = np.concatenate((['All'], opps))
 
             ui.update_selectize('team2', choices={x:x for x in opps})
@@ -287,49 +508,35 @@ def server(input: Inputs, output: Outputs, session: Session):
     @reactive.effect 
     def _():
             
-        input_season_str = input.season_str()
-        tm1 = input.team1()
-        tm1_homestat = input.team1_homestat()
-        tm2 = input.team2()
-
-        season_type = input.season_type()
+        idx = lgl_index()
+        rows, notes = filtered_games()
+        
+        game_strs = idx.game_strs[rows]
+        if notes is not None:
+            game_strs = game_strs + np.asarray(notes, dtype=object)
+        game_ids = idx.game_ids[rows]
 
-        suffix = ''
-        if season_type == 'Playoffs':
-            suffix = '_po'
-        elif season_type == 'PlayIn': 
-            suffix = '_pi'
-        fpath = os.path.join(data_dir, 
-                             'lgls/df_lgl_T_{}{}.csv'.format(input_season_str, suffix)
-                            )
+        ui.update_selectize("game_id", choices={str(game_ids[i]):str(game_strs[i]) for i in range(len(game_strs))},
+                            label='Select the game ({} choice{}):'.format(len(game_strs), '' if len(game_strs) == 1 else 's'))
 
-        df_lgl = pd.read_csv(fpath, 
-            dtype={'GAME_ID': str},
-            index_col=0)
+    # the filtered games' margin sparklines, all from the season's sprite sheet
+    # (see sparkline_utils.py), only while the gallery is shown
+    @render.ui
+    def game_gallery():
 
-        df_lgl = df_lgl[df_lgl.MATCHUP.str.contains('@')]
+        req(input.gallery_mode())
+        idx = lgl_index()
+        rows, _ = filtered_games()
 
-        df_sub = df_lgl.copy().sort_values('GAME_DATE', ascending=0)
-        
-        if tm1 != 'All':
-            df_sub = df_sub[df_sub.MATCHUP.str.contains(tm1)]
+        return make_gallery_tiles(input.season_str(), input.season_type(),
+                                  idx.game_ids[rows], idx.gallery_strs[rows])
 
-            if tm1_homestat == 'home only':
-                df_sub = df_sub[df_sub.MATCHUP.str.contains(f'@ {tm1}')]
-            elif tm1_homestat == 'away only':
-                df_sub = df_sub[df_sub.MATCHUP.str.contains(f'{tm1} @')]
-            
-            if tm2 != 'All':
-                df_sub = df_sub[(df_sub.MATCHUP.str.contains(tm1)) & \
-                                (df_sub.MATCHUP.str.replace(tm1, '').str.contains(tm2))]
-        
-        game_strs = (df_sub
-            .set_index('GAME_ID')
-            .apply(lambda x: x['GAME_DATE']+': '+x['MATCHUP'].replace('.', ''),axis=1)
-        )
+    # clicking a game in the gallery selects it
+    @reactive.effect
+    @reactive.event(input.gallery_game_id)
+    def _():
 
-        ui.update_selectize("game_id", choices={str(game_strs.index[i]):str(game_strs.values[i]) for i in range(len(game_strs))},
-                            label='Select the game ({} choice{}):'.format(len(game_strs), '' if len(game_strs) == 1 else 's'))
+        ui.update_selectize('game_id', selected=input.gallery_game_id())
 
     # update colormaps based on stint coloring
     @reactive.effect
@@ -349,30 +556,131 @@ def server(input: Inputs, output: Outputs, session: Session):
         ui.update_selectize('plot_cmap_name', choices={x:x for x in cmap_choices})
 
 
+    # league game log row for the selected game (None if not found)
+    @reactive.calc
+    @tracked
+    def game_info():
+
+        return lgl_index().get_game_info(input.game_id())
+    
+    # plot settings, as passed to restyle_fig
+    @reactive.calc
+    def plot_settings():
+
+        return (input.checkbox_plottext(), input.stint_val(), input.plot_cmap_name())
+    
+    # device class and size to render the plot at,
+    # given the size of the plot output on the user's device
+    @reactive.calc
+    def render_size():
+
+        return get_render_size(session.clientdata.output_width('plot'),
+                               session.clientdata.pixelratio())
+
+    # once the games are listed, prefetch the plots of the first few
+    # (for the current plot settings and device size)
+    @reactive.effect
+    def _():
+
+        rows, _ = filtered_games()
+
+        with reactive.isolate():
+            df_lgl_T_all = lgl_index().df_lgl_T_all
+            prefetch_games(input.season_str(), input.season_type(),
+                           [df_lgl_T_all.iloc[row] for row in rows[:prefetch_n_games]],
+                           df_team_info, plot_settings(), render_size()[1:], img_format)
+
+    # and prefetch the plots of the games listed next to the selected game
+    @reactive.effect
+    def _():
+
+        g_id = input.game_id()
+
+        with reactive.isolate():
+            idx = lgl_index()
+            rows, _ = filtered_games()
+            i_games = np.flatnonzero(idx.game_ids[rows] == g_id)
+
+            if len(i_games) > 0:
+                i_game = i_games[0]
+                i_neighbors = [i_game + k*d for k in range(1, prefetch_n_neighbors + 1) for d in [1, -1]]
+                prefetch_games(input.season_str(), input.season_type(),
+                               [idx.df_lgl_T_all.iloc[rows[i]] for i in i_neighbors if 0 <= i < len(rows)],
+                               df_team_info, plot_settings(), render_size()[1:], img_format)
+
+    # whether this session asked for its plots to be profiled
+    # (with ?profile=<token> in the app's url, see profile_utils.py)
+    @reactive.calc
+    def profile_session():
+
+        return is_profile_requested(session.clientdata.url_search())
+
     # now we render the plot!
-    @render.plot(width=1200, height=800, alt='rotation_plot')
-    def plot():
-        
-        g_id = input.game_id()               
-        game_info = df_lgl_T_all[df_lgl_T_all['GAME_ID'] == g_id]
-        
-        if len(game_info) > 0:
+    # the game's figure is built once and shared by all sessions, 
+    # and changing the plot settings just restyles it, 
+    # and it's laid out and rasterized for the size of the output on the user's device
+    # (see game_cache.py for the caching/prefetching),
+    # at a lower quality when the server is busy (see render_quality.py).
+    # rendering waits on the render lock (which the prefetcher may hold for a whole
+    # figure build, or other sessions' renders), so it runs in a thread,
+    # outside of shiny's reactive flush, rather than stalling every session
+    @reactive.extended_task
+    async def plot_task(season_str, season_type, cur_game_info, plot_settings, render_size, is_profiled,
+                        t_requested):
+
+        if cur_game_info is None:
+            return None
+
+        t_start = time.perf_counter()
+        device_class, width, height, scale = render_size
+        show_text, stint_val, cmap_name = plot_settings
+
+        def render_img():
+            with profiled('plot', force=is_profiled,
+                          game_id=cur_game_info['GAME_ID'], stint_val=stint_val, cmap=cmap_name,
+                          text=int(show_text), width=width, scale=scale, fmt=img_format):
+                return get_governed_img(season_str, season_type, cur_game_info, df_team_info,
+                                        plot_settings, (width, height, scale), img_format, t_requested)
 
-            game_info = game_info.iloc[0]
-            df_gr = get_gr(input.season_str(), input.game_id(), input.season_type())
+        img, quality = await run_in_threadpool(render_img)
 
-            if len(df_gr) > 0:
+        if img is None:
+            return None
+
+        record_render_stats(device_class, len(img), time.perf_counter() - t_start, quality)
+        return img, width
+
+    # render the selected game, replacing any of this session's renders still waiting
+    @reactive.effect
+    def _():
 
-                df_pbp = get_pbp(input.season_str(), input.game_id(), input.season_type())
+        cur_game_info = game_info()
 
-                if len(df_pbp) > 0:
-                    
-                    return make_final_fig(df_gr, df_pbp, df_team_info, game_info, 
-                                        show_text=input.checkbox_plottext(), 
-                                        show_plot=False,
-                                        season_type=input.season_type(),
-                                        stint_val=input.stint_val(),
-                                        cmap_name=input.plot_cmap_name())
+        # the game id already changes with the season/season type,
+        # so don't rerender when those change first
+        with reactive.isolate():
+            season_str = input.season_str()
+            season_type = input.season_type()
+
+        # the render's latency counts from here (see render_quality.py),
+        # including any wait for a thread or the render lock
+        plot_task.cancel()
+        plot_task.invoke(season_str, season_type, cur_game_info,
+                         plot_settings(), render_size(), profile_session(), time.monotonic())
+
+    @render.image(delete_file=True)
+    @tracked
+    def plot():
+
+        rendered = plot_task.result()
+
+        if rendered is not None:
+
+            img, width = rendered
+            return {'src': write_img_file(img, img_format), 
+                    'width': '100%',
+                    'style': f'max-width: {width}px; height: auto;',
+                    'alt': 'rotation_plot'}
 
         return None
 
@@ -390,40 +698,350 @@ def server(input: Inputs, output: Outputs, session: Session):
                     'FT_PCT': 'FT%',}
     
 
-    @render.data_frame 
-    def away_box():
+    # player game log rows for the selected game, most minutes first,
+    # as (away team rows, home team rows)
+    @reactive.calc
+    @tracked
+    def game_box():
         
-        g_id = input.game_id()       
+        return lgl_index().get_box_rows(input.game_id())
 
-        df_box_game = df_lgl_P_all[df_lgl_P_all['GAME_ID'] == g_id]
-        df_box_away = df_box_game[df_box_game.MATCHUP.str.contains('@')]
-        fintabl = df_box_away[plot_cols].sort_values('MIN', ascending=0)
+    # player game log rows, formatted for the box score tables
+    def format_box(rows):
+
+        df_lgl_P_all = lgl_index().df_lgl_P_all
+        fintabl = df_lgl_P_all.iloc[rows, df_lgl_P_all.columns.get_indexer(plot_cols)]
         fintabl = fintabl.rename(columns=rename_col_d)
         pct_cols = [c for c in fintabl.columns if '%' in c]
         for pct_col in pct_cols:
             fintabl[pct_col] = (fintabl[pct_col]*100).round(0)
 
-        return render.DataGrid(fintabl)
+        return fintabl
 
     @render.data_frame 
+    @tracked
+    def away_box():
+        
+        return render.DataGrid(format_box(game_box()[0]))
+
+    @render.data_frame 
+    @tracked
     def home_box():
         
-        g_id = input.game_id()         
+        return render.DataGrid(format_box(game_box()[1]))
 
-        df_box_game = df_lgl_P_all[df_lgl_P_all['GAME_ID'] == g_id]
-        df_box_home = df_box_game[df_box_game.MATCHUP.str.contains('vs.')]
-        fintabl = df_box_home[plot_cols].sort_values('MIN', ascending=0)
-        fintabl = fintabl.rename(columns = rename_col_d)
-        pct_cols = [c for c in fintabl.columns if '%' in c]
-        for pct_col in pct_cols:
-            fintabl[pct_col] = (fintabl[pct_col]*100).round(0)
+    # games (over all seasons) whose away - home margin played out
+    # most like the selected game's (see similarity_utils.py),
+    # only searching the margin matrices saved nightly
+    @render.data_frame
+    @tracked
+    def similar_games():
+
+        similar_games = find_similar_games(input.game_id(), build_missing=False)
+        idx = lgl_index()
+
+        df_similar = pd.DataFrame([{'DATE': idx.game_dates[idx.away_rows[g_id]],
+                                    'MATCHUP': idx.matchups[idx.away_rows[g_id]],
+                                    'SEASON': g_season_str,
+                                    'SEASON TYPE': g_season_type,
+                                    'MARGIN DIFF (PTS)': round(float(dist), 1),
+                                    'HOME/AWAY FLIPPED': 'yes' if flipped else ''}
+                                   for g_id, g_season_str, g_season_type, dist, flipped in similar_games
+                                   if g_id in idx.away_rows])
+
+        return render.DataGrid(df_similar)
+
+    # playoff series of the season picked in the series view
+    @reactive.calc
+    @tracked
+    def season_series():
+
+        return get_playoff_series(lgls()[0], input.series_season_str())
+
+    @reactive.effect
+    def _():
+
+        df_series = season_series()
+        ui.update_selectize('series_id',
+                            choices={df_series['series_id'].iloc[i]: df_series['series_str'].iloc[i]
+                                     for i in range(len(df_series))})
+
+    # every game of the series side by side,
+    # drawn in parallel worker processes (see series_utils.py),
+    # which are waited on in a thread, outside of shiny's reactive flush
+    # (like the plot, see plot_task)
+    @reactive.extended_task
+    async def series_task(season_str, series, stint_val, cmap_name):
+
+        if series is None:
+            return None
+
+        return await run_in_threadpool(get_series_img, season_str, series, df_team_info,
+                                       stint_val, cmap_name, img_format)
+
+    @reactive.effect
+    def _():
+
+        # only drawn for sessions showing it
+        req(session.clientdata.output_hidden('series_plot') is False)
+
+        df_series = season_series()
+        df_series = df_series[df_series['series_id'] == input.series_id()]
+
+        stint_val = input.series_stint_val()
+        cmap_name = sequential_cmaps[0] if stint_val == 'player_pts' else diverging_cmaps[0]
+
+        with reactive.isolate():
+            season_str = input.series_season_str()
+
+        series_task.cancel()
+        series_task.invoke(season_str, df_series.iloc[0] if len(df_series) > 0 else None,
+                           stint_val, cmap_name)
+
+    @render.image(delete_file=True)
+    @tracked
+    def series_plot():
+
+        img = series_task.result()
+
+        if img is not None:
+            return {'src': write_img_file(img, img_format),
+                    'width': '100%',
+                    'style': 'height: auto;',
+                    'alt': 'series_plot'}
+
+        return None
+
+    # season leaderboards of stint stats, read from the aggregates
+    # updated nightly (see leaderboard_utils.py), and only those:
+    # aggregating a season's game rotations takes seconds
+    @render.text
+    def leaderboard_note():
+
+        if not has_leaderboard(input.lb_season_str(), input.lb_season_type()):
+            return 'No leaderboards available for this season yet.'
+        return ''
+
+    @render.data_frame
+    @tracked
+    def leaderboard():
+
+        level = input.lb_level()
+        df_lb = get_leaderboard(input.lb_season_str(), input.lb_season_type(), level, build_missing=False)
+        if df_lb is None:
+            return render.DataGrid(pd.DataFrame(), width='100%')
+
+        df_lb = df_lb[df_lb['games'] >= (input.lb_min_games() or 1)]
+
+        team_abbrs = df_team_info.set_index('TEAM_ID')['TEAM_ABBREVIATION']
+        df_show = pd.DataFrame({'TEAM': team_abbrs.reindex(df_lb['TEAM_ID']).values})
+        if level == 'players':
+            df_show.insert(0, 'PLAYER', df_lb['PLAYER_NAME'].values)
+        df_show['GP'] = df_lb['games'].values
+        df_show['MPG'] = df_lb['min_per_game'].round(1).values
+        df_show['STINTS/G'] = df_lb['stints_per_game'].round(1).values
+        df_show['AVG STINT (MIN)'] = df_lb['avg_stint_min'].round(1).values
+        df_show['STINT +/- PER 36'] = df_lb['pm_per36'].round(1).values
+        for q_name in ['Q1', 'Q2', 'Q3', 'Q4', 'OT']:
+            df_show[f'{q_name} MPG'] = df_lb[f'min_{q_name.lower()}_per_game'].round(1).values
+
+        return render.DataGrid(df_show, width='100%')
+
+    # shot charts, summed from the shot bins saved nightly (see shot_chart_utils.py),
+    # only read from saved bins: binning a season's play by plays takes seconds
+    @reactive.calc
+    def sc_team_id():
+
+        return df_team_info.set_index('TEAM_ABBREVIATION').loc[input.sc_team(), 'TEAM_ID']
+
+    @reactive.calc
+    def sc_has_data():
+
+        return has_shot_data(input.sc_season_str(), input.sc_season_type(), build_missing=False)
+
+    @reactive.calc
+    def sc_player_names():
+
+        return lgl_index().player_names
+
+    @reactive.effect
+    def _():
+
+        # only listed for sessions showing the shot chart
+        req(session.clientdata.output_hidden('shot_chart') is False)
+
+        choices = {}
+        if sc_has_data():
+            df_shooters = get_shooters(input.sc_season_str(), input.sc_season_type(), sc_team_id(),
+                                       build_missing=False)
+            names = sc_player_names().reindex(df_shooters['player_id']).fillna('').values
+            choices = {str(p_id): f'{name} ({n} FGA)'
+                       for p_id, name, n in zip(df_shooters['player_id'], names, df_shooters['attempts'])}
+        ui.update_selectize('sc_player', choices=choices)
+
+    # the team's games, most recent first, as game_id -> label
+    @reactive.calc
+    @tracked
+    def sc_team_games():
+
+        return lgl_index().get_team_games(input.sc_season_str(), input.sc_season_type(), sc_team_id())
+
+    @reactive.effect
+    def _():
+
+        ui.update_selectize('sc_game_id', choices=sc_team_games())
+
+    @render.text
+    def shot_chart_note():
+
+        if not sc_has_data():
+            return 'No shot locations available for this season yet.'
+        if input.sc_level() == 'game' and input.sc_game_id():
+            attempts, _ = get_shot_chart(input.sc_season_str(), input.sc_season_type(), game_id=input.sc_game_id(),
+                                         build_missing=False)
+            if attempts.sum() == 0:
+                return 'No shot locations available for this game.'
+        return ''
+
+    # the chart is drawn under the render lock, so it's drawn in a thread,
+    # outside of shiny's reactive flush (like the plot, see plot_task)
+    @reactive.extended_task
+    async def shot_chart_task(attempts, makes, title):
+
+        if attempts is None:
+            return None
+
+        def draw_img():
+            # matplotlib work is serialized between sessions (see game_cache.py)
+            with render_lock:
+                return draw_shot_chart(attempts, makes, title, fmt=img_format)
+
+        return await run_in_threadpool(draw_img)
+
+    @reactive.effect
+    def _():
+
+        # only drawn for sessions showing it
+        req(session.clientdata.output_hidden('shot_chart') is False)
+
+        season_str, season_type, level = input.sc_season_str(), input.sc_season_type(), input.sc_level()
+        season_label = '{} {}'.format(season_str, {'Regular Season': 'regular season', 'PlayIn': 'play-in',
+                                                   'Playoffs': 'playoffs'}[season_type])
+
+        attempts, makes, title = None, None, None
+        if not sc_has_data():
+            pass
+        elif level == 'player':
+            if input.sc_player():
+                attempts, makes = get_shot_chart(season_str, season_type, player_id=input.sc_player(),
+                                                 build_missing=False)
+                title = '{}, {}'.format(sc_player_names().get(int(input.sc_player()), ''), season_label)
+        elif level == 'game':
+            if input.sc_game_id():
+                attempts, makes = get_shot_chart(season_str, season_type, game_id=input.sc_game_id(),
+                                                 team_id=sc_team_id(), build_missing=False)
+                title = '{}, {}'.format(input.sc_team(), sc_team_games().get(input.sc_game_id(), ''))
+        else:
+            attempts, makes = get_shot_chart(season_str, season_type, team_id=sc_team_id(), build_missing=False)
+            title = '{}, {}'.format(input.sc_team(), season_label)
+
+        shot_chart_task.cancel()
+        shot_chart_task.invoke(attempts, makes, title)
+
+    @render.image(delete_file=True)
+    @tracked
+    def shot_chart():
+
+        img = shot_chart_task.result()
+
+        if img is not None:
+            return {'src': write_img_file(img, img_format),
+                    'width': '100%',
+                    'style': 'max-width: 600px; height: auto;',
+                    'alt': 'shot_chart'}
+
+        return None
+
+    # a player's season of stints, from the stint index updated nightly
+    # (see player_stint_utils.py), with the team's players by games played
+    @reactive.effect
+    def _():
+
+        team_id = df_team_info.set_index('TEAM_ABBREVIATION').loc[input.ps_team(), 'TEAM_ID']
+        df_players = get_stint_players(input.ps_season_str(), input.ps_season_type(), team_id)
+        names = lgl_index().player_names.reindex(df_players['person_id']).fillna('').values
+        ui.update_selectize('ps_player',
+                            choices={str(p_id): f'{name} ({n} games)'
+                                     for p_id, name, n in zip(df_players['person_id'], names, df_players['games'])})
+
+    # drawn in a thread, outside of shiny's reactive flush, like the shot chart
+    @reactive.extended_task
+    async def player_stints_task(stints, game_labels, title, stint_val):
+
+        if stints is None:
+            return None
+
+        def draw_img():
+            # matplotlib work is serialized between sessions (see game_cache.py)
+            with render_lock:
+                return draw_player_stints(stints, game_labels, title, stint_val, fmt=img_format)
+
+        return await run_in_threadpool(draw_img)
+
+    @reactive.effect
+    def _():
+
+        # only drawn for sessions showing it
+        req(session.clientdata.output_hidden('player_stints_plot') is False)
+
+        stints, game_labels, title = None, None, None
+        season_str, season_type = input.ps_season_str(), input.ps_season_type()
+
+        if input.ps_player():
+            stints = get_player_stints(season_str, season_type, input.ps_player())
+
+            if len(stints['game_id']) > 0:
+                # games labeled by date and matchup, in date order
+                idx = lgl_index()
+                rows = sorted((idx.game_dates[idx.away_rows[g_id]], idx.away_rows[g_id])
+                              for g_id in np.unique(stints['game_id']) if g_id in idx.away_rows)
+                game_labels = {idx.game_ids[row]: idx.gallery_strs[row] for _, row in rows}
+                season_label = '{} {}'.format(season_str, {'Regular Season': 'regular season', 'PlayIn': 'play-in',
+                                                           'Playoffs': 'playoffs'}[season_type])
+                title = '{}, {}'.format(idx.player_names.get(int(input.ps_player()), ''), season_label)
+            else:
+                stints = None
+
+        player_stints_task.cancel()
+        player_stints_task.invoke(stints, game_labels, title, input.ps_stint_val())
+
+    @render.image(delete_file=True)
+    @tracked
+    def player_stints_plot():
+
+        img = player_stints_task.result()
+
+        if img is not None:
+            return {'src': write_img_file(img, img_format),
+                    'width': '100%',
+                    'style': 'max-width: 900px; height: auto;',
+                    'alt': 'player_stints_plot'}
+
+        return None
 
-        return render.DataGrid(fintabl)
-        
     @render.text 
     def lastupdatetxt():
-        last_date = df_lgl_T_all['GAME_DATE'].max()
+        last_date = lgl_index().last_date
         output_str = f'Games through: {last_date}'
         return output_str
   
-app = App(app_ui, server)
+# matplotlib is loaded (off screen) in the background once the app is up, rather than on import
+use_offscreen_backend()
+start_warm_up()
+
+# the shiny app, along with a plain HTTP endpoint for plot images
+app = Starlette(routes=[make_rotation_route(lambda: get_cur_lgls()[0], df_team_info),
+                        make_sparkline_route(),
+                        make_memory_route(),
+                        make_quality_route(),
+                        Mount('/', app=App(app_ui, server))])
@@ -0,0 +1,123 @@
+"""
+Reports where the app's cold start time goes, i.e.
+
+    python cold_start.py
+    python cold_start.py --budget-secs 2.5
+
+In fresh python processes, measures importing the app with python -X importtime
+(without the background matplotlib warm-up, which would be mixed in),
+summarized by top-level package (the app's own modules' time includes
+loading the season data), and the time until the first plot is ready
+when one is asked for right after the app is imported, with and without
+the warm-up (see game_cache.start_warm_up), and when the first user
+shows up a little later, once the warm-up is done.
+
+Exits with status 1 if the first plot takes longer than the cold start budget
+(from launching python), so it can be checked automatically.
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+from load_data_utils import season_strs
+
+
+# seconds from launching python until the first plot is ready
+cold_start_budget_secs = float(os.environ.get('ROTATION_COLD_START_BUDGET', 3))
+
+app_dir = os.path.dirname(os.path.abspath(__file__))
+
+# run in a fresh process: import the app, then make a plot (after wait_secs)
+first_plot_code = '''
+import json, time
+t_start = time.perf_counter()
+import app
+t_import = time.perf_counter()
+time.sleep({wait_secs})
+t_request = time.perf_counter()
+from game_cache import get_cached_img
+from img_utils import img_format
+df_lgl_T_all, _ = app.get_cur_lgls()
+game_info = df_lgl_T_all[(df_lgl_T_all['season_str'] == {season_str!r}) &
+                         (df_lgl_T_all['season_type'] == {season_type!r})].iloc[0]
+img = get_cached_img({season_str!r}, {season_type!r}, game_info, app.df_team_info,
+                     (True, 'pm', 'RdBu_r'), (1200, 800, 1), img_format)
+t_plot = time.perf_counter()
+print(json.dumps({{'import_secs': t_import - t_start, 'first_plot_secs': t_plot - t_request}}))
+'''
+
+
+def get_import_times():
+    '''
+    Imports the app in a fresh process with python -X importtime,
+    returning the total import time, and the time spent in
+    each top-level package's modules (their self times, in seconds)
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                          cwd=app_dir, capture_output=True, text=True, check=True,
+                          env={**os.environ, 'ROTATION_WARM_UP': '0'})
+
+    package_secs = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)', line)
+        if match is not None:
+            self_us, module = match.groups()
+            package = module.split('.')[0]
+            package_secs[package] = package_secs.get(package, 0) + int(self_us)/1e6
+
+    total_secs = sum(package_secs.values())
+
+    return total_secs, dict(sorted(package_secs.items(), key=lambda x: -x[1]))
+
+def get_first_plot_times(season_str, season_type='Playoffs', warm_up=True, wait_secs=0):
+    '''
+    In a fresh process, imports the app and asks for a plot wait_secs later,
+    returning the time from launching python until the app was imported,
+    and from asking for the first plot until it was ready (in seconds)
+    '''
+    code = first_plot_code.format(season_str=season_str, season_type=season_type, wait_secs=wait_secs)
+    proc = subprocess.run([sys.executable, '-c', code],
+                          cwd=app_dir, capture_output=True, text=True, check=True,
+                          env={**os.environ, 'ROTATION_WARM_UP': '1' if warm_up else '0'})
+
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Report where the cold start time of the app goes')
+    parser.add_argument('--budget-secs', type=float, default=cold_start_budget_secs)
+    parser.add_argument('--season-str', default=season_strs[0])
+    parser.add_argument('--season-type', default='Playoffs')
+    parser.add_argument('--n-packages', type=int, default=12)
+    parser.add_argument('--user-wait-secs', type=float, default=2,
+                        help='how long after the app starts the first user asks for a plot')
+    args = parser.parse_args()
+
+    total_secs, package_secs = get_import_times()
+    print('importing the app: {:.2f} s'.format(total_secs))
+    for package, secs in list(package_secs.items())[:args.n_packages]:
+        print('  {:<24} {:>6.3f} s'.format(package, secs))
+
+    # the budget is checked against the app as it runs (with the warm-up)
+    for warm_up in [False, True]:
+        times = get_first_plot_times(args.season_str, args.season_type, warm_up)
+        cold_start_secs = times['import_secs'] + times['first_plot_secs']
+        print('first plot right away ({} warm-up): {:.2f} s import + {:.2f} s plot = {:.2f} s'.format(
+            'with' if warm_up else 'without', times['import_secs'], times['first_plot_secs'],
+            cold_start_secs))
+
+    for warm_up in [False, True]:
+        times = get_first_plot_times(args.season_str, args.season_type, warm_up, args.user_wait_secs)
+        print('first plot {:.0f} s after starting ({} warm-up): {:.2f} s'.format(
+            args.user_wait_secs, 'with' if warm_up else 'without', times['first_plot_secs']))
+
+    print('cold start budget: {:.2f} s'.format(args.budget_secs))
+
+    if cold_start_secs > args.budget_secs:
+        print('over the cold start budget')
+        sys.exit(1)
@@ -0,0 +1,126 @@
+"""
+Record/replay cache of nba_api responses (LeagueGameLog, PlayByPlayV2, GameRotation),
+so that the saved data can be re-derived (i.e. after changing how
+pull_and_save_df_grs assigns h_a) without hitting nba.com again,
+and so that the pulling code can be run against recorded responses, offline.
+
+Each response is saved, gzipped, as
+    {cache_dir}/{endpoint}/{hash of the request parameters}.json.gz
+holding the endpoint, parameters, url, time recorded and the raw response.
+
+The NBA_API_CACHE environment variable picks the mode:
+ - record (default): always request from nba.com, saving each response
+ - replay: use the saved response if there is one, otherwise request and save it
+ - offline: only use saved responses (a missing one raises an error)
+ - off: always request from nba.com, saving nothing
+and NBA_API_CACHE_DIR where the responses are saved (default data/api_cache/).
+
+Requests to nba.com are spaced at least min_request_secs apart (between all threads),
+while saved responses are read at disk speed. Responses are written atomically,
+so several processes can record into / replay from the same cache.
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+import datetime
+from nba_api.stats.library.http import NBAStatsResponse
+
+cache_modes = ['record', 'replay', 'offline', 'off']
+
+cache_mode = os.environ.get('NBA_API_CACHE', 'record')
+cache_dir = os.environ.get('NBA_API_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_cache/'))
+
+# least time between requests to nba.com
+min_request_secs = 0.6
+
+_last_request_time = 0
+_request_lock = threading.Lock()
+
+
+def get_response_path(endpoint, parameters, data_dir=None):
+    '''
+    Path of the saved response of an endpoint requested with parameters
+    '''
+    param_str = json.dumps(sorted(parameters.items()), default=str)
+    param_hash = hashlib.sha1(param_str.encode()).hexdigest()[:20]
+    return os.path.join(data_dir or cache_dir, endpoint.lower(), f'{param_hash}.json.gz')
+
+def load_response(fpath):
+    '''
+    Loads a saved response (see get_response_path), returning its
+    record (endpoint, parameters, url, status_code, recorded, response)
+    '''
+    with gzip.open(fpath, 'rt') as f:
+        return json.load(f)
+
+def save_response(fpath, endpoint, parameters, nba_response):
+    '''
+    Saves the raw response of an endpoint requested with parameters
+    '''
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+
+    record = {'endpoint': endpoint,
+              'parameters': parameters,
+              'url': nba_response.get_url(),
+              'status_code': nba_response._status_code,
+              'recorded': datetime.datetime.now().isoformat(timespec='seconds'),
+              'response': nba_response.get_response()}
+
+    # readers never see a half written response
+    fpath_tmp = f'{fpath}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with gzip.open(fpath_tmp, 'wt') as f:
+        json.dump(record, f)
+    os.replace(fpath_tmp, fpath)
+
+def wait_for_request_slot():
+    '''
+    Waits until at least min_request_secs have passed since the last request to nba.com
+    '''
+    global _last_request_time
+    with _request_lock:
+        wait_secs = _last_request_time + min_request_secs - time.monotonic()
+        if wait_secs > 0:
+            time.sleep(wait_secs)
+        _last_request_time = time.monotonic()
+
+def request_endpoint(endpoint_class, mode=None, data_dir=None, **kwargs):
+    '''
+    Requests an nba_api endpoint through the cache, i.e.
+        request_endpoint(playbyplayv2.PlayByPlayV2, game_id=game_id).get_data_frames()[0]
+    in place of
+        playbyplayv2.PlayByPlayV2(game_id=game_id).get_data_frames()[0]
+    with the cache mode and directory defaulting to cache_mode and cache_dir
+    (see the top of this file). Returns the endpoint object.
+    '''
+    mode = mode or cache_mode
+    if mode not in cache_modes:
+        raise ValueError(f'unknown nba_api cache mode {mode}, should be one of {cache_modes}')
+
+    endpoint = endpoint_class(**kwargs, get_request=False)
+    fpath = get_response_path(endpoint.endpoint, endpoint.parameters, data_dir)
+
+    if mode in ['replay', 'offline'] and os.path.exists(fpath):
+        record = load_response(fpath)
+        endpoint.nba_response = NBAStatsResponse(response=record['response'],
+                                                 status_code=record['status_code'],
+                                                 url=record['url'])
+        endpoint.load_response()
+        return endpoint
+
+    if mode == 'offline':
+        raise FileNotFoundError(f'no saved {endpoint.endpoint} response for {endpoint.parameters} '
+                                f'(looked for {fpath})')
+
+    wait_for_request_slot()
+    endpoint.get_request()
+
+    # get_request already failed on responses that aren't valid json
+    if mode != 'off':
+        save_response(fpath, endpoint.endpoint, endpoint.parameters, endpoint.nba_response)
+
+    return endpoint
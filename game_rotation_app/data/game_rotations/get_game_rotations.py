@@ -3,13 +3,21 @@ Code for pulling from nba_api's GameRotation endpoint for games
 of a desired season and choice of regular season / play-in / playoffs
 Warning that if you call this during a live game, you may get NaNs in the
 point differential column for each player stint
+(update_all_data.py then saves stints reconstructed from the play by play,
+see stint_utils.py in the app's directory, noted in pbp_stint_games.json,
+and those games are pulled again until GameRotation has them)
 """
 
 import os 
+import json
 import numpy as np
 import pandas as pd
 from nba_api.stats.endpoints import leaguegamelog, gamerotation
-import time
+
+# requests go through the record/replay cache of nba_api responses (see data/api_cache.py)
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)))
+from api_cache import request_endpoint
 
 def pull_and_save_df_grs(season_end_year, data_dir = './', 
                          save_files=True, overwrite=False, 
@@ -33,11 +41,12 @@ def pull_and_save_df_grs(season_end_year, data_dir = './',
         print('making season directory: {}'.format(os.path.abspath(season_dir)))
         
     
-    lgl = leaguegamelog.LeagueGameLog(league_id='00',
-                                      player_or_team_abbreviation='T',
-                                      season=season_str,
-                                      season_type_all_star=season_type,
-                                      ).get_data_frames()[0]
+    lgl = request_endpoint(leaguegamelog.LeagueGameLog,
+                           league_id='00',
+                           player_or_team_abbreviation='T',
+                           season=season_str,
+                           season_type_all_star=season_type,
+                           ).get_data_frames()[0]
     lgl_matchup = lgl[lgl.MATCHUP.str.contains('@')]
     season_game_ids = lgl_matchup['GAME_ID']
     
@@ -48,6 +57,13 @@ def pull_and_save_df_grs(season_end_year, data_dir = './',
         suffix = ' (play in)'
     
     existing_gr_files = os.listdir(os.path.abspath(season_dir))
+
+    # games saved with stints reconstructed from the play by play
+    fpath_pbp_stints = os.path.join(season_dir, 'pbp_stint_games.json')
+    pbp_stint_ids = []
+    if os.path.exists(fpath_pbp_stints):
+        with open(fpath_pbp_stints) as f:
+            pbp_stint_ids = json.load(f)
     print('~'*50)
     print('{} games played in {}{}'.format(len(lgl_matchup), season_str, suffix))
     print('{} games found in {}'.format(len(existing_gr_files), os.path.abspath(season_dir)))
@@ -61,9 +77,9 @@ def pull_and_save_df_grs(season_end_year, data_dir = './',
         # check if we already have it
         cur_fname = f'df_gr_{game_id}.csv'
     
-        if overwrite or cur_fname not in existing_gr_files:
+        if overwrite or cur_fname not in existing_gr_files or game_id in pbp_stint_ids:
                 
-            gr_res = gamerotation.GameRotation(game_id=game_id).get_data_frames()
+            gr_res = request_endpoint(gamerotation.GameRotation, game_id=game_id).get_data_frames()
             
             df_gr = pd.concat(gr_res)
             
@@ -80,8 +96,10 @@ def pull_and_save_df_grs(season_end_year, data_dir = './',
             else:
                 print(f'saving to {cur_fname}...')
                 df_gr.to_csv(os.path.join(season_dir, cur_fname))
-        
-            time.sleep(0.6)
+                if game_id in pbp_stint_ids:
+                    pbp_stint_ids.remove(game_id)
+                    with open(fpath_pbp_stints, 'w') as f:
+                        json.dump(pbp_stint_ids, f)
 
     return flagged_ids
 
@@ -1,53 +1,197 @@
 """
 Code for pulling from nba_api's LeagueGameLog endpoint for games
 of a desired season and choice of regular season / play-in / playoffs
+
+Saved game logs are sorted by GAME_DATE, so with incremental=True,
+only games from a few days before the last saved GAME_DATE on are pulled
+(the overlap picks up stat corrections), and they replace the end of the
+saved file rather than rewriting all of it.
+
+Next to each game log, an index (df_lgl_{let}_{season_str}{suffix}_idx.json) keeps
+ - date_offsets: the byte offset and row number of the first row of each GAME_DATE
+ - updates: for each time the file was written, its version, and the byte offset
+   and row number from which the file changed (0, 0 for a full rewrite)
+so that readers (see load_data_utils.LeagueGameLogStore) only need to read
+the rows that changed since they last read the file.
 """
 
 import os
-from nba_api.stats.endpoints import leaguegamelog 
+import io
+import re
+import json
+import datetime
+import pandas as pd
+from nba_api.stats.endpoints import leaguegamelog
+
+# requests go through the record/replay cache of nba_api responses (see data/api_cache.py)
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)))
+from api_cache import request_endpoint
+
+# days before the last saved game date to pull again
+overlap_days = 3
+
+# how many updates the index remembers
+max_index_updates = 100
+
+
+def get_index_path(fpath):
+    '''
+    Path of the index of a saved game log (see the top of this file)
+    '''
+    return fpath.replace('.csv', '_idx.json')
+
+def get_date_offsets(csv_bytes, start_offset=0, start_row=0):
+    '''
+    Given the bytes of game log CSV rows (without the header), sorted by GAME_DATE,
+    starting at start_offset in the file (and row number start_row),
+    returns the byte offset and row number of each date's first row
+    '''
+    date_offsets = {}
+    offset = start_offset
+    for i, line in enumerate(io.BytesIO(csv_bytes)):
+        # GAME_DATE is the only YYYY-MM-DD field in a row
+        game_date = re.search(rb'\d{4}-\d{2}-\d{2}', line).group().decode()
+        if game_date not in date_offsets:
+            date_offsets[game_date] = [offset, start_row + i]
+        offset += len(line)
+    return date_offsets
+
+def update_index(fpath, date_offsets, changed_offset, changed_row, n_rows):
+    '''
+    Updates the index of a saved game log after it was written
+    from changed_offset (row changed_row) on, with the new rows' date_offsets
+    '''
+    fpath_idx = get_index_path(fpath)
+    index = {'version': 0, 'date_offsets': {}, 'updates': []}
+    if changed_offset > 0 and os.path.exists(fpath_idx):
+        with open(fpath_idx) as f:
+            index = json.load(f)
+
+    index['version'] += 1
+    index['size'] = os.path.getsize(fpath)
+    index['n_rows'] = n_rows
+    index['date_offsets'] = {**{k: v for k, v in index['date_offsets'].items() if v[0] < changed_offset},
+                             **date_offsets}
+    index['updates'] = (index['updates'] + [{'version': index['version'],
+                                             'offset': changed_offset,
+                                             'row': changed_row}])[-max_index_updates:]
+
+    # readers never see a half written index
+    with open(fpath_idx + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(fpath_idx + '.tmp', fpath_idx)
+
+def save_full_lgl(lgl, fsave):
+    '''
+    Saves a whole game log, and rebuilds its index
+    '''
+    print(f'saving to... {fsave}')
+    lgl.to_csv(fsave)
+
+    with open(fsave, 'rb') as f:
+        header = f.readline()
+        rows = f.read()
+    update_index(fsave, get_date_offsets(rows, len(header)), 0, 0, len(lgl))
+
+def append_lgl(lgl_new, fsave, from_date):
+    '''
+    Replaces the rows of a saved game log from from_date on
+    with the newly pulled rows (lgl_new), using its index to find
+    where those rows start. Returns the number of rows in the file.
+
+    The saved rows are kept as they are if the pull has no rows,
+    or is missing any of the saved game dates it would replace
+    (an empty or partial response shouldn't delete saved games).
+    '''
+    with open(get_index_path(fsave)) as f:
+        index = json.load(f)
+
+    later_dates = sorted(d for d in index['date_offsets'] if d >= from_date)
+    missing_dates = sorted(set(later_dates) - set(lgl_new['GAME_DATE'])) if len(lgl_new) > 0 else later_dates
+    if len(lgl_new) == 0 or len(missing_dates) > 0:
+        print(f'keeping {fsave} as it is: the pull from {from_date} has {len(lgl_new)} rows'
+              f'{", missing saved dates " + ", ".join(missing_dates) if len(missing_dates) > 0 else ""}')
+        return index['n_rows']
+
+    # the first saved row on or after from_date (or the end of the file)
+    if len(later_dates) > 0:
+        changed_offset, changed_row = index['date_offsets'][later_dates[0]]
+    else:
+        changed_offset, changed_row = index['size'], index['n_rows']
+
+    lgl_new = lgl_new.set_axis(range(changed_row, changed_row + len(lgl_new)))
+    rows = lgl_new.to_csv(header=False).encode()
+
+    print(f'replacing {index["n_rows"] - changed_row} rows with {len(lgl_new)} from {from_date} in... {fsave}')
+    with open(fsave, 'r+b') as f:
+        f.truncate(changed_offset)
+        f.seek(changed_offset)
+        f.write(rows)
+
+    n_rows = changed_row + len(lgl_new)
+    update_index(fsave, get_date_offsets(rows, changed_offset, changed_row), changed_offset, changed_row, n_rows)
+    return n_rows
 
-def pull_and_save_df_lgl(season_end_year, 
-                         data_dir='data/lgls/', 
-                         let='T', 
+def pull_and_save_df_lgl(season_end_year,
+                         data_dir='data/lgls/',
+                         let='T',
                          overwrite=True,
-                         season_type='Regular Season'):
+                         season_type='Regular Season',
+                         incremental=False):
+
 
-    
     season_str = '{}-{}'.format(season_end_year-1, str(season_end_year)[-2:])
-    
+
     if not os.path.isdir(data_dir):
         os.makedirs(data_dir)
         print('making data directory: {}'.format(os.path.abspath(data_dir)))
-        
-   
-    
-    lgl = leaguegamelog.LeagueGameLog(league_id='00',
-                                      player_or_team_abbreviation=let,
-                                      season=season_str,
-                                      season_type_all_star=season_type,
-                                      ).get_data_frames()[0]
-    
-        
-    
-    if let == 'T':
-        lgl = lgl.sort_values(['GAME_DATE', 'GAME_ID', 'TEAM_ID']).reset_index(drop=True)
-    else:
-        lgl = lgl.sort_values(['GAME_DATE', 'GAME_ID', 'TEAM_ID', 'PLAYER_ID']).reset_index(drop=True)
-        
-        
-    suffix = '' 
+
+    suffix = ''
     if season_type == 'Playoffs':
         suffix = '_po'
     elif season_type == 'PlayIn':
         suffix = '_pi'
-        
+
     fsave = os.path.join(data_dir, 'df_lgl_{}_{}{}.csv'.format(let, season_str, suffix))
+
+    # only pull games since a little before the last saved game
+    date_from = None
+    if incremental and os.path.exists(fsave):
+        if not os.path.exists(get_index_path(fsave)):
+            with open(fsave, 'rb') as f:
+                header = f.readline()
+                rows = f.read()
+            update_index(fsave, get_date_offsets(rows, len(header)), 0, 0, rows.count(b'\n'))
+        with open(get_index_path(fsave)) as f:
+            saved_dates = list(json.load(f)['date_offsets'])
+        if len(saved_dates) > 0:
+            date_from = (datetime.date.fromisoformat(max(saved_dates)) -
+                         datetime.timedelta(days=overlap_days)).isoformat()
+
+    lgl = request_endpoint(leaguegamelog.LeagueGameLog,
+                           league_id='00',
+                           player_or_team_abbreviation=let,
+                           season=season_str,
+                           season_type_all_star=season_type,
+                           date_from_nullable=('' if date_from is None else
+                                               pd.to_datetime(date_from).strftime('%m/%d/%Y')),
+                           ).get_data_frames()[0]
+
+
+
+    if let == 'T':
+        lgl = lgl.sort_values(['GAME_DATE', 'GAME_ID', 'TEAM_ID']).reset_index(drop=True)
+    else:
+        lgl = lgl.sort_values(['GAME_DATE', 'GAME_ID', 'TEAM_ID', 'PLAYER_ID']).reset_index(drop=True)
+
     if overwrite:
-        print(f'saving to... {fsave}')
-        lgl.to_csv(fsave)
-    
-    return lgl
+        if date_from is not None:
+            append_lgl(lgl, fsave, date_from)
+        else:
+            save_full_lgl(lgl, fsave)
 
+    return lgl
 
 
 if __name__ == '__main__':
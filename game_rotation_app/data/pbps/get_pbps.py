@@ -5,7 +5,11 @@ of a desired season and choice of regular season / play-in / playoffs
 
 import os 
 from nba_api.stats.endpoints import leaguegamelog, playbyplayv2
-import time
+
+# requests go through the record/replay cache of nba_api responses (see data/api_cache.py)
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)))
+from api_cache import request_endpoint
 
 
 
@@ -33,11 +37,12 @@ def pull_and_save_df_pbps(season_end_year, subset=[],
         print('making season directory: {}'.format(os.path.abspath(season_dir)))
         
     
-    lgl = leaguegamelog.LeagueGameLog(league_id='00',
-                                      player_or_team_abbreviation='T',
-                                      season=season_str,
-                                      season_type_all_star=season_type,
-                                      ).get_data_frames()[0]
+    lgl = request_endpoint(leaguegamelog.LeagueGameLog,
+                           league_id='00',
+                           player_or_team_abbreviation='T',
+                           season=season_str,
+                           season_type_all_star=season_type,
+                           ).get_data_frames()[0]
     lgl_matchup = lgl[lgl.MATCHUP.str.contains('@')]
     season_game_ids = lgl_matchup['GAME_ID']
     
@@ -64,15 +69,13 @@ def pull_and_save_df_pbps(season_end_year, subset=[],
     
         if overwrite or cur_fname not in existing_gr_files:
                 
-            df_pbp = playbyplayv2.PlayByPlayV2(game_id=game_id).get_data_frames()[0]
+            df_pbp = request_endpoint(playbyplayv2.PlayByPlayV2, game_id=game_id).get_data_frames()[0]
             
             print(f'saving to {cur_fname}...')
             df_pbp.to_csv(os.path.join(season_dir, cur_fname))
             
             if return_dfs:
                 df_pbps_to_return.append(df_pbp)
-    
-            time.sleep(0.6)
 
     return df_pbps_to_return
 
@@ -7,6 +7,10 @@ I use crontab to run this script once a day, in the deep of night,
 so that the information is complete
 (if you call GameRotation while a game is still live, you may not get
      all the player stint point differentials)
+
+Every nba_api response is saved by the record/replay cache (see api_cache.py),
+so running it with NBA_API_CACHE=replay (or offline) re-derives the saved
+data from the recorded responses instead of pulling them again.
 """
 
 import os
@@ -18,27 +22,77 @@ from lgls.get_lgls import pull_and_save_df_lgl
 from pbps.get_pbps import pull_and_save_df_pbps
 from game_rotations.get_game_rotations import pull_and_save_df_grs
 
+# the app's own loaders build the derived data (from the app's directory)
+import sys
+app_dir = os.path.abspath(os.path.join(file_dir, os.pardir))
+sys.path.append(app_dir)
+from load_data_utils import get_season_suffix, get_lgls
+from similarity_utils import save_margin_matrix
+from stint_utils import save_pbp_stints
+from sparkline_utils import save_sprite_sheet
+from leaderboard_utils import update_leaderboards
+from game_search_utils import save_game_features
+from dim_utils import normalize_season_data
+from shot_chart_utils import update_shot_bins
+from player_stint_utils import update_player_stints
+import pandas as pd
+
 season_end_year = 2024
 
 season_types = ['Regular Season', 'PlayIn', 'Playoffs']
 
+# games whose GameRotation came back with NaN point differentials
+flagged_gameids = {}
+
 for season_type in season_types:
     
     pull_and_save_df_lgl(season_end_year, 
                          data_dir=os.path.join(file_dir, 'lgls/'),
                          let='T',
                          overwrite=True,
-                         season_type=season_type)
+                         season_type=season_type,
+                         incremental=True)
     pull_and_save_df_lgl(season_end_year, 
                          data_dir=os.path.join(file_dir, 'lgls/'),
                          let='P',
                          overwrite=True,
-                         season_type=season_type)
+                         season_type=season_type,
+                         incremental=True)
     pull_and_save_df_pbps(season_end_year, 
                           data_dir=os.path.join(file_dir, 'pbps/'), 
                           overwrite=False,
                           season_type=season_type)
-    flagged_gameids = pull_and_save_df_grs(season_end_year, 
-                                           data_dir = os.path.join(file_dir, 'game_rotations/'), 
-                                           overwrite=False,
-                                           season_type=season_type)
\ No newline at end of file
+    flagged_gameids[season_type] = pull_and_save_df_grs(season_end_year, 
+                                                        data_dir = os.path.join(file_dir, 'game_rotations/'), 
+                                                        overwrite=False,
+                                                        season_type=season_type)
+
+# derived data the app precomputes from what was just pulled
+os.chdir(app_dir)
+season_str = '{}-{}'.format(season_end_year - 1, str(season_end_year)[2:])
+df_lgl_T_season, _ = get_lgls([season_str])
+df_team_info = pd.read_csv('data/df_team_info.csv')
+
+for season_type in season_types:
+
+    # fill in flagged games with stints from their play by plays, until GameRotation has them
+    if len(flagged_gameids[season_type]) > 0:
+        save_pbp_stints(season_str, season_type, flagged_gameids[season_type])
+
+    # factor the names out of the night's new files (into the player and team dimension tables)
+    normalize_season_data(season_str, season_type)
+
+    if os.path.isdir(os.path.join(file_dir, 'pbps/{}{}'.format(season_str, get_season_suffix(season_type)))):
+        save_margin_matrix(season_str, season_type)
+        save_game_features(season_str, season_type)
+        save_sprite_sheet(season_str, season_type,
+                          df_lgl_T_season[df_lgl_T_season['season_type'] == season_type], df_team_info)
+
+    # fold the night's new games into the season leaderboards,
+    # and the index of each player's stints
+    if os.path.isdir(os.path.join(file_dir, 'game_rotations/{}{}'.format(season_str, get_season_suffix(season_type)))):
+        update_leaderboards(season_str, season_type)
+        update_player_stints(season_str, season_type)
+
+    # bin the shots of the new pbpstats play by plays, for the shot charts
+    update_shot_bins(season_str, season_type)
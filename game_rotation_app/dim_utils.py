@@ -0,0 +1,201 @@
+'''
+Utility functions for the player and team dimension tables.
+
+Every saved play by play repeats its players' names and their teams' city,
+nickname and abbreviation on each event (PLAYER1_NAME, PLAYER1_TEAM_CITY, ...),
+and every saved game rotation repeats each stint's team and player names
+(TEAM_CITY, TEAM_NAME, PLAYER_FIRST, PLAYER_LAST).
+These are factored out into two shared dimension tables, keyed by id:
+    data/dims/df_players.csv (PERSON_ID, PLAYER_NAME, PLAYER_FIRST, PLAYER_LAST)
+    data/dims/df_teams.csv (TEAM_ID, TEAM_CITY, TEAM_NICKNAME, TEAM_ABBREVIATION, TEAM_CITY_GR)
+and dropped from the saved game files, which the loaders join back in
+only when the names are asked for (see load_data_utils.join_names).
+
+The pulling scripts save full files, and normalize_season_data
+(called by data/update_all_data.py) then folds their names into the dimension tables
+and rewrites them without their names. A name already in a dimension table
+is never changed (names only get filled in), and a file is only rewritten
+if joining the dimension tables back gives exactly its names,
+otherwise it's kept as it is (the loaders read both).
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+from load_data_utils import (dims_dir, dim_id_cols, name_columns, get_dim_fpath,
+                             get_game_fpaths, season_strs, season_type_suffixes)
+
+
+# source -> (data subdirectory, file prefix) of its saved game files
+game_file_sources = {'pbp': ('pbps', 'df_pbp_'),
+                     'gr': ('game_rotations', 'df_gr_')}
+
+
+def read_dims(data_dir=dims_dir):
+    '''
+    Reads the saved dimension tables as strings ('' for missing names),
+    indexed by (integer) id, with empty tables for those not saved yet
+    '''
+    dims = {}
+    for dim, id_col in dim_id_cols.items():
+        fpath = get_dim_fpath(dim, data_dir)
+        if os.path.exists(fpath):
+            dims[dim] = pd.read_csv(fpath, index_col=id_col, dtype=str, keep_default_na=False)
+            dims[dim].index = dims[dim].index.astype('int64')
+        else:
+            dims[dim] = pd.DataFrame(index=pd.Index([], dtype='int64', name=id_col))
+    return dims
+
+def write_csv(df, fpath, **kwargs):
+    '''
+    Saves a dataframe as a csv, atomically (readers never see a half written file)
+    '''
+    fpath_tmp = f'{fpath}.{os.getpid()}.tmp'
+    df.to_csv(fpath_tmp, **kwargs)
+    os.replace(fpath_tmp, fpath)
+
+def save_dims(dims, data_dir=dims_dir):
+    '''
+    Saves the dimension tables (see read_dims)
+    '''
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+        print('making data directory: {}'.format(os.path.abspath(data_dir)))
+
+    for dim, df_dim in dims.items():
+        write_csv(df_dim.sort_index(), get_dim_fpath(dim, data_dir))
+
+def get_id_keys(ids):
+    '''
+    Given a column of ids read as strings (i.e. '1610612754.0', '' for missing),
+    returns them as a float series (NaN for missing), to look up in the dimension tables
+    '''
+    return pd.to_numeric(ids.replace('', np.nan), errors='coerce')
+
+def read_game_file(fpath):
+    '''
+    Reads a saved game file as strings ('' for missing values),
+    exactly as written
+    '''
+    return pd.read_csv(fpath, index_col=0, dtype=str, keep_default_na=False)
+
+def has_names(fpath, source):
+    '''
+    Whether a saved game file of a source (pbp or gr) still has its name columns
+    '''
+    with open(fpath) as f:
+        header = f.readline().rstrip('\n').split(',')
+    return any(col in header for _, _, names in name_columns[source] for col in names)
+
+def update_dims(dims, dfs, source):
+    '''
+    Fills in the dimension tables with the names in game dataframes
+    of a source (pbp or gr), read with read_game_file.
+    Names already in the tables are kept.
+    '''
+    d_dim_names = {dim: [] for dim in dims}
+    for df in dfs:
+        for id_col, dim, names in name_columns[source]:
+            if id_col not in df.columns:
+                continue
+            keys = get_id_keys(df[id_col])
+            df_names = df[[col for col in names if col in df.columns]].rename(columns=names)
+            df_names.index = keys.values
+            d_dim_names[dim].append(df_names[keys.notna().values].drop_duplicates())
+
+    for dim, l_names in d_dim_names.items():
+        if len(l_names) == 0:
+            continue
+        df_names = pd.concat(l_names)
+        df_names.index = df_names.index.astype('int64')
+
+        df_dim = dims[dim].reindex(dims[dim].index.union(df_names.index.unique()))
+        for dim_col in df_names.columns:
+            # the first name seen for each id
+            values = df_names[dim_col][df_names[dim_col] != '']
+            values = values[~values.index.duplicated()]
+
+            cur_values = df_dim[dim_col].fillna('') if dim_col in df_dim.columns else pd.Series('', index=df_dim.index)
+            cur_values.loc[values.index] = cur_values.loc[values.index].where(cur_values.loc[values.index] != '', values)
+            df_dim[dim_col] = cur_values
+
+        dims[dim] = df_dim.fillna('').rename_axis(dim_id_cols[dim])
+
+def normalize_game_df(df, source, dims):
+    '''
+    Given a game dataframe of a source (pbp or gr), read with read_game_file,
+    returns it without its name columns, or None if joining the
+    dimension tables back wouldn't give exactly its names
+    '''
+    name_cols = []
+    for id_col, dim, names in name_columns[source]:
+        for col, dim_col in names.items():
+            if col not in df.columns:
+                continue
+            if id_col not in df.columns or dim_col not in dims[dim].columns:
+                return None
+            joined = get_id_keys(df[id_col]).map(dims[dim][dim_col]).fillna('')
+            if not np.array_equal(joined.values, df[col].values):
+                return None
+            name_cols.append(col)
+
+    return df.drop(columns=name_cols)
+
+def normalize_season_data(season_str, season_type='Regular Season', data_dir=dims_dir):
+    '''
+    Given a season string (i.e. 2023-24), folds the names of its saved play by play
+    and game rotation files that still have them into the dimension tables,
+    then rewrites those files without them (see the top of this file),
+    with the dimension tables in data_dir.
+    Returns the number of files rewritten.
+    '''
+    fpaths = {}
+    for source, (data_subdir, fprefix) in game_file_sources.items():
+        fpaths[source] = [fpath for fpath in get_game_fpaths(data_subdir, fprefix, season_str,
+                                                             season_type=season_type).values()
+                          if has_names(fpath, source)]
+    if all(len(source_fpaths) == 0 for source_fpaths in fpaths.values()):
+        return 0
+
+    # the dimension tables are saved before any file loses its names
+    dims = read_dims(data_dir)
+    for source, source_fpaths in fpaths.items():
+        update_dims(dims, map(read_game_file, source_fpaths), source)
+    save_dims(dims, data_dir)
+
+    n_normalized = 0
+    for source, source_fpaths in fpaths.items():
+        for fpath in source_fpaths:
+            df_normalized = normalize_game_df(read_game_file(fpath), source, dims)
+            if df_normalized is None:
+                print(f'keeping the names of {fpath} (they differ from the dimension tables)')
+                continue
+            write_csv(df_normalized, fpath)
+            n_normalized += 1
+
+    return n_normalized
+
+
+if __name__ == '__main__':
+
+    # normalizes every saved season (i.e. after first adding the dimension tables)
+    import time
+
+    def get_dir_size(data_subdir):
+        return sum(os.path.getsize(os.path.join(root, fname))
+                   for root, _, fnames in os.walk(os.path.join('data', data_subdir)) for fname in fnames)
+
+    sizes_before = {data_subdir: get_dir_size(data_subdir) for data_subdir, _ in game_file_sources.values()}
+
+    t_start = time.time()
+    for season_str in season_strs:
+        for season_type in season_type_suffixes:
+            n_normalized = normalize_season_data(season_str, season_type)
+            print(f'{season_str} {season_type}: {n_normalized} files normalized')
+    print('({:.1f} s)'.format(time.time() - t_start))
+
+    for data_subdir, _ in game_file_sources.values():
+        print('data/{}: {:.1f} MB -> {:.1f} MB'.format(data_subdir, sizes_before[data_subdir]/1e6,
+                                                      get_dir_size(data_subdir)/1e6))
+    print('data/dims: {:.2f} MB'.format(get_dir_size('dims')/1e6))
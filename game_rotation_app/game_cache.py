@@ -0,0 +1,250 @@
+'''
+Process-wide caches of rotation plots, shared by all sessions of the app,
+and a background prefetcher that fills them.
+
+Showing a game means building its figure (loading the game's data and 
+plotting it) and then drawing and encoding it for the plot settings and 
+device size, and both steps take a good fraction of a second. 
+Users mostly click through the first few games listed or the games next 
+to the one they are on, so those get built and encoded ahead of time, 
+at low priority: the prefetcher only works when no session has asked for 
+a plot recently, and all matplotlib work (by sessions or the prefetcher)
+is serialized by render_lock, so a user's render waits on at most one
+prefetched one. Sessions only wait on the lock from threads (see app.py's
+plot_task), never on the event loop, which serves every session.
+When many users' renders queue up anyway, they're rendered at a lower
+quality (see render_quality.py).
+'''
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from load_data_utils import get_gr, get_pbp
+from plot_utils import make_final_fig, restyle_fig, set_fig_quality, save_fig_layout, warm_up_matplotlib
+from img_utils import encode_fig
+from profile_utils import profile_function
+from render_quality import governor, quality_profiles, quality_levels, quality_stats, get_quality_params
+
+
+fig_cache_size = 32          # most figures kept in memory
+img_cache_size = 128         # most encoded images kept in memory
+prefetch_n_games = 5         # how many of the top listed games to prefetch
+prefetch_n_neighbors = 1     # how many games on each side of the selected game to prefetch
+prefetch_idle_secs = 1       # only prefetch if no plot was requested for this long
+
+# whether to load matplotlib in the background as soon as the app starts
+warm_up_on_start = os.environ.get('ROTATION_WARM_UP', '1') == '1'
+
+# serializes all matplotlib work between sessions and the prefetcher
+render_lock = threading.RLock()
+
+_fig_cache = OrderedDict()
+_img_cache = OrderedDict()
+_last_request_time = 0
+
+_pending = OrderedDict()
+_pending_cond = threading.Condition()
+_prefetch_thread = None
+
+# the prefetcher's failures are logged (with their tracebacks) rather than raised
+logger = logging.getLogger(__name__)
+
+
+def _cache_put(cache, key, value, max_size):
+    '''
+    Adds a value to an LRU cache (OrderedDict), evicting the oldest entries
+    '''
+    cache[key] = value
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+@profile_function
+def build_game_fig(season_str, season_type, game_id, game_info, df_team_info):
+    '''
+    Loads a game's data and makes its rotation plot
+    (with the default plot settings), returning None if
+    the game rotation or play by play data isn't available
+    '''
+    df_gr = get_gr(season_str, game_id, season_type)
+
+    if len(df_gr) > 0:
+
+        # the plot doesn't use the play by play's names
+        df_pbp = get_pbp(season_str, game_id, season_type, names=False)
+
+        if len(df_pbp) > 0:
+
+            fig = make_final_fig(df_gr, df_pbp, df_team_info, game_info, 
+                                 show_text=True, 
+                                 show_plot=False,
+                                 season_type=season_type)
+            # the figure is kept by the cache, not by pyplot
+            # (already imported by make_final_fig)
+            import matplotlib.pyplot as plt
+            plt.close(fig)
+            return fig
+
+    return None
+
+def get_cached_fig(season_str, season_type, game_info, df_team_info):
+    '''
+    Gets a game's rotation plot figure from the cache,
+    building (and caching) it if it isn't there yet
+    '''
+    key = (season_str, season_type, game_info['GAME_ID'])
+
+    with render_lock:
+
+        if key in _fig_cache:
+            _fig_cache.move_to_end(key)
+            return _fig_cache[key]
+        
+        fig = build_game_fig(season_str, season_type, game_info['GAME_ID'], game_info, df_team_info)
+
+        # don't cache missing games, their data may show up in the next update
+        if fig is not None:
+            _cache_put(_fig_cache, key, fig, fig_cache_size)
+
+        return fig
+
+def get_img_key(season_str, season_type, game_id, plot_settings, render_size, fmt, quality='full'):
+    '''
+    Key of a rotation plot image in the cache
+    '''
+    return (season_str, season_type, game_id, plot_settings, render_size, fmt, quality)
+
+def get_cached_img(season_str, season_type, game_info, df_team_info,
+                   plot_settings, render_size, fmt, from_user=True, quality='full'):
+    '''
+    Gets a game's rotation plot encoded as an image from the cache, 
+    for the plot settings (show_text, stint_val, cmap_name),
+    render size (width, height, scale; see img_utils.get_render_size),
+    and quality profile (see render_quality.py),
+    restyling and encoding the game's figure if it isn't there yet.
+    Returns the image bytes, or None if the game's data isn't available.
+    '''
+    global _last_request_time
+    if from_user:
+        _last_request_time = time.monotonic()
+
+    key = get_img_key(season_str, season_type, game_info['GAME_ID'], plot_settings, render_size, fmt, quality)
+
+    with render_lock:
+
+        if key in _img_cache:
+            _img_cache.move_to_end(key)
+            return _img_cache[key]
+        
+        fig = get_cached_fig(season_str, season_type, game_info, df_team_info)
+        
+        if fig is None:
+            return None
+
+        show_text, stint_val, cmap_name = plot_settings
+        restyle_fig(fig, show_text=show_text, stint_val=stint_val, cmap_name=cmap_name)
+
+        # the layout only depends on the size and the players' labels
+        layout_key = (render_size[0], render_size[1], stint_val)
+        profile = quality_profiles[quality]
+        is_tight = set_fig_quality(fig, path_effects=profile['path_effects'],
+                                   layout_key=None if profile['tight_layout'] else layout_key)
+        img = encode_fig(fig, *render_size, fmt)
+        if is_tight:
+            save_fig_layout(fig, layout_key)
+
+        _cache_put(_img_cache, key, img, img_cache_size)
+
+        return img
+
+def get_governed_img(season_str, season_type, game_info, df_team_info,
+                     plot_settings, render_size, fmt, t_requested=None):
+    '''
+    Gets a game's rotation plot like get_cached_img, at the quality
+    the current render load allows (see render_quality.py),
+    or as it's already cached at a better quality.
+    t_requested is when the user asked for it (from time.monotonic), if not now.
+    Returns the image bytes (or None if the game's data isn't available),
+    and the quality profile they were rendered at.
+    '''
+    with governor.request(t_requested):
+        with render_lock:
+            quality = governor.update_level()
+
+            for cur_quality in quality_levels[:quality_levels.index(quality) + 1]:
+                cur_settings, cur_size = get_quality_params(cur_quality, plot_settings, render_size)
+                key = get_img_key(season_str, season_type, game_info['GAME_ID'], 
+                                  cur_settings, cur_size, fmt, cur_quality)
+                if key in _img_cache or cur_quality == quality:
+                    img = get_cached_img(season_str, season_type, game_info, df_team_info,
+                                         cur_settings, cur_size, fmt, quality=cur_quality)
+                    quality_stats[cur_quality] += 1
+                    return img, cur_quality
+
+def start_warm_up():
+    '''
+    Loads matplotlib and warms its font caches in the background
+    (see plot_utils.warm_up_matplotlib), so that neither starting
+    the app nor its first plot waits on it
+    '''
+    if not warm_up_on_start:
+        return
+
+    def warm_up():
+        with render_lock:
+            warm_up_matplotlib()
+
+    threading.Thread(target=warm_up, daemon=True).start()
+
+def prefetch_games(season_str, season_type, game_infos, df_team_info,
+                   plot_settings, render_size, fmt):
+    '''
+    Queues up games to have their rotation plots built and encoded
+    in the background (see get_cached_img), given a list of 
+    their league game log rows (game_infos), in order of priority. 
+    Newly queued games go ahead of older ones.
+    '''
+    global _prefetch_thread
+
+    with _pending_cond:
+        for game_info in game_infos[::-1]:
+            key = get_img_key(season_str, season_type, game_info['GAME_ID'], plot_settings, render_size, fmt)
+            if key not in _img_cache:
+                _pending[key] = (game_info, df_team_info)
+                _pending.move_to_end(key, last=False)
+        
+        if _prefetch_thread is None:
+            _prefetch_thread = threading.Thread(target=_prefetch_loop, daemon=True)
+            _prefetch_thread.start()
+
+        _pending_cond.notify()
+
+def _prefetch_loop():
+    '''
+    Builds queued rotation plots one at a time, waiting
+    whenever sessions have asked for plots recently
+    '''
+    while True:
+        with _pending_cond:
+            while len(_pending) == 0:
+                _pending_cond.wait()
+        
+        # back off while users are actively requesting plots
+        idle_secs = time.monotonic() - _last_request_time
+        if idle_secs < prefetch_idle_secs:
+            time.sleep(prefetch_idle_secs - idle_secs)
+            continue
+        
+        with _pending_cond:
+            if len(_pending) == 0:
+                continue
+            key, (game_info, df_team_info) = _pending.popitem(last=False)
+        
+        season_str, season_type, game_id, plot_settings, render_size, fmt, _ = key
+        try:
+            get_cached_img(season_str, season_type, game_info, df_team_info,
+                           plot_settings, render_size, fmt, from_user=False)
+        except Exception:
+            logger.exception('prefetching %s failed', game_id)
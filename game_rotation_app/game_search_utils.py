@@ -0,0 +1,190 @@
+'''
+Utility functions for searching a season's games by how the score played out
+(i.e. biggest comebacks, most lead changes, overtime thrillers).
+
+At ingest time (see data/update_all_data.py), every game's score state
+features are computed at once from the season's home - away margin timeline
+(see on_off_utils.get_margin_timelines):
+ - max_home_lead, max_away_lead, max_lead: the largest lead of each side (and either)
+ - lead_changes: times the lead went from one team to the other
+ - ties: times the score was tied again (after 0-0)
+ - deficit_overcome: the winner's largest deficit
+ - n_ot: number of overtimes
+ - final_margin: home - away final margin (and final_margin_abs)
+and saved as one array per feature (columnar) in data/game_features/.
+Searches are then vectorized filters and sorts over those arrays.
+'''
+
+import os
+from functools import lru_cache
+import numpy as np
+
+from load_data_utils import get_season_suffix
+from on_off_utils import get_margin_timelines, game_time_offset
+
+
+features_dir = 'data/game_features/'
+
+feature_names = ['max_home_lead', 'max_away_lead', 'max_lead', 'lead_changes', 'ties',
+                 'deficit_overcome', 'n_ot', 'final_margin', 'final_margin_abs']
+
+# ways to order search results: feature -> (label, descending)
+search_orders = {'date': ('most recent', True),
+                 'deficit_overcome': ('biggest comeback', True),
+                 'lead_changes': ('most lead changes', True),
+                 'ties': ('most ties', True),
+                 'n_ot': ('most overtimes', True),
+                 'max_lead': ('largest lead', True),
+                 'final_margin_abs': ('closest finish', False)}
+
+# how each ordering's feature is noted next to a game in the game selector
+search_note_formats = {'deficit_overcome': 'came back from {}',
+                       'lead_changes': '{} lead changes',
+                       'ties': '{} ties',
+                       'n_ot': '{} OT',
+                       'max_lead': 'led by {}',
+                       'final_margin_abs': 'won by {}'}
+
+
+def get_game_features(season_str, season_type='Regular Season'):
+    '''
+    Given a season string (i.e. 2023-24), computes every saved game's
+    score state features (see the top of this file), all games at once,
+    returning a dictionary of game_ids and one array per feature
+    '''
+    game_ids, game_ends, event_times, margins = get_margin_timelines(season_str, season_type)
+    n_games = len(game_ids)
+    i_game = (event_times // game_time_offset).astype(int)
+
+    # every game's timeline starts with a margin of 0, so every game has events
+    i_starts = np.searchsorted(i_game, np.arange(n_games))
+    i_ends = np.append(i_starts[1:], len(margins)) - 1
+
+    max_home_lead = np.maximum.reduceat(margins, i_starts)
+    max_away_lead = np.maximum.reduceat(-margins, i_starts)
+    final_margin = margins[i_ends]
+
+    # lead changes: consecutive nonzero margins of the same game with opposite signs
+    is_lead = margins != 0
+    lead_signs, lead_games = np.sign(margins[is_lead]), i_game[is_lead]
+    is_change = (lead_signs[1:] != lead_signs[:-1]) & (lead_games[1:] == lead_games[:-1])
+    lead_changes = np.bincount(lead_games[1:][is_change], minlength=n_games)
+
+    # ties: the margin coming back to 0 within a game
+    is_tie = (margins[1:] == 0) & (margins[:-1] != 0) & (i_game[1:] == i_game[:-1])
+    ties = np.bincount(i_game[1:][is_tie], minlength=n_games)
+
+    deficit_overcome = np.where(final_margin > 0, max_away_lead,
+                                np.where(final_margin < 0, max_home_lead, 0))
+    n_ot = np.clip(np.ceil((game_ends - 48 - 1e-6)/5), 0, None)
+
+    features = {'max_home_lead': np.clip(max_home_lead, 0, None),
+                'max_away_lead': np.clip(max_away_lead, 0, None),
+                'lead_changes': lead_changes,
+                'ties': ties,
+                'deficit_overcome': np.clip(deficit_overcome, 0, None),
+                'n_ot': n_ot,
+                'final_margin': final_margin}
+    features = {k: v.astype(np.int16) for k, v in features.items()}
+    features['max_lead'] = np.maximum(features['max_home_lead'], features['max_away_lead'])
+    features['final_margin_abs'] = np.abs(features['final_margin'])
+
+    return {'game_ids': game_ids, **features}
+
+def get_features_fpath(season_str, season_type='Regular Season', data_dir=features_dir):
+    '''
+    Path of a season's saved game features
+    '''
+    return os.path.join(data_dir, 'features_{}{}.npz'.format(season_str, get_season_suffix(season_type)))
+
+def save_game_features(season_str, season_type='Regular Season', data_dir=features_dir):
+    '''
+    Computes a season's game features (see get_game_features)
+    and saves them to data_dir, one array per feature
+    '''
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+        print('making data directory: {}'.format(os.path.abspath(data_dir)))
+
+    fsave = get_features_fpath(season_str, season_type, data_dir)
+    print(f'saving to... {fsave}')
+    np.savez_compressed(fsave, **get_game_features(season_str, season_type))
+
+@lru_cache(maxsize=16)
+def _load_game_features(season_str, season_type, file_version):
+
+    if file_version is None:
+        return get_game_features(season_str, season_type)
+
+    with np.load(get_features_fpath(season_str, season_type)) as saved:
+        features = {k: saved[k] for k in saved.files}
+
+    # saved before a feature was added
+    if any(k not in features for k in feature_names):
+        return get_game_features(season_str, season_type)
+    return features
+
+def load_game_features(season_str, season_type='Regular Season'):
+    '''
+    Loads a season's saved game features,
+    computing them instead if they haven't been saved
+    '''
+    fpath = get_features_fpath(season_str, season_type)
+    file_version = None
+    if os.path.exists(fpath):
+        fstat = os.stat(fpath)
+        file_version = (fstat.st_size, fstat.st_mtime_ns)
+
+    return _load_game_features(season_str, season_type, file_version)
+
+def search_games(season_str, season_type='Regular Season', game_ids=None,
+                 min_deficit_overcome=0, min_lead_changes=0, ot_only=False,
+                 max_final_margin=None, order_by='date'):
+    '''
+    Given a season string (i.e. 2023-24), and optionally the game_ids
+    to search among, finds the games with a comeback of at least
+    min_deficit_overcome points, at least min_lead_changes lead changes,
+    optionally only overtime games, and a final margin of at most max_final_margin,
+    returning their game_ids and features (a dictionary of arrays), ordered
+    by order_by (see search_orders; 'date' keeps the order of game_ids)
+    '''
+    features = load_game_features(season_str, season_type)
+
+    if game_ids is None:
+        i_games = np.arange(len(features['game_ids']))
+    else:
+        # positions of the given games in the feature arrays (games without features dropped)
+        game_ids = np.asarray(game_ids, dtype=str)
+        i_sorted = np.argsort(features['game_ids'])
+        i_found = np.minimum(np.searchsorted(features['game_ids'], game_ids, sorter=i_sorted), len(i_sorted) - 1)
+        i_games = i_sorted[i_found][features['game_ids'][i_sorted[i_found]] == game_ids]
+
+    keep = (features['deficit_overcome'][i_games] >= min_deficit_overcome) & \
+           (features['lead_changes'][i_games] >= min_lead_changes)
+    if ot_only:
+        keep &= features['n_ot'][i_games] > 0
+    if max_final_margin is not None:
+        keep &= features['final_margin_abs'][i_games] <= max_final_margin
+    i_games = i_games[keep]
+
+    if order_by != 'date':
+        values = features[order_by][i_games]
+        i_games = i_games[np.argsort(-values if search_orders[order_by][1] else values, kind='stable')]
+
+    return features['game_ids'][i_games], {k: features[k][i_games] for k in feature_names}
+
+
+if __name__ == '__main__':
+
+    import time
+
+    t_start = time.time()
+    features = get_game_features('2023-24')
+    print('features of {} games ({:.2f} s)'.format(len(features['game_ids']), time.time() - t_start))
+
+    for order_by in search_orders:
+        t_start = time.time()
+        game_ids, game_features = search_games('2023-24', order_by=order_by)
+        print('{} ({:.2f} ms): {}'.format(search_orders[order_by][0], 1000*(time.time() - t_start),
+                                          list(zip(game_ids[:3], game_features[order_by][:3]))
+                                          if order_by != 'date' else game_ids[:3]))
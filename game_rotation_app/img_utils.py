@@ -0,0 +1,122 @@
+'''
+Utility functions for turning rotation plots into images
+for the shiny app, sized for the device viewing them
+(desktop vs. mobile browsers) and encoded compactly.
+
+Rather than always sending a full resolution 1200x800 PNG,
+the plot is laid out for the device class (a narrower, taller layout
+on phones), rasterized at a resolution matching how large it will actually
+be displayed on the device's screen, and encoded as lossless WebP,
+which is several times smaller than PNG for these flat-colored plots.
+'''
+
+import io
+import os
+import logging
+import tempfile
+
+
+# layout sizes (in CSS pixels) of the rotation plot for each device class,
+# along with the most device pixels per CSS pixel worth rendering
+plot_profiles = {'desktop': {'width': 1200, 'height': 800, 'max_pixelratio': 2},
+                 'mobile': {'width': 800, 'height': 900, 'max_pixelratio': 2}}
+
+# outputs narrower than this (in CSS pixels) get the mobile layout
+mobile_max_width = 768
+
+# image format to send plots as, 'webp' or 'png'
+img_format = os.environ.get('ROTATION_IMG_FORMAT', 'webp')
+
+# each render's stats are logged at debug level, e.g. shown
+# with logging.basicConfig(level=logging.DEBUG) when profiling
+logger = logging.getLogger(__name__)
+
+pil_kwargs = {'webp': {'lossless': True, 'method': 4},
+              'png': {'optimize': True}}
+
+# encoded bytes and time to image for each device class and quality profile,
+# (n images, total bytes, total seconds)
+render_stats = {}
+
+
+def get_device_class(output_width):
+    '''
+    Given the width (in CSS pixels) of the plot output in the browser,
+    returns which plot profile to use (desktop or mobile)
+    '''
+    if output_width is not None and output_width < mobile_max_width:
+        return 'mobile'
+    return 'desktop'
+
+def get_render_size(output_width, pixelratio=1):
+    '''
+    Given the width (in CSS pixels) of the plot output in the browser,
+    and the device pixel ratio, returns the device class,
+    the width and height (in CSS pixels) to lay the plot out at,
+    and how many image pixels to render per CSS pixel
+    (rounded to quarters, so small resizes don't change the image)
+    '''
+    device_class = get_device_class(output_width)
+    profile = plot_profiles[device_class]
+    width, height = profile['width'], profile['height']
+
+    if output_width is None:
+        output_width = width
+    pixelratio = pixelratio or 1
+
+    # the plot is scaled down to fit the output, so only render
+    # as many pixels as the device will actually show
+    scale = min(output_width, width)*pixelratio/width
+    scale = min(max(1, round(4*scale)/4), profile['max_pixelratio'])
+
+    return device_class, width, height, scale
+
+def encode_fig(fig, width, height, scale=1, fmt=img_format):
+    '''
+    Encodes a matplotlib figure laid out at width x height CSS pixels,
+    rendered at scale image pixels per CSS pixel,
+    in the desired format (webp or png), returning the image bytes
+    '''
+    ppi = fig.get_dpi()
+    fig.set_size_inches(width/ppi, height/ppi)
+
+    with io.BytesIO() as buf:
+        fig.savefig(buf, format=fmt, dpi=ppi*scale,
+                    pil_kwargs=pil_kwargs.get(fmt, {}))
+        return buf.getvalue()
+
+def encode_rgba(pixels, fmt=img_format):
+    '''
+    Encodes an RGBA pixel array (i.e. a drawn matplotlib canvas)
+    in the desired format (webp or png), returning the image bytes
+    '''
+    from PIL import Image
+
+    with io.BytesIO() as buf:
+        Image.fromarray(pixels, 'RGBA').convert('RGB').save(buf, format=fmt, **pil_kwargs.get(fmt, {}))
+        return buf.getvalue()
+
+def write_img_file(img_bytes, fmt=img_format):
+    '''
+    Writes encoded image bytes to a temporary file 
+    (for shiny's render.image), returning its path
+    '''
+    fd, fpath = tempfile.mkstemp(suffix=f'.{fmt}')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(img_bytes)
+    
+    return fpath
+
+def record_render_stats(device_class, nbytes, secs, quality='full'):
+    '''
+    Adds an encoded image's size and time to image to the
+    running totals for its device class and quality profile 
+    (see render_quality.py), and logs them (at debug level)
+    '''
+    key = (device_class, quality)
+    n, tot_bytes, tot_secs = render_stats.get(key, (0, 0, 0))
+    render_stats[key] = (n + 1, tot_bytes + nbytes, tot_secs + secs)
+
+    n, tot_bytes, tot_secs = render_stats[key]
+    logger.debug('%s plot (%s quality): %.0f kB in %.2f s (avg of %d: %.0f kB in %.2f s)',
+                 device_class, quality, nbytes/1e3, secs, n, tot_bytes/n/1e3, tot_secs/n)
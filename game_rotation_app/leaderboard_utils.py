@@ -0,0 +1,310 @@
+'''
+Utility functions for season leaderboards of stint-level stats,
+for each player and team: stint +/- per 36 minutes, average stint length,
+minutes by quarter and stints per game.
+
+Rather than aggregating every game rotation file of a season whenever
+the leaderboards are shown, the season totals are kept as materialized
+aggregates in data/leaderboards/:
+ - {season_str}{suffix}_player_games.csv: each player's sums in each game
+ - {season_str}{suffix}_players.csv, {season_str}{suffix}_teams.csv: season sums
+ - {season_str}{suffix}_games.json: the version (size, modification time)
+   of each game rotation file folded in
+
+Each night, update_leaderboards (run by data/update_all_data.py) folds in only
+the games whose game rotation file is new or changed (i.e. stints
+reconstructed from the play by play, later replaced by GameRotation's),
+subtracting a changed game's old sums before adding its new ones.
+
+    python leaderboard_utils.py [--rebuild] [--season-str 2023-24]
+
+updates the aggregates, or with --rebuild, rebuilds them from scratch,
+reporting any differences from the incrementally updated ones.
+'''
+
+import os
+import json
+import argparse
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+from load_data_utils import get_grs, get_game_fpaths, get_season_suffix, season_strs, season_type_suffixes
+
+
+leaderboards_dir = 'data/leaderboards/'
+
+# quarters (in minutes into the game), with all overtimes as one
+quarter_bounds = np.array([0, 12, 24, 36, 48, np.inf])
+quarter_cols = ['min_q1', 'min_q2', 'min_q3', 'min_q4', 'min_ot']
+
+# columns summed over stints, games and the season
+sum_cols = ['stints', 'minutes', 'pt_diff'] + quarter_cols
+
+player_keys = ['PERSON_ID', 'TEAM_ID']
+team_keys = ['TEAM_ID']
+
+
+def get_player_game_sums(df_gr):
+    '''
+    Given game rotation stints (of any number of games),
+    returns each player's sums in each game: number of stints,
+    minutes, point differential, and minutes in each quarter
+    '''
+    in_min = df_gr['IN_TIME_REAL'].values/600
+    out_min = df_gr['OUT_TIME_REAL'].values/600
+
+    # overlap of each stint with each quarter
+    quarter_mins = np.clip(np.minimum(out_min[:, None], quarter_bounds[None, 1:]) -
+                           np.maximum(in_min[:, None], quarter_bounds[None, :-1]), 0, None)
+
+    df_stints = pd.DataFrame({'GAME_ID': df_gr['GAME_ID'].values,
+                              'PERSON_ID': df_gr['PERSON_ID'].values,
+                              'TEAM_ID': df_gr['TEAM_ID'].values,
+                              'PLAYER_NAME': df_gr['PLAYER_FIRST'].values + ' ' + df_gr['PLAYER_LAST'].values,
+                              'stints': 1,
+                              'minutes': out_min - in_min,
+                              'pt_diff': df_gr['PT_DIFF'].values,
+                              **dict(zip(quarter_cols, quarter_mins.T))})
+
+    return (df_stints
+            .groupby(['GAME_ID'] + player_keys, as_index=False)
+            .agg({'PLAYER_NAME': 'first', **{col: 'sum' for col in sum_cols}}))
+
+def get_season_sums(df_player_games):
+    '''
+    Given players' sums in each game (see get_player_game_sums),
+    returns the players' and teams' sums over those games,
+    indexed by player_keys / team_keys, with games played
+    '''
+    df_players = (df_player_games
+                  .groupby(player_keys)
+                  .agg(PLAYER_NAME=('PLAYER_NAME', 'last'), games=('GAME_ID', 'size'),
+                       **{col: (col, 'sum') for col in sum_cols}))
+    df_teams = (df_player_games
+                .groupby(team_keys)
+                .agg(games=('GAME_ID', 'nunique'), **{col: (col, 'sum') for col in sum_cols}))
+
+    return df_players, df_teams
+
+def fold_sums(df_totals, df_add=None, df_sub=None):
+    '''
+    Adds df_add's sums to (and subtracts df_sub's sums from) df_totals,
+    all indexed the same way, dropping rows left without any games
+    '''
+    df_totals = df_totals.copy()
+    num_cols = ['games'] + sum_cols
+
+    for df, sign in [(df_sub, -1), (df_add, 1)]:
+        if df is None or len(df) == 0:
+            continue
+        df_totals = df_totals.reindex(df_totals.index.union(df.index))
+        df_totals[num_cols] = df_totals[num_cols].fillna(0).add(sign*df[num_cols], fill_value=0)
+        if 'PLAYER_NAME' in df.columns and sign > 0:
+            df_totals.loc[df.index, 'PLAYER_NAME'] = df['PLAYER_NAME']
+
+    df_totals['games'] = df_totals['games'].round().astype(int)
+    df_totals['stints'] = df_totals['stints'].round().astype(int)
+    return df_totals[df_totals['games'] > 0]
+
+def get_leaderboard_fpaths(season_str, season_type='Regular Season', data_dir=leaderboards_dir):
+    '''
+    Paths of a season's saved aggregates (see the top of this file)
+    '''
+    prefix = os.path.join(data_dir, '{}{}'.format(season_str, get_season_suffix(season_type)))
+    return {'player_games': f'{prefix}_player_games.csv',
+            'players': f'{prefix}_players.csv',
+            'teams': f'{prefix}_teams.csv',
+            'games': f'{prefix}_games.json'}
+
+def get_gr_versions(season_str, season_type='Regular Season'):
+    '''
+    The version (size, modification time) of each of a season's saved game rotation files
+    '''
+    d_fpaths = get_game_fpaths('game_rotations', 'df_gr_', season_str, season_type=season_type)
+    versions = {}
+    for game_id, fpath in d_fpaths.items():
+        fstat = os.stat(fpath)
+        versions[game_id] = f'{fstat.st_size}-{fstat.st_mtime_ns}'
+    return versions
+
+def read_aggregates(season_str, season_type='Regular Season', data_dir=leaderboards_dir):
+    '''
+    Reads a season's saved aggregates, returning the player game sums,
+    player and team season sums and the versions of the games folded in,
+    or None if they haven't been saved
+    '''
+    fpaths = get_leaderboard_fpaths(season_str, season_type, data_dir)
+    if not os.path.exists(fpaths['games']):
+        return None
+
+    with open(fpaths['games']) as f:
+        game_versions = json.load(f)
+    df_player_games = pd.read_csv(fpaths['player_games'], dtype={'GAME_ID': 'string'})
+    df_players = pd.read_csv(fpaths['players']).set_index(player_keys)
+    df_teams = pd.read_csv(fpaths['teams']).set_index(team_keys)
+
+    return df_player_games, df_players, df_teams, game_versions
+
+def write_aggregates(season_str, season_type, df_player_games, df_players, df_teams, game_versions,
+                     data_dir=leaderboards_dir):
+    '''
+    Saves a season's aggregates, each written whole before replacing the old one,
+    with the game versions last (so a reader never sees sums of games it doesn't list)
+    '''
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+        print('making data directory: {}'.format(os.path.abspath(data_dir)))
+
+    fpaths = get_leaderboard_fpaths(season_str, season_type, data_dir)
+    for key, df, index in [('player_games', df_player_games, False),
+                           ('players', df_players, True),
+                           ('teams', df_teams, True)]:
+        df.to_csv(fpaths[key] + '.tmp', index=index)
+        os.replace(fpaths[key] + '.tmp', fpaths[key])
+
+    with open(fpaths['games'] + '.tmp', 'w') as f:
+        json.dump(game_versions, f)
+    os.replace(fpaths['games'] + '.tmp', fpaths['games'])
+    print('saving to... {}'.format(fpaths['players'].replace('_players.csv', '_*')))
+
+def build_aggregates(season_str, season_type='Regular Season'):
+    '''
+    Aggregates every saved game rotation of a season from scratch,
+    returning the player game sums, player and team season sums, and game versions
+    '''
+    game_versions = get_gr_versions(season_str, season_type)
+    df_gr = get_grs(season_str, sorted(game_versions), season_type=season_type,
+                    columns=['TEAM_ID', 'PERSON_ID', 'PLAYER_FIRST', 'PLAYER_LAST',
+                             'IN_TIME_REAL', 'OUT_TIME_REAL', 'PT_DIFF'])
+    df_player_games = get_player_game_sums(df_gr)
+    df_players, df_teams = get_season_sums(df_player_games)
+
+    return df_player_games, df_players, df_teams, game_versions
+
+def update_leaderboards(season_str, season_type='Regular Season', data_dir=leaderboards_dir):
+    '''
+    Folds a season's new and changed game rotation files into its saved aggregates
+    (building them if they haven't been saved), returning the number of games folded in
+    '''
+    aggregates = read_aggregates(season_str, season_type, data_dir)
+    if aggregates is None:
+        aggregates = build_aggregates(season_str, season_type)
+        write_aggregates(season_str, season_type, *aggregates, data_dir=data_dir)
+        return len(aggregates[3])
+
+    df_player_games, df_players, df_teams, old_versions = aggregates
+    game_versions = get_gr_versions(season_str, season_type)
+
+    changed_ids = sorted(g for g, v in game_versions.items() if old_versions.get(g) != v)
+    removed_ids = sorted(set(old_versions) - set(game_versions))
+    if len(changed_ids) + len(removed_ids) == 0:
+        return 0
+
+    # take out the old sums of changed and removed games
+    is_old = df_player_games['GAME_ID'].isin(changed_ids + removed_ids)
+    df_players_sub, df_teams_sub = get_season_sums(df_player_games[is_old])
+
+    # and put in the new sums of new and changed games
+    df_player_games_add = pd.DataFrame(columns=df_player_games.columns)
+    if len(changed_ids) > 0:
+        df_gr = get_grs(season_str, changed_ids, season_type=season_type,
+                        columns=['TEAM_ID', 'PERSON_ID', 'PLAYER_FIRST', 'PLAYER_LAST',
+                                 'IN_TIME_REAL', 'OUT_TIME_REAL', 'PT_DIFF'])
+        df_player_games_add = get_player_game_sums(df_gr)
+    df_players_add, df_teams_add = get_season_sums(df_player_games_add)
+
+    df_players = fold_sums(df_players, df_players_add, df_players_sub)
+    df_teams = fold_sums(df_teams, df_teams_add, df_teams_sub)
+    df_player_games = pd.concat([df_player_games[~is_old], df_player_games_add], ignore_index=True)
+
+    write_aggregates(season_str, season_type, df_player_games, df_players, df_teams, game_versions, data_dir)
+    print('folded {} new/changed and {} removed games into the {} {} leaderboards'.format(
+        len(changed_ids), len(removed_ids), season_str, season_type))
+
+    return len(changed_ids) + len(removed_ids)
+
+def rebuild_leaderboards(season_str, season_type='Regular Season', data_dir=leaderboards_dir):
+    '''
+    Rebuilds a season's aggregates from scratch, printing how the
+    incrementally updated ones (if any) differed from them,
+    and returns the largest difference in any sum
+    '''
+    old_aggregates = read_aggregates(season_str, season_type, data_dir)
+    aggregates = build_aggregates(season_str, season_type)
+
+    max_diff = 0
+    if old_aggregates is not None:
+        for name, df_old, df_new in [('players', old_aggregates[1], aggregates[1]),
+                                     ('teams', old_aggregates[2], aggregates[2])]:
+            num_cols = ['games'] + sum_cols
+            df_diff = (df_old[num_cols].reindex(df_new.index.union(df_old.index)).fillna(0) -
+                       df_new[num_cols].reindex(df_new.index.union(df_old.index)).fillna(0)).abs()
+            print('{} {} {}: {} rows, max difference {:.2g}'.format(
+                season_str, season_type, name, len(df_new), df_diff.values.max()))
+            max_diff = max(max_diff, df_diff.values.max())
+
+    write_aggregates(season_str, season_type, *aggregates, data_dir=data_dir)
+    return max_diff
+
+@lru_cache(maxsize=16)
+def _load_season_sums(season_str, season_type, level, file_version):
+
+    aggregates = read_aggregates(season_str, season_type)
+    if aggregates is None:
+        aggregates = build_aggregates(season_str, season_type)
+    return aggregates[1 if level == 'players' else 2].reset_index()
+
+def has_leaderboard(season_str, season_type='Regular Season'):
+    '''
+    Whether a season's aggregates have been saved
+    '''
+    return os.path.exists(get_leaderboard_fpaths(season_str, season_type)['games'])
+
+def get_leaderboard(season_str, season_type='Regular Season', level='players', build_missing=True):
+    '''
+    Given a season string (i.e. 2023-24), and a level (players or teams),
+    returns the season's leaderboard: for each player (per team) or team,
+    games played, minutes, stints per game, average stint length,
+    stint +/- per 36 minutes, and minutes per game in each quarter.
+    Reads the saved aggregates, aggregating the season's game rotations
+    if they haven't been saved (and build_missing), or returning None if not.
+    The app only reads saved aggregates: aggregating a season takes seconds.
+    '''
+    fpath = get_leaderboard_fpaths(season_str, season_type)['games']
+    file_version = None
+    if os.path.exists(fpath):
+        fstat = os.stat(fpath)
+        file_version = (fstat.st_size, fstat.st_mtime_ns)
+    elif not build_missing:
+        return None
+
+    df = _load_season_sums(season_str, season_type, level, file_version).copy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['min_per_game'] = df['minutes']/df['games']
+        df['stints_per_game'] = df['stints']/df['games']
+        df['avg_stint_min'] = df['minutes']/df['stints']
+        df['pm_per36'] = 36*df['pt_diff']/df['minutes']
+        for col in quarter_cols:
+            df[f'{col}_per_game'] = df[col]/df['games']
+
+    return df.sort_values('minutes', ascending=0).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Update (or rebuild) the season leaderboard aggregates')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild from scratch, reporting differences from the updated aggregates')
+    parser.add_argument('--season-str', default=None, help='only this season (i.e. 2023-24)')
+    args = parser.parse_args()
+
+    for season_str in ([args.season_str] if args.season_str else season_strs):
+        for season_type in season_type_suffixes:
+            if not os.path.isdir('data/game_rotations/{}{}'.format(season_str, get_season_suffix(season_type))):
+                continue
+            if args.rebuild:
+                rebuild_leaderboards(season_str, season_type)
+            else:
+                update_leaderboards(season_str, season_type)
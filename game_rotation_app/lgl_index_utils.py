@@ -0,0 +1,183 @@
+'''
+Read-only lookups into the league game logs, shared by every session.
+
+Each session's sidebar used to filter the whole team and player game logs
+on every change (season, teams, game), keeping its own filtered dataframes.
+Instead, the game logs are indexed once for each new version of them
+(the nightly update's new rows, see load_data_utils.LeagueGameLogStore),
+and sessions only keep arrays of row positions into them:
+ - the game rows (AWAY @ HOME) of each season + season type, most recent first
+ - each game row's away and home team, to filter them by team
+ - each game's team row (for its plot) and away team row (for similar games)
+ - each game's player rows (for its box scores)
+The index's arrays are read-only, so a session can't change them for the others,
+and the dataframes are only copied from (a few rows at a time) when a session
+needs rows of them, i.e. for a box score.
+
+The index is built in each worker, as its own (private) memory. When serving
+with multiple workers (see serve.py), the game logs are memory mapped Arrow data
+held once for all workers (see shared_data.py), but the index's arrays of their
+columns are copies (numpy object arrays of the strings) in each worker.
+Its size is measured when it's built (see get_index_report), and reported
+with the worker's memory (see memory_utils.py): about 4 MB for two seasons,
+against about 19 MB of game logs.
+'''
+
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+
+def read_only(arr):
+    '''
+    Marks a numpy array as read-only (shared between sessions), returning it
+    '''
+    arr.flags.writeable = False
+    return arr
+
+def get_deep_nbytes(value):
+    '''
+    Approximate memory (in bytes) held by an index attribute:
+    numpy arrays (with the objects in object arrays), pandas series,
+    and dicts of them
+    '''
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return value.nbytes + sum(sys.getsizeof(x) for x in value.flat)
+        return value.nbytes
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_deep_nbytes(k) + get_deep_nbytes(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class LeagueGameLogIndex:
+    '''
+    Row positions into the team and player league game logs (see get_lgls),
+    by season, team and game (see the top of this file)
+    '''
+
+    def __init__(self, df_lgl_T_all, df_lgl_P_all):
+        self.df_lgl_T_all = df_lgl_T_all
+        self.df_lgl_P_all = df_lgl_P_all
+
+        # team game log columns
+        self.game_ids = read_only(df_lgl_T_all['GAME_ID'].to_numpy())
+        self.game_dates = read_only(df_lgl_T_all['GAME_DATE'].to_numpy())
+        self.matchups = read_only(df_lgl_T_all['MATCHUP'].to_numpy())
+        self.team_ids = read_only(df_lgl_T_all['TEAM_ID'].to_numpy())
+
+        # game rows are the away team's, listed as AWAY @ HOME
+        matchups = df_lgl_T_all['MATCHUP'].str.partition(' @ ')
+        is_game = (matchups[1] != '').to_numpy()
+        self.away_tms = read_only(np.where(is_game, matchups[0].to_numpy(), ''))
+        self.home_tms = read_only(np.where(is_game, matchups[2].to_numpy(), ''))
+        matchups_nodot = df_lgl_T_all['MATCHUP'].str.replace('.', '', regex=False)
+        self.game_strs = read_only((df_lgl_T_all['GAME_DATE'] + ': ' + matchups_nodot).to_numpy())
+        self.gallery_strs = read_only((df_lgl_T_all['GAME_DATE'].str[5:] + ' ' + matchups_nodot).to_numpy())
+
+        # per season + season type: all rows, game rows (most recent first), and teams
+        dates = pd.Series(self.game_dates, index=np.arange(len(df_lgl_T_all)))
+        self.season_rows = {}
+        self.season_games = {}
+        self.season_teams = {}
+        for key, rows in df_lgl_T_all.groupby(['season_str', 'season_type'], sort=False).indices.items():
+            self.season_rows[key] = read_only(rows)
+            self.season_games[key] = read_only(dates.iloc[rows[is_game[rows]]]
+                                               .sort_values(ascending=False).index.to_numpy())
+            self.season_teams[key] = read_only(np.sort(df_lgl_T_all['TEAM_ABBREVIATION'].iloc[rows].unique()))
+
+        # per game: its first team row, and its away team row
+        rows = np.arange(len(df_lgl_T_all))
+        self.game_rows = dict(zip(self.game_ids[::-1], rows[::-1]))
+        self.away_rows = dict(zip(self.game_ids[is_game][::-1], rows[is_game][::-1]))
+
+        # per game: its player rows
+        self.game_player_rows = {g_id: read_only(p_rows) for g_id, p_rows in
+                                 df_lgl_P_all.groupby('GAME_ID', sort=False).indices.items()}
+        self.player_mins = read_only(df_lgl_P_all['MIN'].to_numpy())
+        self.player_is_away = read_only(df_lgl_P_all['MATCHUP'].str.contains('@').to_numpy(dtype=bool))
+        self.player_names = df_lgl_P_all.drop_duplicates('PLAYER_ID').set_index('PLAYER_ID')['PLAYER_NAME']
+
+        self.last_date = df_lgl_T_all['GAME_DATE'].max()
+
+        # the worker's own memory held by the index (not the game logs it indexes)
+        self.nbytes = sum(get_deep_nbytes(value) for name, value in vars(self).items()
+                          if name not in ['df_lgl_T_all', 'df_lgl_P_all'])
+
+    def get_season_games(self, season_str, season_type):
+        '''
+        A season's game rows (AWAY @ HOME), most recent first
+        '''
+        return self.season_games.get((season_str, season_type), np.zeros(0, dtype=int))
+
+    def get_season_teams(self, season_str, season_type):
+        '''
+        The abbreviations of the teams that played in a season, alphabetically
+        '''
+        return self.season_teams.get((season_str, season_type), np.zeros(0, dtype=object))
+
+    def get_opponents(self, rows, tm):
+        '''
+        The opponents of a team in game rows it played in
+        '''
+        return np.where(self.away_tms[rows] == tm, self.home_tms[rows], self.away_tms[rows])
+
+    def get_game_info(self, game_id):
+        '''
+        A game's team game log row (None if not found)
+        '''
+        row = self.game_rows.get(game_id)
+        if row is None:
+            return None
+        return self.df_lgl_T_all.iloc[row]
+
+    def get_team_games(self, season_str, season_type, team_id):
+        '''
+        A team's games in a season, most recent first, as game_id -> "date: matchup"
+        '''
+        rows = self.season_rows.get((season_str, season_type), np.zeros(0, dtype=int))
+        rows = rows[self.team_ids[rows] == team_id]
+        rows = rows[pd.Series(self.game_dates[rows]).sort_values(ascending=False).index.to_numpy()]
+        return dict(zip(self.game_ids[rows], self.game_dates[rows] + ': ' + self.matchups[rows]))
+
+    def get_box_rows(self, game_id):
+        '''
+        A game's player rows, most minutes first, as (away team rows, home team rows)
+        '''
+        rows = self.game_player_rows.get(game_id, np.zeros(0, dtype=int))
+        rows = rows[pd.Series(self.player_mins[rows]).sort_values(ascending=False).index.to_numpy()]
+        is_away = self.player_is_away[rows]
+        return rows[is_away], rows[~is_away]
+
+
+_cur_index = None
+_index_lock = threading.Lock()
+
+def get_lgl_index(df_lgl_T_all, df_lgl_P_all):
+    '''
+    The index of the given (current) game logs, built the first time
+    they're asked for and shared until they change
+    '''
+    global _cur_index
+    with _index_lock:
+        if (_cur_index is None or _cur_index.df_lgl_T_all is not df_lgl_T_all
+                or _cur_index.df_lgl_P_all is not df_lgl_P_all):
+            _cur_index = LeagueGameLogIndex(df_lgl_T_all, df_lgl_P_all)
+        return _cur_index
+
+def get_index_report():
+    '''
+    The current index's size (its own memory, in each worker) in kB,
+    the number of game log rows it indexes, and whether the game logs
+    are shared between workers (memory mapped Arrow data, see shared_data.py)
+    '''
+    with _index_lock:
+        if _cur_index is None:
+            return None
+        return {'kb': round(_cur_index.nbytes/1e3),
+                'team_rows': len(_cur_index.df_lgl_T_all),
+                'player_rows': len(_cur_index.df_lgl_P_all),
+                'shared_lgls': isinstance(_cur_index.df_lgl_T_all['GAME_ID'].dtype, pd.ArrowDtype)}
@@ -9,41 +9,172 @@ The functions here simply load in the saved dataframes
 for use in the shiny app.
 '''
 
+import io
 import os 
+import json
+import threading
+from functools import lru_cache
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
+from profile_utils import profile_function
 
+
+# seasons available in the app
+# TO-DO: ADD MORE YEARS!
+season_end_yrs = [2024, 2023]
+season_strs = ['{}-{}'.format(season_end_year-1, str(season_end_year)[-2:]) for season_end_year in season_end_yrs]
+
+# suffixes of the data files/directories for each type of game
+season_type_suffixes = {'Regular Season': '',
+                        'PlayIn': '_pi',
+                        'Playoffs': '_po'}
+
+# the names repeated on every row of the saved game files are factored out
+# (see dim_utils.py) into shared player and team dimension tables, keyed by id:
+# source -> [(id column, dimension table, {name column: dimension table column})]
+dims_dir = 'data/dims/'
+dim_id_cols = {'players': 'PERSON_ID', 'teams': 'TEAM_ID'}
+name_columns = {
+    'pbp': [(f'PLAYER{k}{col}', dim, names) for k in [1, 2, 3] for col, dim, names in 
+            [('_ID', 'players', {f'PLAYER{k}_NAME': 'PLAYER_NAME'}),
+             ('_TEAM_ID', 'teams', {f'PLAYER{k}_TEAM_CITY': 'TEAM_CITY',
+                                    f'PLAYER{k}_TEAM_NICKNAME': 'TEAM_NICKNAME',
+                                    f'PLAYER{k}_TEAM_ABBREVIATION': 'TEAM_ABBREVIATION'})]],
+    # GameRotation's city (i.e. LA Clippers, L.A. Lakers) isn't always the play by play's
+    'gr': [('TEAM_ID', 'teams', {'TEAM_CITY': 'TEAM_CITY_GR', 'TEAM_NAME': 'TEAM_NICKNAME'}),
+           ('PERSON_ID', 'players', {'PLAYER_FIRST': 'PLAYER_FIRST', 'PLAYER_LAST': 'PLAYER_LAST'})]
+}
+
+def get_season_suffix(season_type='Regular Season'):
+    '''
+    Given a season type (Regular Season, PlayIn, Playoffs),
+    returns the suffix used in the names of its data files/directories
+    (i.e. df_lgl_T_2023-24_po.csv, game_rotations/2023-24_po/)
+    '''
+    return season_type_suffixes.get(season_type, '')
+
+def get_dim_fpath(dim, data_dir=dims_dir):
+    '''
+    Path of a saved dimension table (players or teams)
+    '''
+    return os.path.join(data_dir, f'df_{dim}.csv')
+
+@lru_cache(maxsize=4)
+def _load_dims(file_versions):
+
+    dims = {}
+    for (dim, id_col), file_version in zip(dim_id_cols.items(), file_versions):
+        if file_version is None:
+            dims[dim] = pd.DataFrame(index=pd.Index([], dtype='int64', name=id_col))
+        else:
+            dims[dim] = pd.read_csv(get_dim_fpath(dim), index_col=id_col, dtype=str)
+            dims[dim].index = dims[dim].index.astype('int64')
+    return dims
+
+def load_dims():
+    '''
+    Loads the saved player and team dimension tables
+    (a dictionary of dataframes indexed by PERSON_ID and TEAM_ID),
+    re-reading them only when they've changed
+    '''
+    file_versions = []
+    for dim in dim_id_cols:
+        fpath = get_dim_fpath(dim)
+        file_version = None
+        if os.path.exists(fpath):
+            fstat = os.stat(fpath)
+            file_version = (fstat.st_size, fstat.st_mtime_ns)
+        file_versions.append(file_version)
+
+    return _load_dims(tuple(file_versions))
+
+def get_read_columns(source, columns):
+    '''
+    Given a source (pbp or gr) and the columns asked for,
+    returns the columns to read from the saved files: 
+    the same, plus the ids of the asked for name columns
+    (saved files may or may not still have their name columns)
+    '''
+    read_columns = list(columns)
+    for id_col, _, names in name_columns[source]:
+        if any(col in names for col in columns) and id_col not in read_columns:
+            read_columns.append(id_col)
+    return read_columns
+
+def join_names(df, source, columns=None):
+    '''
+    Given a dataframe read from saved game files of a source (pbp or gr),
+    joins in its name columns from the dimension tables 
+    (only the ones in columns, if given), each right after its id column,
+    filling in only what's missing (files saved before the names were factored out 
+    still have them)
+    '''
+    dims = load_dims()
+    for id_col, dim, names in name_columns[source]:
+        names = {col: dim_col for col, dim_col in names.items() if columns is None or col in columns}
+        if len(names) == 0 or id_col not in df.columns:
+            continue
+        
+        i_insert = df.columns.get_loc(id_col) + 1
+        for col, dim_col in names.items():
+            if dim_col in dims[dim].columns:
+                joined = df[id_col].map(dims[dim][dim_col])
+            else:
+                joined = pd.Series(np.nan, index=df.index, dtype=object)
+            if col in df.columns:
+                df[col] = df[col].fillna(joined)
+            else:
+                df.insert(i_insert, col, joined)
+            i_insert = df.columns.get_loc(col) + 1
+
+    return df
+
+def clean_names(df, source, columns=None, names=True):
+    '''
+    Joins the name columns asked for into a dataframe read from saved game files
+    of a source (pbp or gr), i.e. the ones in columns if given (dropping the ids
+    only read to join them, see get_read_columns), otherwise all of them if names is True
+    '''
+    if columns is not None:
+        df = join_names(df, source, columns)
+        return df.drop(columns=[col for col in df.columns if col not in columns and col != 'GAME_ID'])
+
+    if names:
+        return join_names(df, source)
+    
+    # files saved before the names were factored out still have them
+    return df.drop(columns=[col for _, _, d_names in name_columns[source] for col in d_names
+                            if col in df.columns])
+
+@profile_function
 def get_gr(season_str, game_id,
-           season_type='Regular Season'):
+           season_type='Regular Season', names=True):
     '''
     Given a season string (i.e. 2023-24),
     and an nba.com/stats game_id (i.e. '0022300408'),
     retrieves game_rotations dataframe 
     from internal data directory
-    if it exists.
+    if it exists, with its team and player names
+    joined in unless names is False.
 
     This directory is updated daily to add new
     game_rotation dataframes.    
     '''
     df_gr = pd.DataFrame()
 
-    suffix = ''
-    if season_type == 'Playoffs':
-        suffix = '_po'
-    elif season_type == 'PlayIn': 
-        suffix = '_pi'
+    suffix = get_season_suffix(season_type)
     season_dir = os.path.join(f'data/game_rotations/{season_str}{suffix}')
     if os.path.isdir(season_dir):
 
-        existing_files = os.listdir(season_dir)
-
         cur_fname = f'df_gr_{game_id}.csv'
 
-        if cur_fname in existing_files:
+        if os.path.isfile(os.path.join(season_dir, cur_fname)):
             df_gr = pd.read_csv(os.path.join(season_dir, cur_fname),
                                 index_col=0,
                                 dtype={'GAME_ID': 'string'})
+            df_gr = clean_names(df_gr, 'gr', names=names)
 
     return df_gr
 
@@ -54,17 +185,19 @@ def clean_pbp(df_pbp):
     '''
     newscores = df_pbp['SCOREMARGIN'].str.replace('TIE', '0')
     df_pbp = df_pbp.drop(columns='SCOREMARGIN')
-    df_pbp['SCOREMARGIN'] = [np.nan if pd.isna(x) else int(x) for x in newscores]
+    df_pbp['SCOREMARGIN'] = pd.to_numeric(newscores).to_numpy(dtype=float, na_value=np.nan)
     return df_pbp
 
+@profile_function
 def get_pbp(season_str, game_id,
-            season_type='Regular Season'):
+            season_type='Regular Season', names=True):
     '''
     Given a season string (i.e. 2023-24),
     and an nba.com/stats game_id (i.e. '0022300408'),
     retrieves play by play dataframe 
     from internal data directory
-    if it exists.
+    if it exists, with its player and team names
+    joined in unless names is False.
 
     This directory is updated daily to add new
     play by play dataframes.    
@@ -72,27 +205,338 @@ def get_pbp(season_str, game_id,
 
     df_pbp = pd.DataFrame()
 
-    suffix = ''
-    if season_type == 'Playoffs':
-        suffix = '_po'
-    elif season_type == 'PlayIn': 
-        suffix = '_pi'
+    suffix = get_season_suffix(season_type)
     season_dir = os.path.join(f'data/pbps/{season_str}{suffix}')
     if os.path.isdir(season_dir):
 
-        existing_files = os.listdir(season_dir)
-
         cur_fname = f'df_pbp_{game_id}.csv'
 
-        if cur_fname in existing_files:
+        if os.path.isfile(os.path.join(season_dir, cur_fname)):
             df_pbp = pd.read_csv(os.path.join(season_dir, cur_fname),
                                 index_col=0,
                                 dtype={'GAME_ID': 'string', 'SCOREMARGIN': 'string'})
             
             df_pbp = clean_pbp(df_pbp)
+            df_pbp = clean_names(df_pbp, 'pbp', names=names)
             
     return df_pbp
 
+def get_game_data_version(season_str, game_id,
+                          season_type='Regular Season'):
+    '''
+    Given a season string (i.e. 2023-24),
+    and an nba.com/stats game_id (i.e. '0022300408'),
+    returns a string identifying the version of the game's saved
+    game rotation and play by play files (their sizes and modification times),
+    or None if either is missing
+    '''
+    suffix = get_season_suffix(season_type)
+    fpaths = [f'data/game_rotations/{season_str}{suffix}/df_gr_{game_id}.csv',
+              f'data/pbps/{season_str}{suffix}/df_pbp_{game_id}.csv']
+    
+    version = []
+    for fpath in fpaths:
+        if not os.path.exists(fpath):
+            return None
+        fstat = os.stat(fpath)
+        version.append(f'{fstat.st_size}-{fstat.st_mtime_ns}')
+    
+    return '_'.join(version)
+
+def get_game_fpaths(data_subdir, fprefix, season_str, game_ids=None,
+                    season_type='Regular Season'):
+    '''
+    Lists the saved files (i.e. data/game_rotations/2023-24/df_gr_*.csv)
+    for a season, in one pass over its directory, 
+    returning a dictionary of game_id -> file path 
+    for the requested game_ids (or all games if game_ids is None),
+    skipping games that don't have a saved file
+    '''
+    suffix = get_season_suffix(season_type)
+    season_dir = os.path.join(f'data/{data_subdir}/{season_str}{suffix}')
+
+    d_fpaths = {}
+    if os.path.isdir(season_dir):
+        for fname in os.listdir(season_dir):
+            if fname.startswith(fprefix) and fname.endswith('.csv'):
+                d_fpaths[fname[len(fprefix):-4]] = os.path.join(season_dir, fname)
+    
+    if game_ids is None:
+        game_ids = sorted(d_fpaths)
+    
+    return {game_id: d_fpaths[game_id] for game_id in game_ids if game_id in d_fpaths}
+
+def get_game_file_versions(data_subdir, fprefix, season_str, season_type='Regular Season'):
+    '''
+    The version of a season's saved files (see get_game_fpaths):
+    (game_id, size, modification time) of each, in game_id order,
+    to key caches of whole season loads on, so they're reloaded after the nightly update
+    '''
+    versions = []
+    for game_id, fpath in get_game_fpaths(data_subdir, fprefix, season_str, season_type=season_type).items():
+        fstat = os.stat(fpath)
+        versions.append((game_id, fstat.st_size, fstat.st_mtime_ns))
+    return tuple(versions)
+
+def read_game_csvs(fpaths, dtype, columns=None, 
+                   chunksize=None, n_workers=8, clean_fn=None):
+    '''
+    Reads per-game csv files, optionally only the given columns (plus GAME_ID),
+    applying clean_fn to the result,
+    and returns one concatenated dataframe, or if chunksize is given, 
+    an iterator of concatenated dataframes of chunksize games each
+    (so only one chunk is in memory at a time).
+
+    Rather than parsing each (small) file separately, 
+    the files are read in parallel (n_workers threads), 
+    and the rows of files with the same header are joined
+    and parsed by pandas in one go, which is much faster.
+    '''
+    read_kwargs = {'dtype': dtype}
+    if columns is None:
+        read_kwargs['index_col'] = 0
+    else:
+        # not every file has every column (see get_read_columns)
+        usecols = set(['GAME_ID'] + list(columns))
+        read_kwargs['usecols'] = lambda col: col in usecols
+
+    def read_one(fpath):
+        with open(fpath, 'rb') as f:
+            contents = f.read()
+        i_body = contents.find(b'\n') + 1
+        body = contents[i_body:]
+        if len(body) > 0 and not body.endswith(b'\n'):
+            body += b'\n'
+        return contents[:i_body], body
+
+    def parse_chunk(headers_bodies):
+        # group rows by header, in case columns differ between files
+        d_header_bodies = {}
+        for header, body in headers_bodies:
+            d_header_bodies.setdefault(header, []).append(body)
+        
+        df = pd.concat([pd.read_csv(io.BytesIO(header + b''.join(bodies)), **read_kwargs)
+                        for header, bodies in d_header_bodies.items()],
+                       ignore_index=True)
+        if clean_fn is not None:
+            df = clean_fn(df)
+        return df
+
+    def read_chunks():
+        n_per_chunk = chunksize or max(1, len(fpaths))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for i in range(0, len(fpaths), n_per_chunk):
+                yield parse_chunk(executor.map(read_one, fpaths[i:i + n_per_chunk]))
+    
+    if chunksize is not None:
+        return read_chunks()
+    
+    if len(fpaths) == 0:
+        return pd.DataFrame()
+    
+    return next(read_chunks())
+
+def get_grs(season_str, game_ids=None,
+            season_type='Regular Season',
+            columns=None, chunksize=None, n_workers=8, names=True):
+    '''
+    Batch version of get_gr:
+    given a season string (i.e. 2023-24),
+    and a list of nba.com/stats game_ids (or None for every saved game in the season),
+    retrieves their game_rotations dataframes in one pass over the data directory,
+    reading files in parallel (n_workers threads).
+
+    Returns one concatenated dataframe, or an iterator of dataframes 
+    of chunksize games each if chunksize is given.
+    If columns is given, only those columns (plus GAME_ID) are read,
+    otherwise all of them (without the team and player names if names is False).
+    Games without saved data are skipped.
+    '''
+    d_fpaths = get_game_fpaths('game_rotations', 'df_gr_', season_str, game_ids, season_type)
+
+    return read_game_csvs(list(d_fpaths.values()), 
+                          dtype={'GAME_ID': 'string'},
+                          columns=None if columns is None else get_read_columns('gr', columns), 
+                          chunksize=chunksize, n_workers=n_workers,
+                          clean_fn=lambda df_gr: clean_names(df_gr, 'gr', columns, names))
+
+def get_pbps(season_str, game_ids=None,
+             season_type='Regular Season',
+             columns=None, chunksize=None, n_workers=8, names=True):
+    '''
+    Batch version of get_pbp:
+    given a season string (i.e. 2023-24),
+    and a list of nba.com/stats game_ids (or None for every saved game in the season),
+    retrieves their play by play dataframes in one pass over the data directory,
+    reading files in parallel (n_workers threads).
+
+    Returns one concatenated dataframe, or an iterator of dataframes 
+    of chunksize games each if chunksize is given.
+    If columns is given, only those columns (plus GAME_ID) are read,
+    otherwise all of them (without the player and team names if names is False).
+    Games without saved data are skipped.
+    '''
+    d_fpaths = get_game_fpaths('pbps', 'df_pbp_', season_str, game_ids, season_type)
+
+    def clean_fn(df_pbp):
+        if 'SCOREMARGIN' in df_pbp.columns:
+            df_pbp = clean_pbp(df_pbp)
+        return clean_names(df_pbp, 'pbp', columns, names)
+
+    return read_game_csvs(list(d_fpaths.values()), 
+                          dtype={'GAME_ID': 'string', 'SCOREMARGIN': 'string'},
+                          columns=None if columns is None else get_read_columns('pbp', columns), 
+                          chunksize=chunksize, n_workers=n_workers,
+                          clean_fn=clean_fn)
+
+def get_lgls(season_strs, data_dir='data/'):
+    '''
+    Given a list of season strings (i.e. ['2023-24', '2022-23']),
+    loads the team and player league game logs
+    for all regular season, play-in, and playoff games in them,
+    returning one team and one player game log dataframe
+    (with season_str and season_type columns added)
+    '''
+    return LeagueGameLogStore(season_strs, data_dir).get_lgls()
+
+def read_lgl_rows(fpath, offset=0, end=None):
+    '''
+    Reads the rows of a saved league game log CSV from byte offset
+    (at the start of a row) up to byte end (None for the end of the file),
+    returning them as a dataframe (indexed by row number)
+    '''
+    with open(fpath, 'rb') as f:
+        header = f.readline()
+        f.seek(max(offset, len(header)))
+        rows = f.read() if end is None else f.read(max(0, end - f.tell()))
+
+    return pd.read_csv(io.BytesIO(header + rows), dtype={'GAME_ID': str}, index_col=0)
+
+class LeagueGameLogStore:
+    '''
+    The league game logs of a list of seasons (see get_lgls),
+    kept up to date with the saved files without re-reading them:
+    the nightly update only rewrites the end of a game log, and records where
+    it started writing in the game log's index (see data/lgls/get_lgls.py),
+    so refresh only reads the rows that changed since the last read
+    (and the game logs saved since, like a season's first playoff game log).
+    '''
+
+    def __init__(self, season_strs, data_dir='data/'):
+        # every game log the seasons may have, in order
+        # (a season's play-in and playoff logs are only saved once they start)
+        self.fpaths = {}
+        for s_str in season_strs:
+            for season_type, s_type in season_type_suffixes.items():
+                for let in ['T', 'P']:
+                    self.fpaths[(let, s_str, season_type)] = os.path.join(data_dir, f'lgls/df_lgl_{let}_{s_str}{s_type}.csv')
+
+        # refreshes come from sessions and from the rotation endpoint's threads
+        self.lock = threading.Lock()
+        self.lgls = {}
+        self.refresh()
+
+    @staticmethod
+    def get_file_state(fpath):
+        '''
+        Version (from the index, if there is one), size and modification time of a saved game log
+        '''
+        fpath_idx = fpath.replace('.csv', '_idx.json')
+        index = None
+        if os.path.exists(fpath_idx):
+            with open(fpath_idx) as f:
+                index = json.load(f)
+        stat = os.stat(fpath)
+        return index, (None if index is None else index['version'], stat.st_size, stat.st_mtime)
+
+    def read_lgl(self, fpath, s_str, season_type):
+        '''
+        Reads a whole saved game log, returning what's kept of it:
+        its path, dataframe and state when read
+        '''
+        index, state = self.get_file_state(fpath)
+        df_lgl = read_lgl_rows(fpath, end=None if index is None else index['size'])
+        df_lgl['season_str'] = s_str
+        df_lgl['season_type'] = season_type
+        return {'fpath': fpath, 'df': df_lgl, 'state': state}
+
+    def update_lgl(self, key):
+        '''
+        Brings a game log up to date with its saved file,
+        only reading the rows written since it was last read when possible.
+        Returns whether it changed.
+        '''
+        lgl = self.lgls[key]
+        _, s_str, season_type = key
+        index, state = self.get_file_state(lgl['fpath'])
+        if state == lgl['state']:
+            return False
+
+        version = lgl['state'][0]
+        updates = [] if index is None else [u for u in index['updates'] if u['version'] > version]
+
+        # without an unbroken record of updates since the last read, read it all again
+        if version is None or len(updates) == 0 or updates[0]['version'] != version + 1:
+            self.lgls[key] = self.read_lgl(lgl['fpath'], s_str, season_type)
+            return True
+
+        changed = min(updates, key=lambda u: u['offset'])
+        df_new = read_lgl_rows(lgl['fpath'], changed['offset'], index['size'])
+        df_new['season_str'] = s_str
+        df_new['season_type'] = season_type
+
+        df_lgl = lgl['df']
+        self.lgls[key] = {'fpath': lgl['fpath'],
+                          'df': pd.concat([df_lgl[df_lgl.index < changed['row']], df_new]),
+                          'state': state}
+        return True
+
+    def concat_lgls(self):
+        self.df_lgl_T_all = pd.concat([lgl['df'] for (let, _, _), lgl in self.lgls.items() if let == 'T'])
+        self.df_lgl_P_all = pd.concat([lgl['df'] for (let, _, _), lgl in self.lgls.items() if let == 'P'])
+
+    def get_file_states(self):
+        '''
+        Sizes and modification times of all the saved game logs and their indexes,
+        None for those not saved (yet) (cheap, to check for changes)
+        '''
+        states = []
+        for lgl_fpath in self.fpaths.values():
+            for fpath in [lgl_fpath, lgl_fpath.replace('.csv', '_idx.json')]:
+                if os.path.exists(fpath):
+                    stat = os.stat(fpath)
+                    states.append((stat.st_size, stat.st_mtime))
+                else:
+                    states.append(None)
+        return tuple(states)
+
+    def refresh(self):
+        '''
+        Brings all game logs up to date with their saved files,
+        reading any saved since the last refresh,
+        returning whether any changed
+        '''
+        with self.lock:
+            changed = False
+            for key, fpath in self.fpaths.items():
+                if key in self.lgls:
+                    changed |= self.update_lgl(key)
+                elif os.path.exists(fpath):
+                    self.lgls[key] = self.read_lgl(fpath, *key[1:])
+                    changed = True
+
+            if changed:
+                # in the order of the seasons
+                self.lgls = {key: self.lgls[key] for key in self.fpaths if key in self.lgls}
+                self.concat_lgls()
+            return changed
+
+    def get_lgls(self):
+        '''
+        The team and player game logs, as returned by get_lgls
+        '''
+        return self.df_lgl_T_all, self.df_lgl_P_all
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,481 @@
+"""
+Load testing harness for the shiny app, i.e.
+
+    python load_test.py --sessions 8 --actions 20 --out report.json
+    python load_test.py --sessions 8 --workers 4 --baseline report.json
+    python load_test.py --sessions 64 --memory-audit --out report.json
+    python load_test.py --sessions 16 --actions 4 --expect-step-down
+
+Starts the app locally (or uses an already running one with --url),
+and drives concurrent simulated browser sessions over shiny's websocket protocol:
+each session picks seasons, teams, opponents and games, and toggles
+the plot settings (stint coloring, colormap, shift annotations),
+pausing between actions like a user would.
+
+Like a browser, a session follows the server's updates to its inputs
+(i.e. a new list of games selects the first game), so an action takes
+however many server round trips it would in the browser.
+
+Records the latency of every output (time from the action until the
+output's new value arrives) and of whole actions, as percentiles,
+throughput, and the server's CPU and memory use (peak RSS, and its
+growth per session), and writes them to a JSON report, comparable
+between runs with --baseline.
+
+With --memory-audit, the app also accounts for each session's memory,
+per reactive calc and output (see memory_utils.py), which is added
+to the report (for a single worker, or whichever worker answers).
+
+The number of plots rendered at each quality profile (see render_quality.py)
+is also added, and with --expect-step-down, the run fails (exit status 1)
+unless the app stepped its plot quality down under the load.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import threading
+import urllib.request
+import numpy as np
+import psutil
+import websockets
+
+from load_data_utils import season_strs
+
+
+# how often each action is taken by a simulated user
+action_weights = {'game_id': 10, 'plot_cmap_name': 3, 'stint_val': 2, 'checkbox_plottext': 1,
+                  'team1': 2, 'team2': 1, 'season_str': 1, 'season_type': 1}
+
+season_types = ['Regular Season', 'PlayIn', 'Playoffs']
+stint_vals = ['pm', 'player_pts', 'none']
+
+init_inputs = {'season_str': season_strs[0], 'season_type': 'Playoffs',
+               'team1': 'All', 'team1_homestat': 'either home or away', 'team2': 'All',
+               'game_id': '', 'stint_val': 'pm', 'checkbox_plottext': True, 'plot_cmap_name': 'RdBu_r',
+               'gallery_mode': False, 'search_order': 'date', 'search_min_deficit': 0,
+               'search_min_lead_changes': 0, 'search_max_final_margin': 60, 'search_ot_only': False}
+
+# the app's outputs, which the browser reports as visible (shiny only computes those)
+output_ids = ['plot', 'away_box', 'home_box', 'similar_games', 'lastupdatetxt']
+
+# the browser's (clientdata) size of the plot output, per device
+client_profiles = {'desktop': {'.clientdata_output_plot_width': 1200, '.clientdata_pixelratio': 1},
+                   'mobile': {'.clientdata_output_plot_width': 390, '.clientdata_pixelratio': 3}}
+
+percentiles = [50, 90, 95, 99]
+
+
+class SimSession:
+    '''
+    One simulated browser session, keeping track of its inputs,
+    and the choices the server has offered for them
+    '''
+    def __init__(self, url, rng, client_profile, timeout):
+        self.url = url
+        self.rng = rng
+        self.client_profile = client_profile
+        self.timeout = timeout
+        self.inputs = dict(init_inputs)
+        self.choices = {}
+        self.latencies = {}
+        self.action_latencies = []
+        self.n_errors = 0
+
+    async def run_cycle(self, ws, t_start):
+        '''
+        Waits for the server to finish reacting to the last update
+        (busy, idle, then the new values, and those of any outputs still
+        rendering in the background), recording the outputs' latencies,
+        and returns the input updates the browser would then send
+        '''
+        got_idle = False
+        in_progress = set()
+        while True:
+            msg = json.loads(await asyncio.wait_for(ws.recv(), self.timeout))
+
+            if msg.get('busy') == 'idle':
+                got_idle = True
+
+            # outputs waiting on a background task (i.e. the plot, see app.py's plot_task)
+            # stay in progress past the flush, until their value arrives
+            progress = msg.get('progress', {})
+            if progress.get('type') == 'binding' and progress['message'].get('persistent'):
+                in_progress.add(progress['message']['id'])
+
+            for name in msg.get('values', {}):
+                self.latencies.setdefault(name, []).append(time.perf_counter() - t_start)
+                in_progress.discard(name)
+            if msg.get('errors'):
+                self.n_errors += len(msg['errors'])
+                in_progress.difference_update(msg['errors'])
+
+            updates = {}
+            for input_msg in msg.get('inputMessages', []):
+                updates.update(self.apply_input_message(input_msg['id'], input_msg['message']))
+
+            if got_idle and 'values' in msg and len(in_progress) == 0:
+                return updates
+
+    def apply_input_message(self, input_id, message):
+        '''
+        Applies a server update to an input (new choices or value)
+        as the browser would, returning the resulting input changes
+        '''
+        updates = {}
+
+        if 'options' in message:
+            options = re.findall(r'value="([^"]*)"', message['options'])
+            self.choices[input_id] = options
+            # selectize keeps its value if it's still a choice, otherwise takes the first one
+            if self.inputs.get(input_id) not in options:
+                updates[input_id] = options[0] if len(options) > 0 else ''
+
+        if 'value' in message and message['value'] != self.inputs.get(input_id):
+            updates[input_id] = message['value']
+
+        self.inputs.update(updates)
+        return updates
+
+    def pick_action(self):
+        '''
+        Picks the next user action, as an input update
+        '''
+        input_id = self.rng.choices(list(action_weights), weights=list(action_weights.values()))[0]
+        cur_value = self.inputs.get(input_id)
+
+        if input_id == 'checkbox_plottext':
+            return {input_id: not cur_value}
+
+        options = {'season_str': season_strs,
+                   'season_type': season_types,
+                   'stint_val': stint_vals}.get(input_id, self.choices.get(input_id, []))
+        options = [x for x in options if x != cur_value]
+        if len(options) == 0:
+            return {}
+
+        return {input_id: self.rng.choice(options)}
+
+    async def run(self, n_actions, think_secs):
+        '''
+        Connects to the app, and takes n_actions actions,
+        waiting a random time up to think_secs between them
+        '''
+        async with websockets.connect(self.url, max_size=None) as ws:
+
+            t_start = time.perf_counter()
+            clientdata = {f'.clientdata_output_{output_id}_hidden': False for output_id in output_ids}
+            clientdata['.clientdata_url_search'] = ''
+            await ws.send(json.dumps({'method': 'init',
+                                      'data': {**self.inputs, **clientdata, **self.client_profile}}))
+            await self.follow_updates(ws, t_start)
+
+            for _ in range(n_actions):
+                await asyncio.sleep(self.rng.uniform(0, think_secs))
+
+                action = self.pick_action()
+                if len(action) == 0:
+                    continue
+                self.inputs.update(action)
+
+                t_start = time.perf_counter()
+                await ws.send(json.dumps({'method': 'update', 'data': action}))
+                await self.follow_updates(ws, t_start)
+
+    async def follow_updates(self, ws, t_start):
+        '''
+        Waits for the server to react to an action, and to the
+        input updates the browser would send back in turn,
+        recording the whole action's latency
+        '''
+        updates = await self.run_cycle(ws, t_start)
+        while len(updates) > 0:
+            await ws.send(json.dumps({'method': 'update', 'data': updates}))
+            updates = await self.run_cycle(ws, t_start)
+
+        self.action_latencies.append(time.perf_counter() - t_start)
+
+
+class ResourceMonitor(threading.Thread):
+    '''
+    Samples the CPU use (percent of a core) and memory (RSS)
+    of a server process and its children (workers), in the background
+    '''
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percents = []
+        self.rss_bytes = []
+        self.stopped = threading.Event()
+
+    def get_procs(self):
+        proc = psutil.Process(self.pid)
+        return [proc] + proc.children(recursive=True)
+
+    def run(self):
+        procs = {}
+        while not self.stopped.is_set():
+            try:
+                cur_procs = self.get_procs()
+            except psutil.NoSuchProcess:
+                break
+            cpu_percent = 0
+            rss = 0
+            for proc in cur_procs:
+                try:
+                    # cpu_percent is measured since the last call on the same Process object
+                    proc = procs.setdefault(proc.pid, proc)
+                    cpu_percent += proc.cpu_percent()
+                    rss += proc.memory_info().rss
+                except psutil.NoSuchProcess:
+                    continue
+            self.cpu_percents.append(cpu_percent)
+            self.rss_bytes.append(rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def start_server(port, workers, memory_audit=False):
+    '''
+    Starts the app on localhost (with serve.py for multiple workers),
+    returning the process once it's accepting requests
+    '''
+    env = dict(os.environ)
+    if memory_audit:
+        env['ROTATION_MEMORY_AUDIT'] = '1'
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    if workers > 1:
+        cmd = [sys.executable, 'serve.py', '--workers', str(workers), '--port', str(port)]
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(port)]
+    proc = subprocess.Popen(cmd, cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    t_start = time.time()
+    while time.time() - t_start < 120:
+        if proc.poll() is not None:
+            raise RuntimeError('app exited while starting, with code {}'.format(proc.returncode))
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.5)
+
+    proc.terminate()
+    raise RuntimeError('app did not start within 120 s')
+
+def get_app_report(http_url, path):
+    '''
+    One of the app's JSON reports: memory accounting (memory, see memory_utils.py)
+    or render quality (render-quality, see render_quality.py),
+    or None if it isn't served
+    '''
+    try:
+        with urllib.request.urlopen(http_url + path, timeout=10) as f:
+            return json.load(f)
+    except OSError:
+        return None
+
+def summarize(vals):
+    '''
+    Count, mean, and percentiles of a list of latencies (in ms)
+    '''
+    if len(vals) == 0:
+        return {'n': 0}
+    vals_ms = 1000*np.asarray(vals)
+    summary = {'n': len(vals_ms), 'mean_ms': round(float(vals_ms.mean()), 1)}
+    for p in percentiles:
+        summary[f'p{p}_ms'] = round(float(np.percentile(vals_ms, p)), 1)
+    return summary
+
+async def run_sessions(url, n_sessions, n_actions, think_secs, mobile_frac, seed, timeout):
+    '''
+    Runs n_sessions simulated sessions concurrently,
+    returning the sessions and the wall time taken
+    '''
+    rng = random.Random(seed)
+    sessions = []
+    for _ in range(n_sessions):
+        client_profile = client_profiles['mobile' if rng.random() < mobile_frac else 'desktop']
+        sessions.append(SimSession(url, random.Random(rng.random()), client_profile, timeout))
+
+    t_start = time.perf_counter()
+    results = await asyncio.gather(*[s.run(n_actions, think_secs) for s in sessions],
+                                   return_exceptions=True)
+    wall_secs = time.perf_counter() - t_start
+
+    for result in results:
+        if isinstance(result, Exception):
+            print('session failed: {!r}'.format(result))
+
+    return sessions, results, wall_secs
+
+def make_report(config, sessions, results, wall_secs, monitor, memory_report=None, quality_report=None):
+    '''
+    Collects the sessions' latencies and the server's resource use into a report
+    '''
+    latencies = {}
+    for session in sessions:
+        for name, vals in session.latencies.items():
+            latencies.setdefault(name, []).extend(vals)
+    action_latencies = [x for session in sessions for x in session.action_latencies]
+
+    report = {'config': config,
+              'wall_secs': round(wall_secs, 2),
+              'n_failed_sessions': sum(isinstance(x, Exception) for x in results),
+              'n_output_errors': sum(session.n_errors for session in sessions),
+              'actions_per_sec': round(len(action_latencies)/wall_secs, 2),
+              'actions': summarize(action_latencies),
+              'outputs': {name: summarize(vals) for name, vals in sorted(latencies.items())}}
+
+    if monitor is not None and len(monitor.cpu_percents) > 0:
+        report['server'] = {'cpu_percent_mean': round(float(np.mean(monitor.cpu_percents)), 1),
+                            'cpu_percent_max': round(float(np.max(monitor.cpu_percents)), 1),
+                            'rss_mb_start': round(monitor.rss_bytes[0]/1e6, 1),
+                            'rss_mb_max': round(max(monitor.rss_bytes)/1e6, 1),
+                            'rss_mb_end': round(monitor.rss_bytes[-1]/1e6, 1),
+                            'rss_mb_per_session': round((max(monitor.rss_bytes) - monitor.rss_bytes[0])
+                                                        /1e6/max(1, len(sessions)), 2)}
+
+    if memory_report is not None:
+        report['memory'] = memory_report
+
+    if quality_report is not None:
+        report['render_quality'] = quality_report
+
+    return report
+
+def print_report(report, baseline=None):
+    '''
+    Prints a report's latencies, throughput and resource use,
+    along with the change from a baseline report
+    '''
+    def fmt(val, base_val):
+        if base_val is None or base_val == 0:
+            return f'{val}'
+        return '{} ({:+.0f}%)'.format(val, 100*(val - base_val)/base_val)
+
+    base_outputs = baseline['outputs'] if baseline else {}
+    rows = [('actions', report['actions'], baseline['actions'] if baseline else {})]
+    rows += [(name, summary, base_outputs.get(name, {})) for name, summary in report['outputs'].items()]
+
+    print('{:<16} {:>6} '.format('latency', 'n') + ' '.join(f'{"p"+str(p)+" ms":>16}' for p in percentiles))
+    for name, summary, base_summary in rows:
+        if summary['n'] == 0:
+            continue
+        print('{:<16} {:>6} '.format(name, summary['n']) +
+              ' '.join('{:>16}'.format(fmt(summary[f'p{p}_ms'], base_summary.get(f'p{p}_ms')))
+                       for p in percentiles))
+
+    print('throughput: {} actions/s over {} s, {} failed sessions, {} output errors'.format(
+        fmt(report['actions_per_sec'], baseline['actions_per_sec'] if baseline else None),
+        report['wall_secs'], report['n_failed_sessions'], report['n_output_errors']))
+
+    if 'server' in report:
+        base_server = baseline.get('server', {}) if baseline else {}
+        print('server: ' + ', '.join('{} {}'.format(k, fmt(v, base_server.get(k)))
+                                     for k, v in report['server'].items()))
+
+    if 'memory' in report:
+        memory = report['memory']
+        print('worker: peak rss {} kB, traced {} kB; sessions: '.format(memory['peak_rss_kb'], memory['traced_kb']) +
+              ', '.join(f'{k} {v}' for k, v in memory['sessions'].items()))
+        if memory.get('lgl_index') is not None:
+            lgl_index = memory['lgl_index']
+            print('game log index: {} kB in each worker, over {} team and {} player rows{}'.format(
+                lgl_index['kb'], lgl_index['team_rows'], lgl_index['player_rows'],
+                ' (of game logs shared between workers)' if lgl_index['shared_lgls'] else ''))
+        print('{:<16} {:>6} {:>16} {:>16} {:>16}'.format('node', 'calls', 'net kB (mean)', 'peak kB (max)',
+                                                         'retained kB (max)'))
+        for name, stats in memory['nodes'].items():
+            print('{:<16} {:>6} {:>16} {:>16} {:>16}'.format(name, stats['calls'], stats['net_kb_mean'],
+                                                             stats['peak_kb_max'], stats['retained_kb_max']))
+
+    if 'render_quality' in report:
+        quality = report['render_quality']
+        print('plot quality: ' + ', '.join(f'{k} {v}' for k, v in quality['quality_stats'].items()) +
+              ' (now {}, queue {}, latency {} s)'.format(quality['quality'], quality['queue_depth'],
+                                                         quality['latency_secs']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load test the rotation app with simulated sessions')
+    parser.add_argument('--sessions', type=int, default=8, help='number of concurrent sessions')
+    parser.add_argument('--actions', type=int, default=20, help='actions per session')
+    parser.add_argument('--think-secs', type=float, default=1, help='max pause between actions')
+    parser.add_argument('--mobile-frac', type=float, default=0.3, help='fraction of sessions on phones')
+    parser.add_argument('--workers', type=int, default=1, help='app workers (if starting the app)')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', default=None, help='http url of an already running app')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=60, help='max secs to wait on the server')
+    parser.add_argument('--out', default=None, help='file to write the JSON report to')
+    parser.add_argument('--baseline', default=None, help='JSON report to compare against')
+    parser.add_argument('--memory-audit', action='store_true',
+                        help='account for per session memory in the app (if starting the app)')
+    parser.add_argument('--expect-step-down', action='store_true',
+                        help='fail unless the app rendered plots at a lower quality under the load')
+    args = parser.parse_args()
+
+    server_proc = None
+    monitor = None
+    if args.url is None:
+        server_proc = start_server(args.port, args.workers, args.memory_audit)
+        http_url = f'http://127.0.0.1:{args.port}/'
+        monitor = ResourceMonitor(server_proc.pid)
+        monitor.start()
+    else:
+        http_url = args.url if args.url.endswith('/') else args.url + '/'
+    ws_url = re.sub('^http', 'ws', http_url) + 'websocket/'
+
+    config = {'sessions': args.sessions, 'actions': args.actions, 'think_secs': args.think_secs,
+              'mobile_frac': args.mobile_frac, 'workers': args.workers if args.url is None else None,
+              'seed': args.seed, 'memory_audit': args.memory_audit,
+              'img_format': os.environ.get('ROTATION_IMG_FORMAT', 'webp'),
+              'started': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    memory_report = None
+    quality_report = None
+    try:
+        sessions, results, wall_secs = asyncio.run(
+            run_sessions(ws_url, args.sessions, args.actions, args.think_secs,
+                         args.mobile_frac, args.seed, args.timeout))
+        memory_report = get_app_report(http_url, 'memory')
+        quality_report = get_app_report(http_url, 'render-quality')
+    finally:
+        if monitor is not None:
+            monitor.stop()
+        if server_proc is not None:
+            server_proc.terminate()
+            server_proc.wait()
+
+    report = make_report(config, sessions, results, wall_secs, monitor, memory_report, quality_report)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'saving to... {args.out}')
+
+    if args.expect_step_down:
+        n_stepped_down = 0 if quality_report is None else \
+            sum(n for quality, n in quality_report['quality_stats'].items() if quality != 'full')
+        if n_stepped_down == 0:
+            print('expected plots rendered at a lower quality under the load, but none were')
+            sys.exit(1)
+        print(f'{n_stepped_down} plots rendered at a lower quality under the load')
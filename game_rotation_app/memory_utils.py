@@ -0,0 +1,214 @@
+'''
+Per session memory accounting of the app's reactive calcs and outputs,
+for sizing how many sessions a worker can hold.
+
+Accounting is off unless the ROTATION_MEMORY_AUDIT environment variable is set to 1,
+in which case python's allocations are traced (tracemalloc, which slows the app down),
+and every call of a reactive node wrapped with tracked records:
+ - the memory it allocated and kept (net) and at most (peak) while running,
+   including the calcs it called
+ - the size of the value it returned, which shiny keeps for the session
+   until the node reruns (retained). Read-only numpy arrays are shared
+   between sessions (see lgl_index_utils.py), so they count as nothing.
+Along with the worker's resident memory (current and peak RSS), and the size of
+its game log index (see lgl_index_utils.py), these are served
+as JSON at /memory (see make_memory_route, and load_test.py --memory-audit).
+
+The traced allocations of a node also count any other thread's
+(i.e. plot prefetching) made while it ran, so they're upper bounds.
+When accounting is off, tracked returns the node as it is.
+'''
+
+import os
+import sys
+import resource
+import threading
+import tracemalloc
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+from shiny import render
+from shiny.session import get_current_session
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from lgl_index_utils import get_index_report
+
+
+memory_audit = os.environ.get('ROTATION_MEMORY_AUDIT', '') == '1'
+
+# per node: number of calls, total and max net allocations, max peak allocations,
+# and max retained size
+node_stats = {}
+
+# per active session: the retained size of each node, and its largest total so far;
+# and the largest totals of the ended sessions
+session_retained = {}
+session_peaks = {}
+ended_session_peaks = []
+
+_stats_lock = threading.Lock()
+
+# the tracked calls running on each thread (calcs call calcs)
+_active = threading.local()
+
+
+def get_nbytes(value):
+    '''
+    Approximate memory (in bytes) kept by a reactive node's value,
+    not counting read-only numpy arrays (shared between sessions)
+    '''
+    if isinstance(value, (render.DataGrid, render.DataTable)):
+        value = value.data
+    if isinstance(value, np.ndarray):
+        if not value.flags.writeable:
+            return 0
+        if value.dtype == object:
+            return value.nbytes + sum(sys.getsizeof(x) for x in value.flat)
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        nbytes = value.memory_usage(deep=True, index=True)
+        return int(nbytes.sum() if isinstance(nbytes, pd.Series) else nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_nbytes(k) + get_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(get_nbytes(x) for x in value)
+    return sys.getsizeof(value)
+
+def record_call(name, session_id, net_bytes, peak_bytes, retained_bytes):
+    '''
+    Adds a tracked call's allocations and retained size to the node's and session's totals
+    '''
+    with _stats_lock:
+        n, tot_net, max_net, max_peak, max_retained = node_stats.get(name, (0, 0, 0, 0, 0))
+        node_stats[name] = (n + 1, tot_net + net_bytes, max(max_net, net_bytes),
+                            max(max_peak, peak_bytes), max(max_retained, retained_bytes))
+
+        if session_id is not None and session_id in session_retained:
+            session_retained[session_id][name] = retained_bytes
+            session_peaks[session_id] = max(session_peaks[session_id],
+                                            sum(session_retained[session_id].values()))
+
+def start_session(session):
+    '''
+    Starts accounting for a session's nodes, until the session ends
+    '''
+    if not memory_audit:
+        return
+
+    with _stats_lock:
+        session_retained[session.id] = {}
+        session_peaks[session.id] = 0
+
+    def end_session():
+        with _stats_lock:
+            session_retained.pop(session.id, None)
+            ended_session_peaks.append(session_peaks.pop(session.id, 0))
+
+    session.on_ended(end_session)
+
+def tracked(func):
+    '''
+    Decorator accounting for every call of a (sync) reactive calc or output,
+    under its name (see the top of this file), when accounting is on
+    '''
+    if not memory_audit:
+        return func
+
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_active, 'stack', None)
+        if stack is None:
+            stack = _active.stack = []
+
+        # the calls this one is inside of keep the peak so far, before it's reset
+        cur, peak = tracemalloc.get_traced_memory()
+        for call in stack:
+            call['peak'] = max(call['peak'], peak)
+        tracemalloc.reset_peak()
+        call = {'start': cur, 'peak': cur}
+        stack.append(call)
+
+        try:
+            value = func(*args, **kwargs)
+        finally:
+            cur, peak = tracemalloc.get_traced_memory()
+            stack.pop()
+            for outer_call in stack:
+                outer_call['peak'] = max(outer_call['peak'], peak)
+
+        session = get_current_session()
+        record_call(name, None if session is None else session.id,
+                    cur - call['start'], max(call['peak'], peak) - call['start'], get_nbytes(value))
+        return value
+
+    return wrapper
+
+def get_rss():
+    '''
+    The worker's current and peak resident memory (in bytes),
+    current being None where it can't be read
+    '''
+    # ru_maxrss is in kB on linux, bytes on macos
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss *= 1 if sys.platform == 'darwin' else 1024
+
+    cur_rss = None
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            cur_rss = int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+
+    return cur_rss, peak_rss
+
+def get_memory_report():
+    '''
+    The worker's memory use, and its nodes' and sessions' accounting, in kB
+    '''
+    cur_rss, peak_rss = get_rss()
+    report = {'rss_kb': None if cur_rss is None else round(cur_rss/1e3),
+              'peak_rss_kb': round(peak_rss/1e3),
+              'lgl_index': get_index_report(),
+              'memory_audit': memory_audit}
+    if not memory_audit:
+        return report
+
+    with _stats_lock:
+        report['traced_kb'] = round(tracemalloc.get_traced_memory()[0]/1e3)
+
+        retained = [sum(node_retained.values()) for node_retained in session_retained.values()]
+        peaks = list(session_peaks.values()) + ended_session_peaks
+        report['sessions'] = {'n_active': len(session_retained),
+                              'n_ended': len(ended_session_peaks),
+                              'retained_kb_mean': round(np.mean(retained)/1e3, 1) if retained else 0,
+                              'peak_retained_kb_mean': round(np.mean(peaks)/1e3, 1) if peaks else 0,
+                              'peak_retained_kb_max': round(max(peaks)/1e3, 1) if peaks else 0}
+
+        report['nodes'] = {name: {'calls': n,
+                                  'net_kb_mean': round(tot_net/n/1e3, 1),
+                                  'net_kb_max': round(max_net/1e3, 1),
+                                  'peak_kb_max': round(max_peak/1e3, 1),
+                                  'retained_kb_max': round(max_retained/1e3, 1)}
+                           for name, (n, tot_net, max_net, max_peak, max_retained)
+                           in sorted(node_stats.items(), key=lambda item: -item[1][3])}
+    return report
+
+def make_memory_route():
+    '''
+    Makes the starlette route serving the memory report (only when accounting is on)
+    '''
+
+    async def memory(request):
+
+        if not memory_audit:
+            return Response('memory accounting is off (set ROTATION_MEMORY_AUDIT=1)', status_code=404)
+
+        return JSONResponse(get_memory_report())
+
+    return Route('/memory', memory)
+
+
+if memory_audit:
+    tracemalloc.start()
@@ -0,0 +1,233 @@
+'''
+Utility functions for player on/off splits over arbitrary windows of games,
+(i.e. the whole game, the 4th quarter, or the last 5 minutes of regulation
+with the score within 5 points), across a whole season.
+
+The GameRotation endpoint only gives each stint's total point differential
+(PT_DIFF), so instead, every game's home - away score margin timeline
+(as in plot_utils.get_home_away_diff) is put into one sorted array
+for the season (each game offset in time so games don't overlap),
+along with running totals of the points scored and minutes played
+inside the window. The points and minutes in the window during each
+stint are then just differences of those running totals at the stint's
+in/out times, found for all stints at once with np.searchsorted.
+
+Scoring plays happening at the same game clock time as a substitution
+(i.e. free throws) are counted for the players on the floor before the substitution.
+
+Results are cached per season and window definition, so repeat queries are cheap,
+and keyed on the versions of the season's saved files, so they're recomputed
+after the nightly update.
+'''
+
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+from load_data_utils import get_grs, get_pbps, get_game_file_versions
+from plot_utils import convert_to_times
+
+
+# each game's times (in minutes) are offset by this much
+# in the season-wide timeline, so games don't overlap
+game_time_offset = 1000
+
+
+def get_margin_timelines(season_str, season_type='Regular Season'):
+    '''
+    Loads every saved play by play of a season, and returns
+    the home - away score margin timeline of each game, as arrays of
+    game_ids, game end times (in minutes), and the season-wide
+    (offset) event times and margins, sorted in time,
+    with each game starting at a margin of 0
+    '''
+    return _get_margin_timelines(season_str, season_type,
+                                 get_game_file_versions('pbps', 'df_pbp_', season_str, season_type))
+
+@lru_cache(maxsize=8)
+def _get_margin_timelines(season_str, season_type, pbp_versions):
+
+    df_pbp = get_pbps(season_str, season_type=season_type,
+                      columns=['EVENTNUM', 'PERIOD', 'PCTIMESTRING', 'SCOREMARGIN'])
+
+    game_ids, i_game = np.unique(df_pbp['GAME_ID'].to_numpy(dtype=str), return_inverse=True)
+
+    clock = df_pbp['PCTIMESTRING'].str.split(':', expand=True).astype(int)
+    times = convert_to_times(df_pbp['PERIOD'].values, clock[0].values, clock[1].values)
+
+    # the game ends at its last event
+    game_ends = np.zeros(len(game_ids))
+    np.maximum.at(game_ends, i_game, times)
+
+    # only keep scoring events, and a margin of 0 at the start of every game
+    margins = df_pbp['SCOREMARGIN'].values
+    has_score = ~np.isnan(margins)
+    times = np.concatenate((np.zeros(len(game_ids)), times[has_score]))
+    margins = np.concatenate((np.zeros(len(game_ids)), margins[has_score]))
+    i_event_game = np.concatenate((np.arange(len(game_ids)), i_game[has_score]))
+
+    # sort by game then time (stable, so same-time events stay in order)
+    event_times = i_event_game*game_time_offset + times
+    i_sort = np.argsort(event_times, kind='stable')
+
+    return game_ids, game_ends, event_times[i_sort], margins[i_sort]
+
+def get_season_stints(season_str, season_type='Regular Season'):
+    '''
+    Loads every saved game rotation of a season,
+    returning one dataframe of player stints with in/out times
+    in minutes (in_min, out_min)
+    '''
+    return _get_season_stints(season_str, season_type,
+                              get_game_file_versions('game_rotations', 'df_gr_', season_str, season_type))
+
+@lru_cache(maxsize=8)
+def _get_season_stints(season_str, season_type, gr_versions):
+
+    df_gr = get_grs(season_str, season_type=season_type,
+                    columns=['TEAM_ID', 'PERSON_ID', 'PLAYER_FIRST', 'PLAYER_LAST',
+                             'IN_TIME_REAL', 'OUT_TIME_REAL', 'PT_DIFF', 'h_a'])
+    df_gr['in_min'] = df_gr['IN_TIME_REAL']/60/10
+    df_gr['out_min'] = df_gr['OUT_TIME_REAL']/60/10
+
+    return df_gr
+
+def get_window_totals(event_times, margins, game_ends, start=0, end=None, max_margin=None):
+    '''
+    Given a season-wide margin timeline (see get_margin_timelines),
+    and a window of each game, from start to end (in minutes; end=None means
+    the end of the game, including OT) and optionally only while the
+    score margin is within max_margin points, returns, at each event,
+    the running totals of home - away points scored in the window
+    and of minutes elapsed in the window, along with a function
+    that evaluates those running totals at arbitrary (offset) times
+    '''
+    i_game = (event_times // game_time_offset).astype(int)
+    times = event_times - i_game*game_time_offset
+    game_ends = game_ends[i_game]
+    ends = game_ends if end is None else np.minimum(end, game_ends)
+
+    # the margin before each event, and whether the game is inside the window
+    # from each event until the next one
+    new_game = np.concatenate(([True], i_game[1:] != i_game[:-1]))
+    margins_before = np.where(new_game, 0, np.roll(margins, 1))
+    margin_ok = np.ones(len(margins), dtype=bool)
+    margin_ok_before = margin_ok
+    if max_margin is not None:
+        margin_ok = np.abs(margins) <= max_margin
+        margin_ok_before = np.abs(margins_before) <= max_margin
+
+    # points scored at each event, counted if the event was in the window
+    in_window = (times >= start) & (times <= ends) & margin_ok_before
+    pts = np.where(in_window, margins - margins_before, 0)
+    cum_pts = np.cumsum(pts)
+
+    # minutes in the window between each event and the next one
+    next_times = np.concatenate((times[1:], [0]))
+    next_times = np.where(np.concatenate((~new_game[1:], [False])), next_times, game_ends)
+    seg_mins = np.clip(np.minimum(next_times, ends) - np.maximum(times, start), 0, None)*margin_ok
+    cum_mins = np.concatenate(([0], np.cumsum(seg_mins)[:-1]))
+
+    def totals_at(query_times):
+        '''
+        Running totals of points and minutes in the window at (offset) times,
+        including all events at exactly those times
+        '''
+        i_event = np.searchsorted(event_times, query_times, side='right') - 1
+        query_mins = query_times - i_game[i_event]*game_time_offset
+        partial_mins = np.clip(np.minimum(query_mins, ends[i_event]) - np.maximum(times[i_event], start),
+                               0, None)*margin_ok[i_event]
+        return cum_pts[i_event], cum_mins[i_event] + partial_mins
+
+    return totals_at
+
+@lru_cache(maxsize=32)
+def _get_on_off(season_str, season_type, pbp_versions, gr_versions, start, end, max_margin):
+
+    game_ids, game_ends, event_times, margins = _get_margin_timelines(season_str, season_type, pbp_versions)
+    df_gr = _get_season_stints(season_str, season_type, gr_versions)
+
+    # only stints in games with a play by play
+    i_stint_game = np.searchsorted(game_ids, df_gr['GAME_ID'].to_numpy(dtype=str))
+    has_pbp = game_ids[np.minimum(i_stint_game, len(game_ids) - 1)] == df_gr['GAME_ID'].to_numpy(dtype=str)
+    df_gr = df_gr[has_pbp]
+    i_stint_game = i_stint_game[has_pbp]
+
+    totals_at = get_window_totals(event_times, margins, game_ends, start, end, max_margin)
+
+    # points (home - away) and minutes in the window during each stint
+    pts_in, mins_in = totals_at(i_stint_game*game_time_offset + df_gr['in_min'].values)
+    pts_out, mins_out = totals_at(i_stint_game*game_time_offset + df_gr['out_min'].values)
+    team_sign = np.where(df_gr['h_a'].values == 'home', 1, -1)
+
+    # and in the window over each whole game
+    pts_start, mins_start = totals_at(np.arange(len(game_ids))*game_time_offset)
+    pts_end, mins_end = totals_at(np.arange(len(game_ids))*game_time_offset + game_ends)
+
+    df_stints = pd.DataFrame({'GAME_ID': df_gr['GAME_ID'].values,
+                              'TEAM_ID': df_gr['TEAM_ID'].values,
+                              'PERSON_ID': df_gr['PERSON_ID'].values,
+                              'PLAYER_NAME': df_gr['PLAYER_FIRST'].values + ' ' + df_gr['PLAYER_LAST'].values,
+                              'on_min': mins_out - mins_in,
+                              'on_pm': team_sign*(pts_out - pts_in),
+                              'team_min': (mins_end - mins_start)[i_stint_game],
+                              'team_pm': team_sign*(pts_end - pts_start)[i_stint_game]})
+
+    # players' totals in each game, then over the season
+    df_games = (df_stints
+                .groupby(['PERSON_ID', 'PLAYER_NAME', 'TEAM_ID', 'GAME_ID'])
+                .agg({'on_min': 'sum', 'on_pm': 'sum', 'team_min': 'first', 'team_pm': 'first'})
+                )
+    df_on_off = (df_games
+                 .groupby(['PERSON_ID', 'PLAYER_NAME', 'TEAM_ID'])
+                 .agg(games=('on_min', 'size'),
+                      on_min=('on_min', 'sum'), on_pm=('on_pm', 'sum'),
+                      team_min=('team_min', 'sum'), team_pm=('team_pm', 'sum'))
+                 .reset_index()
+                 )
+    df_on_off['off_min'] = df_on_off['team_min'] - df_on_off['on_min']
+    df_on_off['off_pm'] = df_on_off['team_pm'] - df_on_off['on_pm']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df_on_off['on_pm_per36'] = 36*df_on_off['on_pm']/df_on_off['on_min']
+        df_on_off['off_pm_per36'] = 36*df_on_off['off_pm']/df_on_off['off_min']
+    df_on_off['on_off_per36'] = df_on_off['on_pm_per36'] - df_on_off['off_pm_per36']
+
+    return (df_on_off
+            .drop(columns=['team_min', 'team_pm'])
+            .sort_values('on_min', ascending=0)
+            .reset_index(drop=True))
+
+def get_on_off(season_str, season_type='Regular Season',
+               start=0, end=None, max_margin=None):
+    '''
+    Given a season string (i.e. 2023-24), and a window of each game
+    from start to end (in minutes into the game, with end=None meaning
+    the end of the game, including OT), optionally only counting
+    while the score margin is within max_margin points, returns
+    each player's (per team) on/off split in the window over the season:
+    games played, minutes and team +/- in the window with the player on the floor
+    (on_min, on_pm) and off it in those games (off_min, off_pm),
+    and per 36 minutes (on_pm_per36, off_pm_per36, on_off_per36).
+
+    Examples:
+     - whole game: get_on_off('2023-24')
+     - 4th quarter: get_on_off('2023-24', start=36, end=48)
+     - last 5 minutes of regulation within 5 points: get_on_off('2023-24', start=43, end=48, max_margin=5)
+     - from 43:00 on, including OT, within 5 points: get_on_off('2023-24', start=43, max_margin=5)
+    '''
+    return _get_on_off(season_str, season_type,
+                       get_game_file_versions('pbps', 'df_pbp_', season_str, season_type),
+                       get_game_file_versions('game_rotations', 'df_gr_', season_str, season_type),
+                       start, end, max_margin).copy()
+
+
+if __name__ == '__main__':
+
+    import time
+
+    for window in [{}, {'start': 36, 'end': 48}, {'start': 43, 'end': 48, 'max_margin': 5}]:
+        t_start = time.time()
+        df_on_off = get_on_off('2023-24', **window)
+        print('window: {} ({:.2f} s)'.format(window, time.time() - t_start))
+        print(df_on_off.head())
@@ -0,0 +1,296 @@
+'''
+Utility functions for a player's season of stints: every stint of every game
+they played, stacked on one axis (one row per game, by minutes into the game),
+to see how consistently they're used (when they check in, how long they stay,
+and their +/- in each stint).
+
+Rather than reading every game rotation file of a season whenever a player is shown,
+at ingest time (see data/update_all_data.py) the season's stints are indexed
+by player and saved as one set of compact arrays in data/player_stints/:
+    game_ids, game_versions: the games folded in, and the version (size, modification time)
+        of their game rotation files
+    person_ids: the players, sorted, and offsets: player i's stints are rows
+        offsets[i]:offsets[i + 1] of
+    game (index into game_ids), team_id, in_time, out_time (tenths of seconds into the game),
+        pt_diff, player_pts: one row per stint, by game then time
+Each night, only the games whose game rotation file is new or changed are read again
+(see update_player_stints), as for the leaderboards (see leaderboard_utils.py).
+A player's stints are then a slice of the arrays.
+
+    python player_stint_utils.py [--rebuild] [--season-str 2023-24]
+
+updates the saved stints, or with --rebuild, rebuilds them from scratch.
+'''
+
+import os
+import argparse
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+from load_data_utils import get_grs, get_season_suffix, season_strs, season_type_suffixes
+from leaderboard_utils import get_gr_versions
+from plot_utils import load_matplotlib, get_cmap_limits, diverging_cmaps, sequential_cmaps
+from img_utils import encode_fig
+
+
+player_stints_dir = 'data/player_stints/'
+
+# per stint arrays, and their types
+# (a few game rotations are missing their stints' points, kept as NaN)
+stint_dtypes = {'game': np.int32, 'team_id': np.int64,
+                'in_time': np.int32, 'out_time': np.int32,
+                'pt_diff': np.float32, 'player_pts': np.float32}
+
+# width of the plot image (in CSS pixels), and height of each game's row
+plot_width = 900
+plot_row_height = 9
+
+
+def get_flat_stints(season_str, season_type='Regular Season', game_ids=None):
+    '''
+    Reads the stints of a season's saved game rotations (for the given game_ids, or all of them),
+    returning them as a dictionary of per stint arrays: game_id, person_id,
+    and those in stint_dtypes (but game)
+    '''
+    df_gr = get_grs(season_str, game_ids, season_type=season_type,
+                    columns=['TEAM_ID', 'PERSON_ID', 'IN_TIME_REAL', 'OUT_TIME_REAL', 'PT_DIFF', 'PLAYER_PTS'])
+    if len(df_gr) == 0:
+        return {'game_id': np.zeros(0, dtype=str), 'person_id': np.zeros(0, dtype=np.int64),
+                **{k: np.zeros(0, dtype=v) for k, v in stint_dtypes.items() if k != 'game'}}
+
+    return {'game_id': df_gr['GAME_ID'].to_numpy(dtype=str),
+            'person_id': df_gr['PERSON_ID'].to_numpy(dtype=np.int64),
+            'team_id': df_gr['TEAM_ID'].to_numpy(dtype=np.int64),
+            'in_time': df_gr['IN_TIME_REAL'].round().to_numpy(dtype=np.int32),
+            'out_time': df_gr['OUT_TIME_REAL'].round().to_numpy(dtype=np.int32),
+            'pt_diff': df_gr['PT_DIFF'].to_numpy(dtype=np.float32),
+            'player_pts': df_gr['PLAYER_PTS'].to_numpy(dtype=np.float32)}
+
+def get_flat_stints_from(stints):
+    '''
+    Given saved (packed) stints, returns them as per stint arrays (see get_flat_stints)
+    '''
+    return {'game_id': stints['game_ids'][stints['game']],
+            'person_id': np.repeat(stints['person_ids'], np.diff(stints['offsets'])),
+            **{k: stints[k] for k in stint_dtypes if k != 'game'}}
+
+def pack_stints(flat_stints, game_versions):
+    '''
+    Given per stint arrays (see get_flat_stints), and the versions of the games they're from,
+    returns them indexed by player (see the top of this file)
+    '''
+    game_ids = np.array(sorted(game_versions), dtype=str)
+    game = np.searchsorted(game_ids, flat_stints['game_id']).astype(np.int32)
+
+    order = np.lexsort((flat_stints['in_time'], game, flat_stints['person_id']))
+    person_ids, counts = np.unique(flat_stints['person_id'][order], return_counts=True)
+
+    return {'game_ids': game_ids,
+            'game_versions': np.array([game_versions[g] for g in game_ids], dtype=str),
+            'person_ids': person_ids.astype(np.int64),
+            'offsets': np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            'game': game[order],
+            **{k: flat_stints[k][order].astype(v) for k, v in stint_dtypes.items() if k != 'game'}}
+
+def get_player_stints_fpath(season_str, season_type='Regular Season', data_dir=player_stints_dir):
+    '''
+    Path of a season's saved stints
+    '''
+    return os.path.join(data_dir, 'stints_{}{}.npz'.format(season_str, get_season_suffix(season_type)))
+
+def build_player_stints(season_str, season_type='Regular Season'):
+    '''
+    Indexes the stints of every saved game rotation of a season from scratch
+    '''
+    game_versions = get_gr_versions(season_str, season_type)
+    return pack_stints(get_flat_stints(season_str, season_type, sorted(game_versions)), game_versions)
+
+def update_player_stints(season_str, season_type='Regular Season', data_dir=player_stints_dir, rebuild=False):
+    '''
+    Folds a season's new and changed game rotation files into its saved stints
+    (or indexes every game, if rebuild or they haven't been saved),
+    returning the number of games folded in
+    '''
+    fpath = get_player_stints_fpath(season_str, season_type, data_dir)
+
+    stints = None
+    if os.path.exists(fpath) and not rebuild:
+        with np.load(fpath) as saved:
+            stints = {k: saved[k] for k in saved.files}
+
+    game_versions = get_gr_versions(season_str, season_type)
+    if stints is None:
+        changed_ids = sorted(game_versions)
+        removed_ids = []
+        new_stints = pack_stints(get_flat_stints(season_str, season_type, changed_ids), game_versions)
+    else:
+        old_versions = dict(zip(stints['game_ids'], stints['game_versions']))
+        changed_ids = sorted(g for g, v in game_versions.items() if old_versions.get(g) != v)
+        removed_ids = sorted(set(old_versions) - set(game_versions))
+        if len(changed_ids) + len(removed_ids) == 0:
+            return 0
+
+        # take out the old stints of changed and removed games, and put in the new ones
+        flat_stints = get_flat_stints_from(stints)
+        is_old = np.isin(flat_stints['game_id'], changed_ids + removed_ids)
+        flat_new = get_flat_stints(season_str, season_type, changed_ids) if len(changed_ids) > 0 else None
+        flat_stints = {k: v[~is_old] if flat_new is None else np.concatenate((v[~is_old], flat_new[k]))
+                       for k, v in flat_stints.items()}
+        new_stints = pack_stints(flat_stints, game_versions)
+
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+        print('making data directory: {}'.format(os.path.abspath(data_dir)))
+
+    print(f'saving to... {fpath}')
+    fpath_tmp = f'{fpath}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(fpath_tmp, **new_stints)
+    os.replace(fpath_tmp, fpath)
+
+    return len(changed_ids) + len(removed_ids)
+
+@lru_cache(maxsize=8)
+def _load_player_stints(season_str, season_type, file_version):
+
+    if file_version is None:
+        return build_player_stints(season_str, season_type)
+
+    with np.load(get_player_stints_fpath(season_str, season_type)) as saved:
+        return {k: saved[k] for k in saved.files}
+
+def load_player_stints(season_str, season_type='Regular Season'):
+    '''
+    Loads a season's saved stints (see the top of this file),
+    indexing them instead if they haven't been saved
+    '''
+    fpath = get_player_stints_fpath(season_str, season_type)
+    file_version = None
+    if os.path.exists(fpath):
+        fstat = os.stat(fpath)
+        file_version = (fstat.st_size, fstat.st_mtime_ns)
+
+    return _load_player_stints(season_str, season_type, file_version)
+
+def get_player_stints(season_str, season_type='Regular Season', person_id=None):
+    '''
+    A player's season of stints, by game then time, as a dictionary of arrays:
+    game_id, and those in stint_dtypes (but game)
+    '''
+    stints = load_player_stints(season_str, season_type)
+
+    i = np.searchsorted(stints['person_ids'], int(person_id))
+    if i == len(stints['person_ids']) or stints['person_ids'][i] != int(person_id):
+        rows = slice(0, 0)
+    else:
+        rows = slice(stints['offsets'][i], stints['offsets'][i + 1])
+
+    return {'game_id': stints['game_ids'][stints['game'][rows]],
+            **{k: stints[k][rows] for k in stint_dtypes if k != 'game'}}
+
+def get_stint_players(season_str, season_type='Regular Season', team_id=None):
+    '''
+    A season's players (of a team, if given), with their games and stints (for that team),
+    most games first, as a dataframe of person_id, games, stints
+    '''
+    stints = load_player_stints(season_str, season_type)
+
+    df = pd.DataFrame({'person_id': np.repeat(stints['person_ids'], np.diff(stints['offsets'])),
+                       'game': stints['game']})
+    if team_id is not None:
+        df = df[stints['team_id'] == int(team_id)]
+
+    return (df.groupby('person_id', as_index=False)
+              .agg(games=('game', 'nunique'), stints=('game', 'size'))
+              .sort_values(['games', 'stints'], ascending=False, ignore_index=True))
+
+def draw_player_stints(stints, game_labels, title, stint_val='pm',
+                       width=plot_width, scale=1, fmt='png'):
+    '''
+    Draws a player's season of stints (see get_player_stints): one row per game,
+    in the order of game_labels (game_id -> label, i.e. its date; games without one go last),
+    with each stint a bar over the minutes they played,
+    colored by its point differential (stint_val pm) or the player's points (player_pts),
+    all as one collection. The caller should hold game_cache.render_lock.
+    Returns the encoded image.
+    '''
+    load_matplotlib()
+    from plot_utils import mpl, plt
+
+    # game rows, in the order of their labels
+    stint_game_ids = set(stints['game_id'])
+    game_ids = ([g for g in game_labels if g in stint_game_ids] +
+                sorted(stint_game_ids.difference(game_labels)))
+    i_row = pd.Index(game_ids, dtype=object).get_indexer(stints['game_id'])
+    n_games = max(1, len(game_ids))
+
+    height = 130 + plot_row_height*n_games
+    fig = plt.figure(figsize=(width/100, height/100), dpi=100, facecolor='w')
+    ax = fig.add_axes([0.14, 50/height, 0.72, 1 - 110/height])
+    cax = fig.add_axes([0.89, 50/height, 0.02, min(0.5, 1 - 110/height)])
+
+    in_min = stints['in_time']/600
+    out_min = stints['out_time']/600
+    y = i_row.astype(float)
+    verts = np.stack([np.stack([in_min, y - 0.4], axis=1), np.stack([out_min, y - 0.4], axis=1),
+                      np.stack([out_min, y + 0.4], axis=1), np.stack([in_min, y + 0.4], axis=1)], axis=1)
+
+    values = stints['pt_diff'] if stint_val == 'pm' else stints['player_pts']
+    vmin, vmax, tickdiff = get_cmap_limits(stint_val, int(np.nanmax(values, initial=0)))
+    cmap = mpl.cm.ScalarMappable(norm=mpl.colors.Normalize(vmin=vmin, vmax=vmax),
+                                 cmap=diverging_cmaps[0] if stint_val == 'pm' else sequential_cmaps[0])
+    facecolors = cmap.to_rgba(values)
+    facecolors[np.isnan(values)] = mpl.colors.to_rgba('0.8')
+    ax.add_collection(mpl.collections.PolyCollection(verts, facecolors=facecolors,
+                                                     edgecolors='0.3', linewidths=0.3))
+
+    # quarters (and overtimes)
+    max_min = max(48, np.ceil((out_min.max(initial=48) - 48)/5)*5 + 48)
+    period_ends = np.concatenate((np.arange(12, 48 + 1, 12), np.arange(53, max_min + 1, 5)))
+    for x in period_ends[:-1]:
+        ax.axvline(x, c='0.6', lw=0.8, zorder=0)
+    ax.set_xticks(np.concatenate(([0], period_ends)))
+    ax.set_xlim(0, max_min)
+    ax.set_xlabel('minutes into the game')
+
+    # label every game, or every few of them for long seasons
+    label_every = int(np.ceil(n_games/30))
+    ax.set_yticks(np.arange(0, len(game_ids), label_every))
+    ax.set_yticklabels([game_labels.get(g, g) for g in game_ids[::label_every]], size=8)
+    ax.set_ylim(n_games - 0.5, -0.5)
+    for side in ['top', 'right']:
+        ax.spines[side].set_visible(False)
+
+    cbar = fig.colorbar(cmap, cax=cax)
+    cbar.set_label('point diff in stint' if stint_val == 'pm' else 'player points in stint')
+    cbar.set_ticks(np.arange(vmin, vmax + 1e-5, tickdiff).astype(int))
+
+    n_stints = len(in_min)
+    stint_mins = out_min - in_min
+    subtitle = '{} games, {:.1f} stints and {:.1f} min per game, {:.1f} min per stint, {:+d} in stints'.format(
+        len(game_ids), n_stints/n_games, stint_mins.sum()/n_games, stint_mins.mean() if n_stints > 0 else 0,
+        int(np.nansum(stints['pt_diff'])))
+    fig.suptitle(f'{title}\n{subtitle}', size=12, y=1 - 8/height, va='top')
+
+    img = encode_fig(fig, width, height, scale, fmt)
+    plt.close(fig)
+    return img
+
+
+if __name__ == '__main__':
+
+    import time
+
+    parser = argparse.ArgumentParser(description="Index the saved game rotations' stints by player")
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--season-str', default=None, help='only this season (i.e. 2023-24)')
+    args = parser.parse_args()
+
+    for season_str in ([args.season_str] if args.season_str else season_strs):
+        for season_type in season_type_suffixes:
+            if not os.path.isdir('data/game_rotations/{}{}'.format(season_str, get_season_suffix(season_type))):
+                continue
+            t_start = time.time()
+            n_games = update_player_stints(season_str, season_type, rebuild=args.rebuild)
+            print('{} {}: {} games indexed ({:.1f} s)'.format(season_str, season_type, n_games,
+                                                               time.time() - t_start))
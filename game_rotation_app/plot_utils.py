@@ -2,12 +2,24 @@
 Necessary plotting utilities for shiny app
 """
 
+import os
+import sys
+import threading
 import numpy as np
 import pandas as pd
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import matplotlib.patheffects as pe
-from matplotlib.ticker import MultipleLocator
+
+from profile_utils import profile_function
+
+# matplotlib takes a good fraction of a second to import and set up,
+# so it's only imported when the first figure is made (see load_matplotlib)
+mpl = plt = pe = MultipleLocator = None
+_matplotlib_lock = threading.Lock()
+
+# the backend matplotlib is loaded with: the app only renders images, from several
+# threads, so it asks for the non-interactive Agg backend (see use_offscreen_backend),
+# while scripts (i.e. this file's example) keep matplotlib's own pick, to show plots
+mpl_backend = None
+
 
 # plotting parameters that are not 
 # really meant to be modified by a user
@@ -38,9 +50,55 @@ def set_font_sizes(SMALL_SIZE=12, MEDIUM_SIZE=14, LARGE_SIZE=16):
     plt.rc('ytick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
     plt.rc('legend', fontsize=SMALL_SIZE)    # legend fontsize
     plt.rc('figure', titlesize=LARGE_SIZE)   # fontsize of the figure title
-    
-    
-set_font_sizes()
+
+def use_offscreen_backend():
+    '''
+    Has matplotlib load with the non-interactive Agg backend, for rendering
+    images only (the app and its worker processes)
+    '''
+    global mpl_backend
+    mpl_backend = 'Agg'
+
+def load_matplotlib():
+    '''
+    Imports matplotlib on first use, with the backend asked for (mpl_backend),
+    unless a backend was already picked (i.e. in a notebook, or with MPLBACKEND),
+    and sets the font sizes
+    '''
+    global mpl, plt, pe, MultipleLocator
+
+    with _matplotlib_lock:
+        if plt is not None:
+            return
+
+        import matplotlib
+        if (mpl_backend is not None and 'matplotlib.pyplot' not in sys.modules
+                and 'MPLBACKEND' not in os.environ):
+            matplotlib.use(mpl_backend)
+        import matplotlib.pyplot
+        import matplotlib.patheffects
+        from matplotlib.ticker import MultipleLocator as _MultipleLocator
+
+        mpl, pe, MultipleLocator = matplotlib, matplotlib.patheffects, _MultipleLocator
+        plt = matplotlib.pyplot
+
+        set_font_sizes()
+
+def warm_up_matplotlib():
+    '''
+    Loads matplotlib, and draws text in the plots' fonts and sizes
+    once, so that the first real plot doesn't pay for finding
+    and loading the fonts
+    '''
+    load_matplotlib()
+
+    fig = plt.figure(figsize=(2, 1))
+    for size in ['small', 'medium', 'large', 12, 14, 16]:
+        for weight in ['normal', 'bold']:
+            fig.text(0, 0, 'L. James (32 min, +23) 0123456789', size=size, weight=weight,
+                     path_effects=[pe.withStroke(linewidth=3, foreground="w")])
+    fig.canvas.draw()
+    plt.close(fig)
 
 
 def get_player_summary(df_gr0, stint_val='pm'):
@@ -62,15 +120,28 @@ def get_player_summary(df_gr0, stint_val='pm'):
                           )
     
     player_IDs_sorted = player_summary['PERSON_ID'].values
+    n_players = len(player_summary)
+    
+    d_ID_to_pos = {player_IDs_sorted[i]:n_players-i for i in range(n_players)}
+    
+    plyr_strings = get_player_strings(player_summary, stint_val)
+
+    return df_gr, player_summary, plyr_strings, d_ID_to_pos
+
+
+def get_player_strings(player_summary, stint_val='pm'):
+    '''
+    Makes the y axis player labels from a player summary,
+    i.e. L. James (32 min, +23), or L. James (32 min, 30 pts)
+    if coloring stints by player points
+    '''
     player_nms = player_summary['nameI'].values
     player_mins = np.round(player_summary['min'].values).astype(int)
     player_pms = player_summary['PT_DIFF'].values.astype(int)
     player_points = player_summary['PLAYER_PTS'].values.astype(int)
     player_signs = ['+' if x >= 0 else '-' for x in player_pms]
     n_players = len(player_summary)
-    
-    d_ID_to_pos = {player_IDs_sorted[i]:n_players-i for i in range(n_players)}
-    
+
     plyr_strings = ['{} ({:>2} min, {}{:>2})'.format(player_nms[i], 
                                                player_mins[i],
                                                player_signs[i],
@@ -79,7 +150,7 @@ def get_player_summary(df_gr0, stint_val='pm'):
         plyr_strings = ['{} ({:>2} min, {:>2} pts)'.format(player_nms[i], 
                                                 player_mins[i],
                                                 player_points[i]) for i in range(n_players)]
-    return df_gr, player_summary, plyr_strings, d_ID_to_pos
+    return plyr_strings
 
 
 
@@ -96,59 +167,95 @@ def plot_stints(plyr_strings, d_ID_to_pos, df_gr, ax, cmap,
        (d_ID_to_pos)
      - the axis to plot on (ax)
      - the colormap for +/-'s (cmap)
+    Returns a dictionary of handles to the stint rectangles and
+    text annotations, so they can be restyled later (see style_stints)
+    without redrawing the whole figure
     '''
           
     n_players = len(plyr_strings)
     n_rows = len(df_gr)
 
+    stint_polys = []
+    stint_texts = []
+    text_rows = []
+
     # go row by row to add rectangles with width given by in/out times
     for i in range(n_rows):
         cur_row = df_gr.iloc[i]
         
         # get the in and out times along with where to plot along y
-        cur_person_ID, cur_in_min, cur_out_min, cur_pm, cur_player_pts = \
-            cur_row[['PERSON_ID', 'in_min', 'out_min', 'PT_DIFF', 'PLAYER_PTS']]
+        cur_person_ID, cur_in_min, cur_out_min = \
+            cur_row[['PERSON_ID', 'in_min', 'out_min']]
         cur_ypos = d_ID_to_pos[cur_person_ID]
 
-        stint_arg_val = ''
-        stint_color = force_stint_color
-        stint_edge_color = force_stint_edge_color
-        lw=1.5
-        if stint_val == 'pm':
-            stint_arg_val = cur_pm
-            stint_color = cmap.to_rgba(stint_arg_val)
-            stint_edge_color = '0.5'
-            lw=0.2
-        elif stint_val == 'player_pts':
-            stint_arg_val = cur_player_pts
-            stint_color = cmap.to_rgba(stint_arg_val)
-            stint_edge_color = '0.5'
-            lw=0.2
-            
+        # plot the rectangle (colors are filled in by style_stints)
+        stint_polys.append(
+            ax.fill_between(x=[cur_in_min, cur_out_min], 
+                            y1=cur_ypos-shift_rectangle_height, 
+                            y2=cur_ypos+shift_rectangle_height)
+        )
         
-        # plot the rectangle
-        ax.fill_between(x=[cur_in_min, cur_out_min], 
-                        y1=cur_ypos-shift_rectangle_height, 
-                        y2=cur_ypos+shift_rectangle_height,
-                        lw=lw, edgecolor=stint_edge_color,
-                        facecolor=stint_color)
-        
-        # optional: annotate stint rectangle with text
-        if stint_val in ['pm', 'player_pts']:
-            if show_text:
-                lenshift = cur_out_min - cur_in_min
-                if lenshift > min_shift_len_min:
-                    textpos = cur_in_min + lenshift/2
-                    texttag = '{}{:.0f}'.format('+' if stint_arg_val >= 0 else '-', abs(stint_arg_val))
-                    ax.text(textpos, cur_ypos, texttag, size=10,
-                            c='k', 
-                            path_effects=[pe.withStroke(linewidth=6, foreground="w")],
-                            ha='center', va='center')
+        # annotate stint rectangle with text 
+        # (visibility and contents are set by style_stints)
+        lenshift = cur_out_min - cur_in_min
+        if lenshift > min_shift_len_min:
+            textpos = cur_in_min + lenshift/2
+            stint_texts.append(
+                ax.text(textpos, cur_ypos, '', size=10,
+                        c='k', 
+                        path_effects=[pe.withStroke(linewidth=6, foreground="w")],
+                        ha='center', va='center')
+            )
+            text_rows.append(i)
     
     # format y ticks and labels
     ax.set_yticks(1+np.arange(n_players))
     ax.set_yticklabels(plyr_strings[::-1])
 
+    stint_handles = {'polys': stint_polys,
+                     'texts': stint_texts,
+                     'text_rows': np.array(text_rows, dtype=int),
+                     'pm': df_gr['PT_DIFF'].values,
+                     'player_pts': df_gr['PLAYER_PTS'].values,
+                     'force_stint_color': force_stint_color,
+                     'force_stint_edge_color': force_stint_edge_color}
+    
+    style_stints(stint_handles, cmap, stint_val, show_text)
+
+    return stint_handles
+
+
+def style_stints(stint_handles, cmap, stint_val='pm', show_text=False):
+    '''
+    (Re)colors the stint rectangles and (re)writes/hides the text annotations
+    made by plot_stints, for a given stint coloring (stint_val), 
+    colormap (cmap), and choice of annotating stints (show_text)
+    '''
+
+    stint_polys = stint_handles['polys']
+
+    if stint_val in ['pm', 'player_pts']:
+        stint_arg_vals = stint_handles[stint_val]
+        stint_colors = cmap.to_rgba(stint_arg_vals)
+        for stint_poly, stint_color in zip(stint_polys, stint_colors):
+            stint_poly.set_facecolor(stint_color)
+            stint_poly.set_edgecolor('0.5')
+            stint_poly.set_linewidth(0.2)
+    else:
+        stint_arg_vals = stint_handles['pm']
+        for stint_poly in stint_polys:
+            stint_poly.set_facecolor(stint_handles['force_stint_color'])
+            stint_poly.set_edgecolor(stint_handles['force_stint_edge_color'])
+            stint_poly.set_linewidth(1.5)
+
+    # optional: annotate stint rectangles with text
+    show_text = show_text and stint_val in ['pm', 'player_pts']
+    for stint_text, i in zip(stint_handles['texts'], stint_handles['text_rows']):
+        stint_arg_val = stint_arg_vals[i]
+        texttag = '{}{:.0f}'.format('+' if stint_arg_val >= 0 else '-', abs(stint_arg_val))
+        stint_text.set_text(texttag)
+        stint_text.set_visible(show_text)
+
 def convert_to_time(pbp_row):
     '''
     Utility function for processing time info in play by play dataframe,
@@ -167,6 +274,22 @@ def convert_to_time(pbp_row):
     
     # return minutes
     return tt_sec/60
+
+def convert_to_times(qtrs, clock_mins, clock_secs):
+    '''
+    Vectorized version of convert_to_time,
+    converting arrays of periods, clock_min and clock_sec
+    to elapsed minutes in game
+    '''
+    qtrs = np.asarray(qtrs)
+    clock_tt_sec = 60*np.asarray(clock_mins) + np.asarray(clock_secs)
+
+    tt_sec = np.where(qtrs <= 4,
+                      12*(qtrs-1)*60 + (12*60 - clock_tt_sec),
+                      48*60 + 60*5*(qtrs-5) + (5*60 - clock_tt_sec))
+    
+    # return minutes
+    return tt_sec/60
  
 def get_home_away_diff(df_pbp):
     '''
@@ -176,7 +299,7 @@ def get_home_away_diff(df_pbp):
     
     df_pbp_slim = df_pbp.copy()[['EVENTNUM', 'PERIOD', 'PCTIMESTRING', 'SCOREMARGIN']]
     df_pbp_slim[['clock_min', 'clock_sec']] = df_pbp_slim['PCTIMESTRING'].str.split(':', expand=True).astype(int)
-    df_pbp_slim['time'] = df_pbp_slim.apply(lambda x: convert_to_time(x), axis=1)
+    df_pbp_slim['time'] = convert_to_times(df_pbp_slim['PERIOD'], df_pbp_slim['clock_min'], df_pbp_slim['clock_sec'])
     
     df_pbp_slim.loc[((df_pbp_slim['EVENTNUM'] == 2) & \
                      (df_pbp_slim['PERIOD'] == 1)),
@@ -266,6 +389,7 @@ def make_final_score_tag(home_info, away_info, df_pbp, num_OTs):
     return final_score_tag
 
 
+@profile_function
 def make_final_fig(df_gr, df_pbp, df_team_info, game_info,
                    show_text=False, show_plot=False,
                    season_type='Regular Season',
@@ -274,6 +398,7 @@ def make_final_fig(df_gr, df_pbp, df_team_info, game_info,
     '''
     Puts it all together
     '''
+    load_matplotlib()
 
 
     game_id = df_gr['GAME_ID'].iloc[0]
@@ -315,22 +440,14 @@ def make_final_fig(df_gr, df_pbp, df_team_info, game_info,
     rot_plot_rats = 10*n_away_players/n_tot_players, 10*n_home_players/n_tot_players
     
     
-    vmin = -20; vmax = 20; tickdiff = 10
-    norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
-    cmap = mpl.cm.ScalarMappable(norm=norm, cmap=diverging_cmaps[0])
-   
-    if stint_val == 'player_pts':
-        vmin = 0
-        maxpts = np.max(
-                    np.concatenate([
-                        gr_home['PLAYER_PTS'].values,
-                        gr_away['PLAYER_PTS'].values]))
-        tickdiff = 5 if maxpts < 35 else 10
-        vmax = max(20, maxpts + (tickdiff - maxpts % tickdiff)*(maxpts % tickdiff > 0))
-            
-        norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
-        cmap = mpl.cm.ScalarMappable(norm=norm, cmap=cmap_name)
+    maxpts = np.max(
+                np.concatenate([
+                    gr_home['PLAYER_PTS'].values,
+                    gr_away['PLAYER_PTS'].values]))
     
+    # colors are (re)applied in restyle_fig below
+    cmap = mpl.cm.ScalarMappable(norm=mpl.colors.Normalize(vmin=cmap_VMIN, vmax=cmap_VMAX), 
+                                 cmap=diverging_cmaps[0])
         
     fig_width = 13+0.1167*max_string_len
     fig, axs = plt.subplots(3, 2, figsize=(fig_width,8), 
@@ -346,23 +463,18 @@ def make_final_fig(df_gr, df_pbp, df_team_info, game_info,
     for ax in axs[:, 1]:
         ax.axis('off')
     
-    if stint_val in ['pm', 'player_pts']:
-        lab = 'point diff in stint' if stint_val == 'pm' else 'player points in stint'
-        cbar = fig.colorbar(cmap, 
-                    ax=axs[1, 1],
-                    fraction=1,
-                    pad=0.05,
-                    shrink=1,
-                    label=lab)
-        cbar_ticks = np.arange(vmin, vmax + 1e-5, tickdiff).astype(int)
-        cbar.ax.set_yticks(cbar_ticks)
-        cbar.ax.set_yticklabels(cbar_ticks)
+    # the colorbar is always made, and hidden if coloring by team colors
+    cbar = fig.colorbar(cmap, 
+                ax=axs[1, 1],
+                fraction=1,
+                pad=0.05,
+                shrink=1)
     
     # main plots
     home_color, home_color2 = home_info['COLOR1'], home_info['COLOR2']
     away_color, away_color2 = away_info['COLOR1'], away_info['COLOR2']
-    plot_stints(away_plyr_strings, away_d_ID_to_pos, gr_away, ax_away, cmap, stint_val, show_text, away_color, away_color2)
-    plot_stints(home_plyr_strings, home_d_ID_to_pos, gr_home, ax_home, cmap, stint_val, show_text, home_color, home_color2)
+    away_stints = plot_stints(away_plyr_strings, away_d_ID_to_pos, gr_away, ax_away, cmap, stint_val, show_text, away_color, away_color2)
+    home_stints = plot_stints(home_plyr_strings, home_d_ID_to_pos, gr_home, ax_home, cmap, stint_val, show_text, home_color, home_color2)
     plot_diff(game_times, -home_away_diff, home_info, away_info, ax_diff)
     
     # x axis ticks
@@ -380,7 +492,7 @@ def make_final_fig(df_gr, df_pbp, df_team_info, game_info,
     elif season_type == 'PlayIn':
         suptitl_suffix = ' (play-in tournament)'
     # to-do: annotate round in playoffs
-    plt.suptitle(final_score_tag + f'\n{game_start_date}')
+    fig.suptitle(final_score_tag + f'\n{game_start_date}')
     
     # add gridlines for each quarter/OT
     for ax in axs[:, 0]:
@@ -397,6 +509,19 @@ def make_final_fig(df_gr, df_pbp, df_team_info, game_info,
                 c='0.5',
                 )
     
+    # keep handles to everything that depends on the plot settings,
+    # so that changing them only restyles the figure (see restyle_fig)
+    fig.rotation_artists = {'cmap': cmap,
+                            'cbar': cbar,
+                            'maxpts': maxpts,
+                            'away': (ax_away, away_player_summary, away_stints),
+                            'home': (ax_home, home_player_summary, home_stints),
+                            # and everything that depends on the render quality (see set_fig_quality)
+                            'path_effects': [(text, text.get_path_effects()) 
+                                             for text in fig.findobj(mpl.text.Text) if text.get_path_effects()],
+                            'layouts': {}}
+    restyle_fig(fig, show_text=show_text, stint_val=stint_val, cmap_name=cmap_name)
+
     # if not in use in shiny app, optional flag to show plot
     if show_plot:
         plt.show()
@@ -404,6 +529,95 @@ def make_final_fig(df_gr, df_pbp, df_team_info, game_info,
     return fig
 
 
+def get_cmap_limits(stint_val='pm', maxpts=0):
+    '''
+    Gets the colormap limits and colorbar tick spacing for a stint coloring,
+    where maxpts is the most points a player scored in a single stint
+    '''
+    vmin = cmap_VMIN; vmax = cmap_VMAX; tickdiff = 10
+
+    if stint_val == 'player_pts':
+        vmin = 0
+        tickdiff = 5 if maxpts < 35 else 10
+        vmax = max(20, maxpts + (tickdiff - maxpts % tickdiff)*(maxpts % tickdiff > 0))
+
+    return vmin, vmax, tickdiff
+
+
+def restyle_fig(fig, show_text=False,
+                stint_val='pm',
+                cmap_name='RdBu_r'):
+    '''
+    Updates a figure made by make_final_fig for new plot settings
+    (stint coloring, colormap, text annotation), 
+    by only recoloring the existing stints, colorbar and labels
+    instead of rebuilding the figure
+    '''
+    
+    artists = fig.rotation_artists
+
+    if not cmap_name:
+        cmap_name = sequential_cmaps[0] if stint_val == 'player_pts' else diverging_cmaps[0]
+    
+    vmin, vmax, tickdiff = get_cmap_limits(stint_val, artists['maxpts'])
+    cmap = artists['cmap']
+    cmap.set_cmap(cmap_name)
+    cmap.set_norm(mpl.colors.Normalize(vmin=vmin, vmax=vmax))
+    
+    cbar = artists['cbar']
+    cbar.ax.set_visible(stint_val in ['pm', 'player_pts'])
+    if stint_val in ['pm', 'player_pts']:
+        lab = 'point diff in stint' if stint_val == 'pm' else 'player points in stint'
+        cbar.update_normal(cmap)
+        cbar.set_label(lab)
+        cbar_ticks = np.arange(vmin, vmax + 1e-5, tickdiff).astype(int)
+        cbar.ax.set_yticks(cbar_ticks)
+        cbar.ax.set_yticklabels(cbar_ticks)
+    
+    max_string_len = 0
+    for side in ['away', 'home']:
+        ax, player_summary, stint_handles = artists[side]
+        style_stints(stint_handles, cmap, stint_val, show_text)
+        plyr_strings = get_player_strings(player_summary, stint_val)
+        ax.set_yticklabels(plyr_strings[::-1])
+        max_string_len = max(max_string_len, max([len(x) for x in plyr_strings]) - 14)
+    
+    fig.set_size_inches(13+0.1167*max_string_len, 8)
+
+    return fig
+
+
+def set_fig_quality(fig, path_effects=True, layout_key=None):
+    '''
+    Sets how costly a figure made by make_final_fig is to draw
+    (see render_quality.py): with or without the white outlines (path effects)
+    on its text, and with a tight layout, or if layout_key is given
+    (i.e. the render size and stint coloring), the tight layout last saved for it
+    (see save_fig_layout), if there is one.
+    Returns whether the figure will be drawn with a tight layout.
+    '''
+    artists = fig.rotation_artists
+    for text, effects in artists['path_effects']:
+        text.set_path_effects(effects if path_effects else [])
+
+    positions = artists['layouts'].get(layout_key)
+    if positions is None:
+        fig.set_layout_engine('tight')
+        return True
+    
+    fig.set_layout_engine('none')
+    for ax, position in zip(fig.axes, positions):
+        ax.set_position(position)
+    return False
+
+def save_fig_layout(fig, layout_key):
+    '''
+    Saves where each of a (drawn) figure's axes is, for drawing it again 
+    with the same layout (see set_fig_quality)
+    '''
+    fig.rotation_artists['layouts'][layout_key] = [ax.get_position().frozen() for ax in fig.axes]
+
+
 if __name__ == '__main__':
     
     # example game
@@ -0,0 +1,153 @@
+'''
+On-demand profiling of plot requests, for finding where the time goes
+in a slow render (loading data, building the figure, rasterizing...).
+
+Profiling is off unless either
+ - the ROTATION_PROFILE environment variable is set to 1 (profiles every request), or
+ - a request carries ?profile=<token>, matching the ROTATION_PROFILE_TOKEN
+   environment variable (in the app's url, for that session's plots,
+   or in a /rotation/... image url)
+
+A profiled call is sampled (its thread's stack, every sample_interval seconds,
+from a background thread, so the profiled code itself runs unchanged),
+and the samples are written to profile_dir as folded stacks
+(one "frame;frame;frame count" line per distinct stack), which
+flamegraph.pl or speedscope turn into a flame graph.
+The root frame and the file name carry the call's parameters
+(i.e. game_id, stint_val, cmap, scale).
+
+When profiling is off, a profiled call costs a flag check.
+'''
+
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from inspect import signature
+from urllib.parse import parse_qs
+
+
+profile_all = os.environ.get('ROTATION_PROFILE', '') == '1'
+profile_token = os.environ.get('ROTATION_PROFILE_TOKEN')
+profile_dir = os.environ.get('ROTATION_PROFILE_DIR', 'profiles/')
+
+# seconds between stack samples
+sample_interval = 0.002
+
+# the profile running on each thread (nested profiled calls join it)
+_active = threading.local()
+
+
+class StackSampler(threading.Thread):
+    '''
+    Samples the stack of another thread every interval seconds,
+    counting how often each (folded) stack is seen
+    '''
+    def __init__(self, thread_id, interval=sample_interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stack_counts = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stack_counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def is_profile_requested(query):
+    '''
+    Given a request's query string (i.e. '?profile=abc') or parameters,
+    returns whether it asks for profiling with the right token
+    '''
+    if profile_token is None or query is None:
+        return False
+    if isinstance(query, str):
+        query = {k: v[0] for k, v in parse_qs(query.lstrip('?')).items()}
+    return query.get('profile') == profile_token
+
+def write_profile(name, tags, stack_counts, secs):
+    '''
+    Writes a profile's stack counts to profile_dir as folded stacks,
+    under a root frame naming the call and its parameters,
+    returning the file's path
+    '''
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+
+    tag_str = ' '.join(f'{k}={v}' for k, v in tags.items())
+    root = f'{name} {tag_str}'.strip().replace(';', ',')
+
+    fname = '{}_{}_{}.folded'.format(time.strftime('%Y%m%d-%H%M%S'), name,
+                                     '_'.join(str(v) for v in tags.values()))
+    fpath = os.path.join(profile_dir, re.sub(r'[^\w.\-]', '-', fname))
+    with open(fpath, 'w') as f:
+        for stack, count in stack_counts.most_common():
+            f.write(f'{root};{stack} {count}\n')
+
+    print('profiled {} in {:.2f} s ({} samples), saving to... {}'.format(
+        root, secs, sum(stack_counts.values()), fpath))
+    return fpath
+
+@contextmanager
+def profiled(name, force=False, **tags):
+    '''
+    Profiles the code run inside it (on this thread)
+    if profiling is on for every request, or force is True,
+    writing its profile (see write_profile) tagged with the keyword arguments.
+    Inside an already running profile, it's just part of that profile.
+    '''
+    if not (profile_all or force) or getattr(_active, 'sampler', None) is not None:
+        yield
+        return
+
+    sampler = StackSampler(threading.get_ident())
+    _active.sampler = sampler
+    t_start = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        _active.sampler = None
+        # a profile that can't be saved shouldn't fail the request
+        try:
+            write_profile(name, tags, sampler.stack_counts, time.perf_counter() - t_start)
+        except OSError as e:
+            print(f'could not save profile of {name}: {e}')
+
+def profile_function(func):
+    '''
+    Decorator profiling every call of a function when profiling is on
+    for every request (see profiled), tagged with its
+    string and number arguments (i.e. season_str, game_id)
+    '''
+    sig = signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profile_all or getattr(_active, 'sampler', None) is not None:
+            return func(*args, **kwargs)
+
+        bound = sig.bind(*args, **kwargs)
+        tags = {k: v for k, v in bound.arguments.items() if isinstance(v, (str, int, float))}
+        with profiled(func.__name__, **tags):
+            return func(*args, **kwargs)
+
+    return wrapper
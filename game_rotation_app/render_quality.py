@@ -0,0 +1,192 @@
+'''
+Load-aware quality of rotation plot renders.
+
+All matplotlib work in a worker is serialized (see game_cache.render_lock),
+so on busy nights plot requests queue up behind each other
+(each waiting in its own thread, see app.py's plot_task).
+Rather than every request paying for a full quality render,
+a governor watches how many plot requests are waiting or rendering (queue depth)
+and how long they take, from the user's input change to the finished image
+(latency), and steps down through cheaper
+quality profiles while the worker is overloaded:
+ - full: as designed
+ - no_effects: no white outlines (path effects) on the text
+ - fixed_layout: also reuses the figure's last tight layout instead of recomputing it
+ - low_dpi: also renders at most low_dpi_max_scale image pixels per CSS pixel
+ - default_image: also ignores the plot settings, serving (or rendering once)
+   the game's image with the default settings, shared by every request for it
+stepping back up, one profile at a time, once the load has cleared.
+Images already cached at a better quality are always served as they are.
+
+Each request's profile is returned with its image (see game_cache.get_governed_img),
+and counted in quality_stats, which are served as JSON at /render-quality
+along with the current load (see make_quality_route, and load_test.py --expect-step-down).
+Setting ROTATION_QUALITY_GOVERNOR=0 always renders at full quality.
+'''
+
+import os
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from plot_utils import diverging_cmaps
+
+
+# quality profiles, from best to cheapest
+quality_profiles = {'full': {'path_effects': True, 'tight_layout': True, 'low_dpi': False, 'default_image': False},
+                    'no_effects': {'path_effects': False, 'tight_layout': True, 'low_dpi': False, 'default_image': False},
+                    'fixed_layout': {'path_effects': False, 'tight_layout': False, 'low_dpi': False, 'default_image': False},
+                    'low_dpi': {'path_effects': False, 'tight_layout': False, 'low_dpi': True, 'default_image': False},
+                    'default_image': {'path_effects': False, 'tight_layout': False, 'low_dpi': True, 'default_image': True}}
+quality_levels = list(quality_profiles)
+
+# most image pixels per CSS pixel rendered by the low_dpi profiles
+low_dpi_max_scale = 0.75
+
+# step down a profile if more plot requests than this are waiting or rendering,
+# or they're taking longer than this (on average)
+max_queue_depth = 3
+max_latency_secs = 2.0
+
+# and step back up once at most this many are, taking less than this
+min_queue_depth = 1
+min_latency_secs = 0.75
+
+# least time between steps (down, up)
+step_down_secs = 1
+step_up_secs = 10
+
+# how fast the average latency follows new requests, and forgets old ones when idle
+latency_weight = 0.3
+latency_half_life_secs = 5
+
+# plot settings of the default_image profile (show_text, stint_val, cmap_name)
+default_plot_settings = (True, 'pm', diverging_cmaps[0])
+
+governor_enabled = os.environ.get('ROTATION_QUALITY_GOVERNOR', '1') == '1'
+
+# quality steps are logged (at info level), like the render stats (see img_utils.py)
+logger = logging.getLogger(__name__)
+
+# number of requests served by each profile
+quality_stats = Counter()
+
+
+class QualityGovernor:
+    '''
+    Picks the quality profile of plot requests from the current load
+    (see the top of this file)
+    '''
+
+    def __init__(self, enabled=governor_enabled):
+        self.enabled = enabled
+        self.level = 0
+        self.queue_depth = 0
+        self.latency = 0
+        self.last_update = time.monotonic()
+        self.last_step = self.last_update
+        self.lock = threading.Lock()
+
+    def decay_latency(self, now):
+        self.latency *= 0.5**((now - self.last_update)/latency_half_life_secs)
+        self.last_update = now
+
+    def update_level(self):
+        '''
+        Steps the quality down or up a profile for the current load,
+        returning the current profile
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.decay_latency(now)
+
+            is_overloaded = self.queue_depth > max_queue_depth or self.latency > max_latency_secs
+            is_cleared = self.queue_depth <= min_queue_depth and self.latency < min_latency_secs
+
+            if not self.enabled:
+                self.level = 0
+            elif is_overloaded and self.level < len(quality_levels) - 1 and now - self.last_step >= step_down_secs:
+                self.level += 1
+                self.last_step = now
+                logger.info('render load (queue %d, %.2f s): stepping down to %s quality',
+                            self.queue_depth, self.latency, quality_levels[self.level])
+            elif is_cleared and self.level > 0 and now - self.last_step >= step_up_secs:
+                self.level -= 1
+                self.last_step = now
+                logger.info('render load cleared: stepping up to %s quality', quality_levels[self.level])
+
+            return quality_levels[self.level]
+
+    @contextmanager
+    def request(self, t_requested=None):
+        '''
+        Counts a plot request as queued (until it's done) and its latency,
+        from when it was requested (t_requested, from time.monotonic,
+        i.e. when the user's input changed; by default now), i.e.
+            with governor.request(t_requested):
+                with render_lock:
+                    quality = governor.update_level()
+        '''
+        with self.lock:
+            self.queue_depth += 1
+        t_start = time.monotonic() if t_requested is None else t_requested
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.queue_depth -= 1
+                now = time.monotonic()
+                self.decay_latency(now)
+                self.latency += latency_weight*(now - t_start - self.latency)
+
+    def get_state(self):
+        '''
+        The current profile, queue depth and average latency (in seconds)
+        '''
+        with self.lock:
+            return quality_levels[self.level], self.queue_depth, self.latency
+
+
+def get_quality_report():
+    '''
+    The governor's current profile and load, and the number of requests
+    served by each profile so far
+    '''
+    quality, queue_depth, latency = governor.get_state()
+    return {'enabled': governor.enabled,
+            'quality': quality,
+            'queue_depth': queue_depth,
+            'latency_secs': round(latency, 3),
+            'quality_stats': {level: quality_stats[level] for level in quality_levels}}
+
+def make_quality_route():
+    '''
+    Makes the starlette route serving the quality report
+    '''
+
+    async def render_quality(request):
+
+        return JSONResponse(get_quality_report())
+
+    return Route('/render-quality', render_quality)
+
+def get_quality_params(quality, plot_settings, render_size):
+    '''
+    Given a quality profile, and the requested plot settings (show_text, stint_val, cmap_name)
+    and render size (width, height, scale), returns the plot settings and render size
+    to render at for that profile
+    '''
+    profile = quality_profiles[quality]
+    if profile['default_image']:
+        plot_settings = default_plot_settings
+    if profile['low_dpi']:
+        width, height, scale = render_size
+        render_size = (width, height, min(scale, low_dpi_max_scale))
+    return plot_settings, render_size
+
+
+governor = QualityGovernor()
@@ -0,0 +1,148 @@
+'''
+Plain HTTP endpoint for rotation plot images, mounted next to the shiny app,
+so that plots can be embedded (i.e. on plotandroll.com, or in social previews)
+and cached by browsers and CDNs, without a live shiny session:
+
+    /rotation/{season_str}/{season_type}/{game_id}.{png,webp}?stint_val=pm&cmap=RdBu_r&text=1
+
+where season_type is one of regular-season, playin, playoffs.
+
+Responses carry a strong ETag made from the game's data version and the 
+render parameters (so conditional requests get a 304 without rendering),
+and completed games are cached for a long time.
+The images come from the same cache the app's plots use (see game_cache.py),
+and like them are rendered at a lower quality when the server is busy
+(see render_quality.py), noted in the X-Render-Quality header.
+Those are only cached briefly, and with their own ETag.
+'''
+
+import math
+import hashlib
+import pandas as pd
+from starlette.routing import Route
+from starlette.responses import Response
+from starlette.concurrency import run_in_threadpool
+
+from load_data_utils import get_game_data_version
+from plot_utils import diverging_cmaps, sequential_cmaps
+from img_utils import plot_profiles, pil_kwargs
+from game_cache import get_governed_img
+from profile_utils import profiled, is_profile_requested
+
+
+# bump when the look of the plots changes, to invalidate cached images
+rotation_img_version = 1
+
+season_type_slugs = {'regular-season': 'Regular Season',
+                     'playin': 'PlayIn',
+                     'playoffs': 'Playoffs'}
+
+completed_cache_control = 'public, max-age=604800'
+incomplete_cache_control = 'public, max-age=60'
+not_found_cache_control = 'public, max-age=300'
+
+
+def get_render_params(query_params):
+    '''
+    Given the query parameters of a request, returns the plot settings
+    (show_text, stint_val, cmap_name), and render size (width, height, scale),
+    or None if they aren't valid
+    '''
+    stint_val = query_params.get('stint_val', 'pm')
+    if stint_val not in ['pm', 'player_pts', 'none']:
+        return None
+    
+    cmap_choices = sequential_cmaps if stint_val == 'player_pts' else diverging_cmaps
+    cmap_name = query_params.get('cmap', cmap_choices[0])
+    if stint_val == 'none':
+        cmap_name = cmap_choices[0]
+    elif cmap_name not in cmap_choices:
+        return None
+    
+    show_text = query_params.get('text', '1') not in ['0', 'false']
+
+    profile = plot_profiles['desktop']
+    try:
+        scale = float(query_params.get('scale', 1))
+    except ValueError:
+        return None
+    # float() also takes 'nan' and 'inf'
+    if not math.isfinite(scale):
+        return None
+    scale = min(max(1, round(4*scale)/4), profile['max_pixelratio'])
+
+    return (show_text, stint_val, cmap_name), (profile['width'], profile['height'], scale)
+
+def get_profiled_img(profile, season_str, season_type, game_info, df_team_info,
+                     plot_settings, render_size, fmt):
+    '''
+    Gets a rotation plot image and its quality profile from the cache 
+    (see game_cache.get_governed_img), profiling it if asked to (see profile_utils.py)
+    '''
+    show_text, stint_val, cmap_name = plot_settings
+    with profiled('rotation_img', force=profile,
+                  game_id=game_info['GAME_ID'], stint_val=stint_val, cmap=cmap_name,
+                  text=int(show_text), width=render_size[0], scale=render_size[2], fmt=fmt):
+        return get_governed_img(season_str, season_type, game_info, df_team_info,
+                                plot_settings, render_size, fmt)
+
+def make_rotation_route(get_lgl_T, df_team_info):
+    '''
+    Makes the starlette route serving rotation plot images,
+    given a function returning the current team league game logs,
+    and the team info the app loaded
+    '''
+
+    async def rotation_img(request):
+
+        season_str = request.path_params['season_str']
+        season_type = season_type_slugs.get(request.path_params['season_type'])
+        game_id = request.path_params['game_id']
+        fmt = request.path_params['fmt']
+
+        render_params = get_render_params(request.query_params)
+
+        if season_type is None or fmt not in pil_kwargs or render_params is None:
+            return Response('invalid request', status_code=400)
+        plot_settings, render_size = render_params
+
+        df_lgl_T_all = get_lgl_T()
+        game_info = df_lgl_T_all[(df_lgl_T_all['GAME_ID'] == game_id) & \
+                                 (df_lgl_T_all['season_str'] == season_str) & \
+                                 (df_lgl_T_all['season_type'] == season_type)]
+        data_version = get_game_data_version(season_str, game_id, season_type)
+
+        if len(game_info) == 0 or data_version is None:
+            return Response('game not found', status_code=404,
+                            headers={'Cache-Control': not_found_cache_control})
+        game_info = game_info.iloc[0]
+
+        etag_key = repr((rotation_img_version, season_str, season_type, game_id, 
+                         data_version, plot_settings, render_size, fmt))
+        etag = '"{}"'.format(hashlib.sha1(etag_key.encode()).hexdigest())
+        # games only get a win/loss in the game log once they're over
+        is_completed = not pd.isna(game_info['WL'])
+        headers = {'ETag': etag, 
+                   'Cache-Control': completed_cache_control if is_completed else incomplete_cache_control}
+
+        if etag in [x.strip() for x in request.headers.get('if-none-match', '').split(',')]:
+            return Response(status_code=304, headers=headers)
+        
+        # rendering holds the render lock, so keep it off the event loop
+        img, quality = await run_in_threadpool(get_profiled_img, is_profile_requested(request.query_params),
+                                               season_str, season_type, game_info, df_team_info,
+                                               plot_settings, render_size, fmt)
+        
+        if img is None:
+            return Response('game not found', status_code=404,
+                            headers={'Cache-Control': not_found_cache_control})
+
+        headers['X-Render-Quality'] = quality
+        # a lower quality image shouldn't stand in for the full one for long
+        if quality != 'full':
+            headers['ETag'] = '"{}"'.format(hashlib.sha1(f'{etag_key}{quality}'.encode()).hexdigest())
+            headers['Cache-Control'] = incomplete_cache_control
+
+        return Response(img, media_type=f'image/{fmt}', headers=headers)
+
+    return Route('/rotation/{season_str}/{season_type}/{game_id}.{fmt}', rotation_img)
@@ -0,0 +1,285 @@
+'''
+Utility functions for the playoff series view, comparing the rotations
+of every game of a series side by side.
+
+Series are found by grouping a season's playoff games by matchup
+(the two teams) in the league game log. Each game gets a compact strip:
+one row per player, stints as rectangles colored on one color scale
+for the whole series, with every game's players in the same order
+(by series minutes) and the same time axis, so rows line up across games.
+
+The strips are drawn in parallel, one game per worker process
+(matplotlib isn't thread safe, so processes rather than threads),
+returned as pixel arrays, and put side by side in one image,
+so the series takes about as long as the slowest of its games.
+'''
+
+import os
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from load_data_utils import get_grs, get_game_data_version
+from plot_utils import (cmap_VMIN, cmap_VMAX, shift_rectangle_height,
+                        load_matplotlib, warm_up_matplotlib, use_offscreen_backend)
+from img_utils import encode_rgba
+
+
+# size of each game's strip, in pixels
+strip_width = 320
+strip_height = 800
+label_width = 170        # extra width of the first strip, for the player names
+colorbar_width = 90      # extra width of the last strip, for the color scale
+strip_dpi = 100
+
+# most worker processes drawing strips (a series has at most 7 games)
+max_series_workers = min(7, os.cpu_count() or 1)
+
+series_img_cache_size = 32
+
+# columns of get_playoff_series
+series_columns = ['series_id', 'series_str', 'team_a', 'team_b', 'team_a_id', 'team_b_id',
+                  'game_ids', 'game_strs']
+
+_pool = None
+_pool_lock = threading.Lock()
+_series_img_cache = OrderedDict()
+_series_img_cache_lock = threading.Lock()
+
+
+def get_playoff_series(df_lgl_T, season_str):
+    '''
+    Given league game logs (one row per team per game, with season_str
+    and season_type columns), returns a season's playoff series,
+    one row per series, in the order they started, with:
+     - series_id (i.e. 'BOS-MIA'), and series_str (i.e. 'BOS 4-1 MIA'),
+     - the two teams' abbreviations and ids (team_a, team_b, team_a_id, team_b_id),
+       team_a being the team with home court in game 1
+     - the series' game_ids, and their labels (game_strs), in order
+    (no rows if the season has no playoff games yet)
+    '''
+    df_po = df_lgl_T[(df_lgl_T['season_str'] == season_str) &
+                     (df_lgl_T['season_type'] == 'Playoffs')]
+    df_home = df_po[~df_po['MATCHUP'].str.contains('@')].sort_values(['GAME_DATE', 'GAME_ID'])
+
+    df_opp = df_po[df_po['MATCHUP'].str.contains('@')].set_index('GAME_ID')
+    df_home = df_home.assign(OPP_ABBREVIATION=df_opp.loc[df_home['GAME_ID'], 'TEAM_ABBREVIATION'].values,
+                             OPP_ID=df_opp.loc[df_home['GAME_ID'], 'TEAM_ID'].values)
+
+    # matchups are the same regardless of who's home
+    pair = np.sort(np.stack((df_home['TEAM_ABBREVIATION'].values.astype(str),
+                             df_home['OPP_ABBREVIATION'].values.astype(str))), axis=0)
+    df_home['series_id'] = pair[0] + '-' + pair[1]
+
+    series_rows = []
+    for series_id, df_series in df_home.groupby('series_id', sort=False):
+        game1 = df_series.iloc[0]
+        team_a, team_b = game1['TEAM_ABBREVIATION'], game1['OPP_ABBREVIATION']
+        is_a_home = (df_series['TEAM_ABBREVIATION'] == team_a).values
+        home_won = (df_series['WL'] == 'W').values
+        wins_a = int(np.sum(home_won == is_a_home))
+        wins_b = len(df_series) - wins_a
+
+        series_rows.append({'series_id': series_id,
+                            'series_str': f'{team_a} {wins_a}-{wins_b} {team_b}',
+                            'team_a': team_a, 'team_b': team_b,
+                            'team_a_id': game1['TEAM_ID'], 'team_b_id': game1['OPP_ID'],
+                            'game_ids': tuple(df_series['GAME_ID'].astype(str)),
+                            'game_strs': tuple('G{}: {} {} {}-{} {}'.format(
+                                                   i + 1, row['GAME_DATE'][5:],
+                                                   row['OPP_ABBREVIATION'],
+                                                   int(df_opp.loc[row['GAME_ID'], 'PTS']), int(row['PTS']),
+                                                   row['TEAM_ABBREVIATION'])
+                                               for i, (_, row) in enumerate(df_series.iterrows()))})
+
+    return pd.DataFrame(series_rows, columns=series_columns)
+
+def get_series_layout(df_gr, team_ids, stint_val='pm'):
+    '''
+    Given the stints of every game of a series, returns what the strips share:
+    each team's players in order of series minutes (PERSON_ID and name),
+    the end of the longest game (in minutes), and the color scale limits
+    '''
+    df_gr = df_gr.assign(min=(df_gr['OUT_TIME_REAL'] - df_gr['IN_TIME_REAL'])/600,
+                         nameI=df_gr['PLAYER_FIRST'].str[0] + '. ' + df_gr['PLAYER_LAST'])
+
+    player_orders = {}
+    for team_id in team_ids:
+        player_mins = (df_gr[df_gr['TEAM_ID'] == team_id]
+                       .groupby(['PERSON_ID', 'nameI'])['min'].sum()
+                       .sort_values(ascending=False)
+                       .reset_index())
+        player_orders[team_id] = (player_mins['PERSON_ID'].tolist(), player_mins['nameI'].tolist())
+
+    # games end at the end of a period (12 minutes, 5 per OT)
+    end_min = max(48, df_gr['OUT_TIME_REAL'].max()/600)
+
+    vmin, vmax = cmap_VMIN, cmap_VMAX
+    if stint_val == 'player_pts':
+        vmin, vmax = 0, max(1, df_gr['PLAYER_PTS'].max())
+
+    return player_orders, end_min, (vmin, vmax)
+
+def draw_series_strip(df_gr_game, team_ids, team_abbrs, team_colors, player_orders, end_min,
+                      title, stint_val, cmap_name, clims,
+                      show_labels=False, show_colorbar=False):
+    '''
+    Draws one game's strip of a series (runs in a worker process),
+    given its stints, the two teams' ids, abbreviations and colors, the series layout
+    (see get_series_layout), the strip's title, and how to color stints.
+    Returns the strip as an RGBA pixel array.
+    '''
+    load_matplotlib()
+    from plot_utils import mpl, plt
+
+    width = strip_width + show_labels*label_width + show_colorbar*colorbar_width
+    fig = plt.figure(figsize=(width/strip_dpi, strip_height/strip_dpi), dpi=strip_dpi)
+
+    # axes positions in figure fractions, leaving room for labels/colorbar
+    left = (show_labels*label_width + 8)/width
+    right = 1 - (show_colorbar*colorbar_width + 8)/width
+    n_players = [len(player_orders[team_id][0]) for team_id in team_ids]
+    bottom, top, gap = 0.05, 0.93, 0.03
+    heights = (top - bottom - gap)*np.array(n_players)/sum(n_players)
+
+    norm = mpl.colors.Normalize(vmin=clims[0], vmax=clims[1])
+    cmap = mpl.colormaps[cmap_name]
+
+    ax_bottom = top
+    for i_team, team_id in enumerate(team_ids):
+        ax_bottom -= heights[i_team] + (gap if i_team > 0 else 0)
+        ax = fig.add_axes([left, ax_bottom, right - left, heights[i_team]])
+
+        person_ids, names = player_orders[team_id]
+        ypos = {person_id: len(person_ids) - i for i, person_id in enumerate(person_ids)}
+        df_team = df_gr_game[df_gr_game['TEAM_ID'] == team_id]
+
+        # all of a team's stints as one collection of rectangles
+        x0 = df_team['IN_TIME_REAL'].values/600
+        x1 = df_team['OUT_TIME_REAL'].values/600
+        y = df_team['PERSON_ID'].map(ypos).values
+        verts = np.stack([np.stack([x0, y - shift_rectangle_height], axis=1),
+                          np.stack([x1, y - shift_rectangle_height], axis=1),
+                          np.stack([x1, y + shift_rectangle_height], axis=1),
+                          np.stack([x0, y + shift_rectangle_height], axis=1)], axis=1)
+        if stint_val == 'none':
+            facecolors = team_colors[i_team]
+        else:
+            facecolors = cmap(norm(df_team['PT_DIFF' if stint_val == 'pm' else 'PLAYER_PTS'].values))
+        ax.add_collection(mpl.collections.PolyCollection(verts, facecolors=facecolors,
+                                                         edgecolors='k', linewidths=0.5))
+
+        ax.set_xlim(0, end_min)
+        ax.set_ylim(0.4, len(person_ids) + 0.6)
+        ax.set_xticks(np.arange(0, end_min + 1e-5, 12))
+        ax.set_xticklabels([])
+        ax.set_yticks(1 + np.arange(len(person_ids)))
+        ax.set_yticklabels(names[::-1] if show_labels else [], size=9)
+        if show_labels:
+            ax.set_ylabel(team_abbrs[i_team], size=12, weight='bold')
+        ax.tick_params(length=0)
+        ax.grid(axis='x', color='0.8')
+
+    fig.suptitle(title, size=11, y=0.985)
+
+    if show_colorbar and stint_val != 'none':
+        cax = fig.add_axes([1 - (colorbar_width - 12)/width, bottom, 12/width, top - bottom])
+        cbar = fig.colorbar(mpl.cm.ScalarMappable(norm=norm, cmap=cmap), cax=cax)
+        cbar.set_label('stint +/-' if stint_val == 'pm' else 'player points in stint', size=9)
+        cbar.ax.tick_params(labelsize=8)
+
+    fig.canvas.draw()
+    img = np.asarray(fig.canvas.buffer_rgba()).copy()
+    plt.close(fig)
+
+    return img
+
+def init_series_worker():
+    '''
+    Loads matplotlib (off screen) and warms it up in a worker process
+    '''
+    use_offscreen_backend()
+    warm_up_matplotlib()
+
+def get_pool():
+    '''
+    Starts (once) the worker processes that draw series strips,
+    with matplotlib already loaded and warmed up in each of them
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork, as the app has threads running
+            _pool = ProcessPoolExecutor(max_workers=max_series_workers,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=init_series_worker)
+        return _pool
+
+def get_series_img(season_str, series, df_team_info, stint_val='pm', cmap_name='RdBu_r', fmt='webp'):
+    '''
+    Given a row of get_playoff_series, makes the series view image
+    (every game's strip, side by side), encoded in fmt,
+    drawing the games in parallel worker processes.
+    Returns the image bytes, or None if none of the games have data.
+    Images are cached (by the games' data versions and the settings).
+    '''
+    season_type = 'Playoffs'
+    game_ids = list(series['game_ids'])
+    data_versions = tuple(get_game_data_version(season_str, game_id, season_type) for game_id in game_ids)
+    key = (season_str, series['series_id'], tuple(game_ids), data_versions, stint_val, cmap_name, fmt)
+
+    with _series_img_cache_lock:
+        if key in _series_img_cache:
+            _series_img_cache.move_to_end(key)
+            return _series_img_cache[key]
+
+    df_gr = get_grs(season_str, game_ids, season_type=season_type,
+                    columns=['TEAM_ID', 'PERSON_ID', 'PLAYER_FIRST', 'PLAYER_LAST',
+                             'IN_TIME_REAL', 'OUT_TIME_REAL', 'PLAYER_PTS', 'PT_DIFF'])
+    if len(df_gr) == 0:
+        return None
+
+    team_ids = [series['team_a_id'], series['team_b_id']]
+    team_colors = [df_team_info.loc[df_team_info['TEAM_ID'] == team_id, 'COLOR1'].iloc[0]
+                   for team_id in team_ids]
+    player_orders, end_min, clims = get_series_layout(df_gr, team_ids, stint_val)
+
+    # only games with data (i.e. not yet played, or missing)
+    games = [(game_id, game_str) for game_id, game_str in zip(game_ids, series['game_strs'])
+             if (df_gr['GAME_ID'] == game_id).any()]
+
+    pool = get_pool()
+    team_abbrs = [series['team_a'], series['team_b']]
+    futures = [pool.submit(draw_series_strip, df_gr[df_gr['GAME_ID'] == game_id], team_ids, team_abbrs, team_colors,
+                           player_orders, end_min, game_str, stint_val, cmap_name, clims,
+                           i == 0, i == len(games) - 1)
+               for i, (game_id, game_str) in enumerate(games)]
+    img = encode_rgba(np.concatenate([future.result() for future in futures], axis=1), fmt)
+
+    with _series_img_cache_lock:
+        _series_img_cache[key] = img
+        while len(_series_img_cache) > series_img_cache_size:
+            _series_img_cache.popitem(last=False)
+
+    return img
+
+
+if __name__ == '__main__':
+
+    import time
+    from load_data_utils import get_lgls
+
+    season_str = '2023-24'
+    df_team_info = pd.read_csv('data/df_team_info.csv')
+    df_lgl_T_all, _ = get_lgls([season_str])
+    df_series = get_playoff_series(df_lgl_T_all, season_str)
+    print(df_series[['series_id', 'series_str', 'game_ids']])
+
+    get_pool().submit(int).result()
+    series = df_series.iloc[0]
+    t_start = time.time()
+    img = get_series_img(season_str, series, df_team_info)
+    print('{}: {:.0f} kB in {:.2f} s'.format(series['series_str'], len(img)/1e3, time.time() - t_start))
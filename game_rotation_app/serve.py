@@ -0,0 +1,89 @@
+"""
+Entry point for serving the shiny app with multiple worker processes, i.e.
+
+    python serve.py --workers 4 --port 8000
+
+The season data (team info, league game logs) is loaded once here,
+written to memory-mappable Arrow files (see shared_data.py),
+and every worker maps those same files instead of reading the CSVs
+into its own copy, so an extra worker only costs its own per-session state.
+The game logs are checked for the nightly update's new rows (as the app does
+on its own, see load_data_utils.LeagueGameLogStore), and written again as
+a new version when they change, which the workers then move to.
+
+Note that shiny sessions live in one worker, so a load balancer in front
+of several workers (or several machines) needs sticky sessions.
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import threading
+import pandas as pd
+import uvicorn
+
+from load_data_utils import LeagueGameLogStore, season_strs
+from shared_data import write_shared_frames, write_shared_lgls
+
+
+# how often (in seconds) to check the saved game logs for new rows
+lgl_poll_secs = 60
+
+
+def get_default_shared_dir():
+    '''
+    Default location for the shared data files,
+    in memory (/dev/shm) if available, otherwise a temporary directory
+    '''
+    base_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base_dir, 'rotation_app_data')
+
+
+def write_app_data(shared_dir, data_dir='./data/'):
+    '''
+    Loads the season data the app needs and writes it to shared_dir,
+    returning the game logs' store, to keep them up to date
+    '''
+    df_team_info = pd.read_csv(os.path.join(data_dir, 'df_team_info.csv'))
+    write_shared_frames({'df_team_info': df_team_info}, shared_dir)
+
+    lgl_store = LeagueGameLogStore(season_strs, data_dir)
+    write_shared_lgls(*lgl_store.get_lgls(), shared_dir)
+
+    return lgl_store
+
+def watch_lgls(lgl_store, shared_dir, poll_secs=lgl_poll_secs):
+    '''
+    In the background, writes a new version of the shared game logs
+    whenever their saved files get new rows
+    '''
+    def watch():
+        while True:
+            time.sleep(poll_secs)
+            try:
+                if lgl_store.refresh():
+                    version = write_shared_lgls(*lgl_store.get_lgls(), shared_dir)
+                    print(f'shared game logs updated to version {version}')
+            except Exception as e:
+                print(f'updating the shared game logs failed: {e}')
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serve the rotation app with multiple workers')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--shared-dir', default=get_default_shared_dir())
+    args = parser.parse_args()
+
+    lgl_store = write_app_data(args.shared_dir)
+    watch_lgls(lgl_store, args.shared_dir)
+
+    # workers inherit the environment, and so read the shared data
+    os.environ['ROTATION_SHARED_DATA_DIR'] = args.shared_dir
+
+    uvicorn.run('app:app', host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,138 @@
+'''
+Utility functions for sharing the read-only season data
+(league game logs and team info) between multiple app worker processes.
+
+The dataframes are written once, uncompressed, to Arrow IPC files,
+and every worker memory maps them and wraps them in pandas dataframes
+backed by the Arrow buffers (no copies), so the data is held only once
+in the OS page cache no matter how many workers there are.
+Only per-session state is private to each worker.
+
+The game logs get new rows every night, so they're written as versions,
+each in its own directory (v1/, v2/, ...), with the current version noted
+in version.json, written last. When serve.py writes a new version,
+workers map it (see SharedLeagueGameLogs) the next time their sessions
+check for new rows, while mappings of the previous version stay valid
+until they're let go. Only the last two versions are kept.
+
+Requires pyarrow (only needed when serving with multiple workers).
+'''
+
+import os
+import json
+import shutil
+import threading
+import pandas as pd
+import pyarrow as pa
+
+
+# game logs, written as versions
+lgl_frame_names = ['df_lgl_T_all', 'df_lgl_P_all']
+
+
+def write_shared_frames(frames, shared_dir):
+    '''
+    Given a dictionary of dataframe name -> dataframe,
+    writes each one to an uncompressed Arrow IPC file in shared_dir
+    (the index is not kept)
+    '''
+    if not os.path.isdir(shared_dir):
+        os.makedirs(shared_dir)
+        print('making shared data directory: {}'.format(os.path.abspath(shared_dir)))
+
+    for name, df in frames.items():
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        # write to a temporary file first, so that workers
+        # never map a partially written file
+        fpath = os.path.join(shared_dir, f'{name}.arrow')
+        with pa.OSFile(fpath + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(fpath + '.tmp', fpath)
+        print(f'saving to {fpath}...')
+
+def read_shared_frame(name, shared_dir):
+    '''
+    Memory maps a dataframe written by write_shared_frames,
+    returning a dataframe whose columns are views of the mapped file
+    '''
+    source = pa.memory_map(os.path.join(shared_dir, f'{name}.arrow'), 'r')
+    table = pa.ipc.open_file(source).read_all()
+
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def get_lgl_version(shared_dir):
+    '''
+    The current version of the shared game logs (None if none was written)
+    '''
+    fpath = os.path.join(shared_dir, 'version.json')
+    if not os.path.exists(fpath):
+        return None
+    with open(fpath) as f:
+        return json.load(f)['version']
+
+def write_shared_lgls(df_lgl_T_all, df_lgl_P_all, shared_dir):
+    '''
+    Writes the team and player game logs as the next version of them,
+    returning the version
+    '''
+    version = (get_lgl_version(shared_dir) or 0) + 1
+    write_shared_frames({'df_lgl_T_all': df_lgl_T_all, 'df_lgl_P_all': df_lgl_P_all},
+                        os.path.join(shared_dir, f'v{version}'))
+
+    # only then is the version current
+    fpath = os.path.join(shared_dir, 'version.json')
+    with open(fpath + '.tmp', 'w') as f:
+        json.dump({'version': version}, f)
+    os.replace(fpath + '.tmp', fpath)
+
+    for old_version in range(1, version - 1):
+        shutil.rmtree(os.path.join(shared_dir, f'v{old_version}'), ignore_errors=True)
+
+    return version
+
+def read_shared_lgls(shared_dir, version):
+    '''
+    Memory maps a version of the shared team and player game logs
+    '''
+    return [read_shared_frame(name, os.path.join(shared_dir, f'v{version}')) for name in lgl_frame_names]
+
+
+class SharedLeagueGameLogs:
+    '''
+    A worker's mapping of the shared game logs, moved to the
+    current version when refreshed (like load_data_utils.LeagueGameLogStore,
+    whose new rows serve.py writes as new versions)
+    '''
+
+    def __init__(self, shared_dir):
+        self.shared_dir = shared_dir
+        self.version = None
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def get_file_states(self):
+        '''
+        The current version of the shared game logs (cheap, to check for changes)
+        '''
+        return get_lgl_version(self.shared_dir)
+
+    def refresh(self):
+        '''
+        Maps the current version of the game logs if it's new,
+        returning whether it was
+        '''
+        with self.lock:
+            version = get_lgl_version(self.shared_dir)
+            if version == self.version:
+                return False
+            self.df_lgl_T_all, self.df_lgl_P_all = read_shared_lgls(self.shared_dir, version)
+            self.version = version
+            return True
+
+    def get_lgls(self):
+        '''
+        The team and player game logs, as returned by get_lgls
+        '''
+        return self.df_lgl_T_all, self.df_lgl_P_all
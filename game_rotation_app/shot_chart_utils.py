@@ -0,0 +1,326 @@
+'''
+Utility functions for shot charts of a game, a player's season or a team's season,
+from the shot locations (LOCX, LOCY, in tenths of feet from the basket)
+in the pbpstats play by plays (data/pbpstats/pbp/{season_str}_{season type}/).
+
+Rather than scanning every play by play of a season whenever a chart is shown,
+at ingest time (see data/update_all_data.py) each game's shots are binned
+on a grid over the half court (bin_size x bin_size tenths of feet),
+as attempts and makes per bin for each shooter in the game,
+and saved for the whole season as one set of arrays in data/shot_charts/:
+    game_ids, team_ids, player_ids: one row per shooter per game
+    attempts, makes: (n rows) x (n y bins) x (n x bins) counts
+Only games not binned yet are read each night.
+A player's or team's season chart is then the sum of its rows.
+Shots from beyond the grid (i.e. heaves from the backcourt) aren't binned.
+'''
+
+import os
+import argparse
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from load_data_utils import season_strs, season_type_suffixes, get_season_suffix
+from plot_utils import load_matplotlib
+from img_utils import encode_fig
+
+
+pbpstats_dir = 'data/pbpstats/pbp/'
+shot_charts_dir = 'data/shot_charts/'
+
+# names of the pbpstats play by play directories for each season type
+pbpstats_season_types = {'Regular Season': 'RegularSeason',
+                         'PlayIn': 'PlayIn',
+                         'Playoffs': 'Playoffs'}
+
+# event types of made and missed shots
+made_shot_etype = 1
+missed_shot_etype = 2
+
+# the grid of bins, in tenths of feet from the basket:
+# the width of the court, and from behind the baseline to about half court
+bin_size = 20
+x_edges = np.arange(-250, 250 + 1, bin_size)
+y_edges = np.arange(-50, 430 + 1, bin_size)
+
+shot_columns = ['PID', 'TID', 'ETYPE', 'LOCX', 'LOCY']
+
+# size of the chart image (in CSS pixels)
+chart_width = 600
+chart_height = 600
+
+# field goal percentages at the ends of the color scale
+chart_fg_pct_lims = (0.25, 0.65)
+
+
+def get_pbpstats_fpaths(season_str, season_type='Regular Season', data_dir=pbpstats_dir):
+    '''
+    Lists a season's saved pbpstats play by plays,
+    returning a dictionary of game_id -> file path
+    '''
+    season_dir = os.path.join(data_dir, '{}_{}'.format(season_str, pbpstats_season_types[season_type]))
+
+    d_fpaths = {}
+    if os.path.isdir(season_dir):
+        for fname in sorted(os.listdir(season_dir)):
+            if fname.startswith('df_pbp_') and fname.endswith('.csv'):
+                d_fpaths[fname[len('df_pbp_'):-4]] = os.path.join(season_dir, fname)
+    return d_fpaths
+
+def read_shots(d_fpaths, n_workers=8):
+    '''
+    Given a dictionary of game_id -> pbpstats play by play file path,
+    reads every shot of those games (in parallel, n_workers threads),
+    returning one dataframe of them, with the game's position in d_fpaths (i_game)
+    '''
+    def read_one(i_fpath):
+        i_game, fpath = i_fpath
+        df = pd.read_csv(fpath, usecols=shot_columns)
+        df = df[df['ETYPE'].isin([made_shot_etype, missed_shot_etype])]
+        return df.assign(i_game=i_game)
+
+    if len(d_fpaths) == 0:
+        return pd.DataFrame(columns=shot_columns + ['i_game'])
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return pd.concat(executor.map(read_one, enumerate(d_fpaths.values())), ignore_index=True)
+
+def bin_shots(df_shots, game_ids):
+    '''
+    Bins shots (see read_shots) of the games game_ids, all at once,
+    returning a dictionary of arrays with one row per shooter per game:
+    game_ids, team_ids, player_ids, and their attempts and makes in each bin
+    '''
+    n_x, n_y = len(x_edges) - 1, len(y_edges) - 1
+    i_x = np.floor((df_shots['LOCX'].to_numpy() - x_edges[0])/bin_size).astype(int)
+    i_y = np.floor((df_shots['LOCY'].to_numpy() - y_edges[0])/bin_size).astype(int)
+    on_grid = (i_x >= 0) & (i_x < n_x) & (i_y >= 0) & (i_y < n_y)
+    df_shots = df_shots[on_grid]
+
+    # one row per (game, team, shooter)
+    df_rows = df_shots[['i_game', 'TID', 'PID']].drop_duplicates().sort_values(['i_game', 'TID', 'PID'])
+    i_rows = (pd.MultiIndex.from_frame(df_rows)
+              .get_indexer(pd.MultiIndex.from_frame(df_shots[['i_game', 'TID', 'PID']])))
+
+    i_bins = i_rows*n_x*n_y + i_y[on_grid]*n_x + i_x[on_grid]
+    is_made = (df_shots['ETYPE'] == made_shot_etype).to_numpy()
+    n_bins = len(df_rows)*n_x*n_y
+
+    return {'game_ids': np.asarray(game_ids, dtype=str)[df_rows['i_game'].to_numpy(dtype=int)],
+            'team_ids': df_rows['TID'].to_numpy(dtype=np.int64),
+            'player_ids': df_rows['PID'].to_numpy(dtype=np.int64),
+            'attempts': np.bincount(i_bins, minlength=n_bins).astype(np.uint8).reshape(-1, n_y, n_x),
+            'makes': np.bincount(i_bins[is_made], minlength=n_bins).astype(np.uint8).reshape(-1, n_y, n_x)}
+
+def get_shot_bins(season_str, season_type='Regular Season', game_ids=None):
+    '''
+    Reads and bins the shots (see bin_shots) of a season's saved pbpstats play by plays,
+    for the given game_ids (or all of them)
+    '''
+    d_fpaths = get_pbpstats_fpaths(season_str, season_type)
+    if game_ids is not None:
+        d_fpaths = {game_id: d_fpaths[game_id] for game_id in game_ids if game_id in d_fpaths}
+    return bin_shots(read_shots(d_fpaths), list(d_fpaths))
+
+def get_shot_bins_fpath(season_str, season_type='Regular Season', data_dir=shot_charts_dir):
+    '''
+    Path of a season's saved shot bins
+    '''
+    return os.path.join(data_dir, 'shots_{}{}.npz'.format(season_str, get_season_suffix(season_type)))
+
+def update_shot_bins(season_str, season_type='Regular Season', data_dir=shot_charts_dir, rebuild=False):
+    '''
+    Bins the shots of a season's games that aren't in its saved shot bins yet
+    (or of every game, if rebuild), adding them to the saved shot bins.
+    Returns the number of games binned.
+    '''
+    fpath = get_shot_bins_fpath(season_str, season_type, data_dir)
+
+    bins = None
+    if os.path.exists(fpath) and not rebuild:
+        with np.load(fpath) as saved:
+            bins = {k: saved[k] for k in saved.files}
+
+    d_fpaths = get_pbpstats_fpaths(season_str, season_type)
+    binned_ids = set() if bins is None else set(bins['game_ids'])
+    new_ids = [game_id for game_id in d_fpaths if game_id not in binned_ids]
+    if len(new_ids) == 0:
+        return 0
+
+    new_bins = get_shot_bins(season_str, season_type, new_ids)
+    if bins is not None:
+        new_bins = {k: np.concatenate((bins[k], new_bins[k])) for k in bins}
+
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+        print('making data directory: {}'.format(os.path.abspath(data_dir)))
+
+    print(f'saving to... {fpath}')
+    fpath_tmp = f'{fpath}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(fpath_tmp, **new_bins)
+    os.replace(fpath_tmp, fpath)
+
+    return len(new_ids)
+
+@lru_cache(maxsize=8)
+def _load_shot_bins(season_str, season_type, file_version):
+
+    if file_version is None:
+        return get_shot_bins(season_str, season_type)
+
+    with np.load(get_shot_bins_fpath(season_str, season_type)) as saved:
+        return {k: saved[k] for k in saved.files}
+
+def load_shot_bins(season_str, season_type='Regular Season', build_missing=True):
+    '''
+    Loads a season's saved shot bins (see bin_shots),
+    binning them instead if they haven't been saved (and build_missing),
+    or returning None if they can't be.
+    The app only reads saved bins: binning a season's play by plays takes seconds.
+    '''
+    fpath = get_shot_bins_fpath(season_str, season_type)
+    if os.path.exists(fpath):
+        fstat = os.stat(fpath)
+        return _load_shot_bins(season_str, season_type, (fstat.st_size, fstat.st_mtime_ns))
+
+    if not build_missing or len(get_pbpstats_fpaths(season_str, season_type)) == 0:
+        return None
+    return _load_shot_bins(season_str, season_type, None)
+
+def has_shot_data(season_str, season_type='Regular Season', build_missing=True):
+    '''
+    Whether a season has shot bins saved or (if build_missing) pbpstats play by plays to bin
+    '''
+    return (os.path.exists(get_shot_bins_fpath(season_str, season_type)) or
+            (build_missing and len(get_pbpstats_fpaths(season_str, season_type)) > 0))
+
+def get_shot_chart(season_str, season_type='Regular Season',
+                   game_id=None, team_id=None, player_id=None, build_missing=True):
+    '''
+    Sums a season's shot bins for a game, team and/or player (any left as None aren't filtered on),
+    returning the attempts and makes in each bin, as (n y bins) x (n x bins) arrays
+    (all zero if the season has no shot bins, see load_shot_bins)
+    '''
+    bins = load_shot_bins(season_str, season_type, build_missing)
+    if bins is None:
+        empty = np.zeros((len(y_edges) - 1, len(x_edges) - 1), dtype=np.int32)
+        return empty, empty.copy()
+
+    keep = np.ones(len(bins['game_ids']), dtype=bool)
+    if game_id is not None:
+        keep &= bins['game_ids'] == game_id
+    if team_id is not None:
+        keep &= bins['team_ids'] == int(team_id)
+    if player_id is not None:
+        keep &= bins['player_ids'] == int(player_id)
+
+    return bins['attempts'][keep].sum(axis=0, dtype=np.int32), bins['makes'][keep].sum(axis=0, dtype=np.int32)
+
+def get_shooters(season_str, season_type='Regular Season', team_id=None, build_missing=True):
+    '''
+    A season's shooters (of a team, if given), with their shot attempts
+    (most first), as a dataframe of player_id, team_id, attempts
+    (empty if the season has no shot bins, see load_shot_bins)
+    '''
+    bins = load_shot_bins(season_str, season_type, build_missing)
+    if bins is None:
+        return pd.DataFrame({'player_id': np.array([], dtype=np.int64), 'team_id': np.array([], dtype=np.int64),
+                             'attempts': np.array([], dtype=np.int64)})
+
+    keep = np.ones(len(bins['game_ids']), dtype=bool) if team_id is None else bins['team_ids'] == int(team_id)
+
+    df = pd.DataFrame({'player_id': bins['player_ids'][keep],
+                       'team_id': bins['team_ids'][keep],
+                       'attempts': bins['attempts'][keep].sum(axis=(1, 2))})
+    return (df.groupby(['player_id', 'team_id'], as_index=False)['attempts'].sum()
+              .sort_values('attempts', ascending=False, ignore_index=True))
+
+def draw_court(ax, color='0.6', lw=1):
+    '''
+    Draws half court lines (in tenths of feet from the basket) on an axes
+    '''
+    from plot_utils import mpl
+
+    patches = [mpl.patches.Circle((0, 0), radius=7.5, fill=False),                     # hoop
+               mpl.patches.Rectangle((-30, -7.5), 60, 0),                               # backboard
+               mpl.patches.Rectangle((-80, -47.5), 160, 190, fill=False),               # paint
+               mpl.patches.Arc((0, 142.5), 120, 120, theta1=0, theta2=180),             # free throw circle
+               mpl.patches.Arc((0, 0), 80, 80, theta1=0, theta2=180),                   # restricted area
+               mpl.patches.Rectangle((-220, -47.5), 0, 140),                            # corner threes
+               mpl.patches.Rectangle((220, -47.5), 0, 140),
+               mpl.patches.Arc((0, 0), 475, 475, theta1=22, theta2=158),                # three point arc
+               mpl.patches.Rectangle((-250, -47.5), 500, 470, fill=False)]              # baseline/sidelines/half court
+    for patch in patches:
+        patch.set_edgecolor(color)
+        patch.set_linewidth(lw)
+        patch.set_facecolor('none')
+        ax.add_patch(patch)
+
+def draw_shot_chart(attempts, makes, title, width=chart_width, height=chart_height, scale=1, fmt='webp'):
+    '''
+    Draws a shot chart from binned attempts and makes (see get_shot_chart):
+    a square in every bin with shots, sized by the bin's attempts
+    and colored by its field goal percentage, all as one collection.
+    Returns the encoded image bytes (the caller holds game_cache.render_lock).
+    '''
+    load_matplotlib()
+    from plot_utils import mpl, plt
+
+    fig = plt.figure(figsize=(width/100, height/100), dpi=100, facecolor='w')
+    ax = fig.add_axes([0.02, 0.02, 0.96, 0.86])
+
+    i_y, i_x = np.nonzero(attempts)
+    bin_attempts = attempts[i_y, i_x]
+    fg_pct = makes[i_y, i_x]/np.maximum(bin_attempts, 1)
+
+    # the busiest bin fills its square
+    side = np.sqrt(bin_attempts/bin_attempts.max(initial=1))*bin_size*0.95
+    x = x_edges[i_x] + bin_size/2
+    y = y_edges[i_y] + bin_size/2
+    verts = np.stack([np.stack([x - side/2, y - side/2], axis=1), np.stack([x + side/2, y - side/2], axis=1),
+                      np.stack([x + side/2, y + side/2], axis=1), np.stack([x - side/2, y + side/2], axis=1)], axis=1)
+    norm = mpl.colors.Normalize(*chart_fg_pct_lims)
+    ax.add_collection(mpl.collections.PolyCollection(verts, facecolors=mpl.colormaps['RdYlBu_r'](norm(fg_pct)),
+                                                     edgecolors='none'))
+
+    draw_court(ax)
+    ax.set_xlim(x_edges[0] - 5, x_edges[-1] + 5)
+    ax.set_ylim(y_edges[0] - 5, y_edges[-1])
+    ax.set_aspect('equal')
+    ax.axis('off')
+
+    n_attempts, n_makes = attempts.sum(), makes.sum()
+    fig.suptitle('{}\n{} / {} FG ({:.1%})'.format(title, n_makes, n_attempts, n_makes/max(1, n_attempts)),
+                 size=14)
+    ax.text(0, y_edges[-1], 'bigger squares: more shots\nred: higher FG%, blue: lower',
+            ha='center', va='top', size=10, c='0.5')
+
+    img = encode_fig(fig, width, height, scale, fmt)
+    plt.close(fig)
+    return img
+
+
+if __name__ == '__main__':
+
+    import time
+
+    parser = argparse.ArgumentParser(description='Bin the shots of the saved pbpstats play by plays')
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--season-str', default=None)
+    args = parser.parse_args()
+
+    for season_str in ([args.season_str] if args.season_str else season_strs):
+        for season_type in season_type_suffixes:
+            if not has_shot_data(season_str, season_type):
+                continue
+            t_start = time.time()
+            n_games = update_shot_bins(season_str, season_type, rebuild=args.rebuild)
+            print('{} {}: {} games binned ({:.2f} s)'.format(season_str, season_type, n_games, time.time() - t_start))
+
+            bins = load_shot_bins(season_str, season_type)
+            team_id = bins['team_ids'][0]
+            t_start = time.time()
+            attempts, makes = get_shot_chart(season_str, season_type, team_id=team_id)
+            print('team {} season chart: {} shots ({:.2f} ms)'.format(team_id, attempts.sum(), 1000*(time.time() - t_start)))
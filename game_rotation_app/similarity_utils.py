@@ -0,0 +1,174 @@
+'''
+Utility functions for finding games that played out like a given game
+(similar margin flow, comebacks, wire-to-wire wins).
+
+Each game's away - home score margin is resampled onto a fixed grid of
+minutes in regulation, and a season's games are stacked into one matrix,
+saved at ingest time (see data/update_all_data.py) in data/margins/.
+Queries compare a game's row to every game of every season at once
+(vectorized distances), also matching games flipped between home and away,
+so i.e. a home team's comeback matches an away team's comeback.
+'''
+
+import os
+from functools import lru_cache
+import numpy as np
+
+from load_data_utils import get_season_suffix, season_strs, season_type_suffixes
+from on_off_utils import get_margin_timelines, game_time_offset
+
+
+# minutes in regulation the margins are resampled at
+margin_grid = np.arange(0, 48 + 1e-5, 0.5)
+
+margins_dir = 'data/margins/'
+
+
+def get_margin_matrix(season_str, season_type='Regular Season'):
+    '''
+    Given a season string (i.e. 2023-24),
+    resamples every saved game's away - home score margin onto margin_grid,
+    returning the game_ids and a (n games) x (n grid points) matrix
+    '''
+    game_ids, game_ends, event_times, margins = get_margin_timelines(season_str, season_type)
+
+    # the margin at each grid time is the margin after the last event at or before it,
+    # looked up for every game at once in the season-wide timeline
+    query_times = (np.arange(len(game_ids))[:, None]*game_time_offset + margin_grid[None, :]).ravel()
+    i_event = np.searchsorted(event_times, query_times, side='right') - 1
+
+    margin_matrix = -margins[i_event].reshape(len(game_ids), len(margin_grid))
+
+    return game_ids, margin_matrix.astype(np.float32)
+
+def get_margin_matrix_fpath(season_str, season_type='Regular Season', data_dir=margins_dir):
+    '''
+    Path of a season's saved margin matrix
+    '''
+    return os.path.join(data_dir, 'margins_{}{}.npz'.format(season_str, get_season_suffix(season_type)))
+
+def save_margin_matrix(season_str, season_type='Regular Season', data_dir=margins_dir):
+    '''
+    Computes a season's margin matrix (see get_margin_matrix)
+    and saves it to data_dir as margins_{season_str}{suffix}.npz
+    '''
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+        print('making data directory: {}'.format(os.path.abspath(data_dir)))
+
+    game_ids, margin_matrix = get_margin_matrix(season_str, season_type)
+
+    fsave = get_margin_matrix_fpath(season_str, season_type, data_dir)
+    print(f'saving to... {fsave}')
+    np.savez_compressed(fsave, game_ids=game_ids, margin_grid=margin_grid, margin_matrix=margin_matrix)
+
+def load_margin_matrix(season_str, season_type='Regular Season', data_dir=margins_dir, build_missing=True):
+    '''
+    Loads a season's saved margin matrix,
+    computing it instead if it hasn't been saved (or was saved on another grid)
+    and build_missing, or returning None, None if not
+    '''
+    fpath = get_margin_matrix_fpath(season_str, season_type, data_dir)
+
+    if os.path.exists(fpath):
+        with np.load(fpath) as saved:
+            if np.array_equal(saved['margin_grid'], margin_grid):
+                return saved['game_ids'], saved['margin_matrix']
+
+    if not build_missing:
+        return None, None
+    return get_margin_matrix(season_str, season_type)
+
+def get_margin_file_versions(data_dir=margins_dir):
+    '''
+    The seasons and season types in the app with play by plays,
+    each with the version (size, modification time) of its saved margin matrix
+    (None if it hasn't been saved)
+    '''
+    file_versions = []
+    for season_str in season_strs:
+        for season_type in season_type_suffixes:
+            if os.path.isdir('data/pbps/{}{}'.format(season_str, get_season_suffix(season_type))):
+                fpath = get_margin_matrix_fpath(season_str, season_type, data_dir)
+                file_version = None
+                if os.path.exists(fpath):
+                    fstat = os.stat(fpath)
+                    file_version = (fstat.st_size, fstat.st_mtime_ns)
+                file_versions.append((season_str, season_type, file_version))
+    return tuple(file_versions)
+
+@lru_cache(maxsize=2)
+def _load_all_margin_matrices(file_versions, build_missing):
+
+    all_game_ids = [np.array([], dtype=str)]
+    all_season_strs = [np.array([], dtype=str)]
+    all_season_types = [np.array([], dtype=str)]
+    all_matrices = [np.zeros((0, len(margin_grid)), dtype=np.float32)]
+    for season_str, season_type, _ in file_versions:
+        game_ids, margin_matrix = load_margin_matrix(season_str, season_type, build_missing=build_missing)
+        if game_ids is not None:
+            all_game_ids.append(game_ids)
+            all_season_strs.append(np.full(len(game_ids), season_str))
+            all_season_types.append(np.full(len(game_ids), season_type))
+            all_matrices.append(margin_matrix)
+
+    return (np.concatenate(all_game_ids), np.concatenate(all_season_strs),
+            np.concatenate(all_season_types), np.concatenate(all_matrices))
+
+def load_all_margin_matrices(build_missing=True):
+    '''
+    Loads the margin matrices of all seasons and season types in the app,
+    stacked into one matrix, returning the game_ids, the season string
+    and season type of each game, and the matrix.
+    Reloaded when the saved matrices change (i.e. the nightly update's new games).
+    Seasons without a saved matrix are computed if build_missing, or left out if not:
+    the app only reads saved matrices, as computing them takes seconds.
+    '''
+    return _load_all_margin_matrices(get_margin_file_versions(), build_missing)
+
+def find_similar_games(game_id, k=10, match_flipped=True, build_missing=True):
+    '''
+    Given an nba.com/stats game_id (i.e. '0022300408'),
+    finds the k games (over all seasons) whose away - home margin
+    through regulation was closest to it (root mean square difference, in points),
+    optionally also matching games with home and away flipped.
+    Returns a list of (game_id, season_str, season_type, distance, flipped) tuples,
+    closest first (empty if the game isn't found).
+    Only saved margin matrices are searched unless build_missing (see load_all_margin_matrices).
+    '''
+    game_ids, game_season_strs, game_season_types, margin_matrix = load_all_margin_matrices(build_missing)
+
+    i_query = np.flatnonzero(game_ids == game_id)
+    if len(i_query) == 0:
+        return []
+    query = margin_matrix[i_query[0]]
+
+    dists = np.sqrt(np.mean((margin_matrix - query)**2, axis=1))
+    flipped = np.zeros(len(dists), dtype=bool)
+    if match_flipped:
+        dists_flipped = np.sqrt(np.mean((margin_matrix + query)**2, axis=1))
+        flipped = dists_flipped < dists
+        dists = np.where(flipped, dists_flipped, dists)
+
+    # don't match the game itself
+    dists[i_query] = np.inf
+
+    k = min(k, len(dists) - len(i_query))
+    i_top = np.argpartition(dists, k)[:k] if k < len(dists) else np.arange(len(dists))
+    i_top = i_top[np.argsort(dists[i_top])]
+
+    return [(game_ids[i], game_season_strs[i], game_season_types[i], dists[i], flipped[i]) for i in i_top]
+
+
+if __name__ == '__main__':
+
+    import time
+
+    game_id = '0022300063'
+    load_all_margin_matrices()
+
+    t_start = time.time()
+    similar_games = find_similar_games(game_id)
+    print('games similar to {} ({:.1f} ms):'.format(game_id, 1000*(time.time() - t_start)))
+    for similar_game in similar_games:
+        print(similar_game)
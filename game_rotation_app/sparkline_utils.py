@@ -0,0 +1,286 @@
+'''
+Utility functions for the game gallery: a tiny away - home margin sparkline
+for every game in the game picker's current filter.
+
+Rather than drawing a figure per game, each season's sparklines are
+rasterized all at once with numpy from the season's resampled margin matrix
+(see similarity_utils.py), as one sprite sheet image, at ingest time
+(see data/update_all_data.py), and saved in data/margins/ along with
+where each game's tile is. The gallery's tiles all show pieces of the same
+sheet (as CSS background positions), so browsing any number of a season's
+games costs one image fetch, which browsers then cache, as the sheet's url
+carries its version:
+
+    /sparklines/{season_str}/{season_type}.webp?v={version}
+
+where season_type is one of regular-season, playin, playoffs.
+'''
+
+import os
+import json
+import hashlib
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from starlette.routing import Route
+from starlette.responses import Response
+from shiny import ui
+
+from load_data_utils import get_season_suffix, get_lgls
+from similarity_utils import load_margin_matrix, margins_dir
+from rotation_endpoint import season_type_slugs
+from img_utils import encode_rgba
+
+
+# size of each game's tile (in CSS pixels), drawn at scale device pixels per CSS pixel
+tile_width = 96
+tile_height = 28
+tile_scale = 2
+
+# tiles per row of the sprite sheet
+sheet_ncols = 16
+
+# margin (in points) reaching the top/bottom of a tile
+tile_max_margin = 25
+
+background_rgb = (255, 255, 255)
+zero_line_rgb = (200, 200, 200)
+missing_team_rgb = (128, 128, 128)
+
+# lossless webp is about half the size of png for these sheets
+sheet_format = 'webp'
+
+sheet_cache_control = 'public, max-age=604800'
+
+
+def hex_to_rgb(hex_colors):
+    '''
+    Converts a list of hex colors (i.e. #C8102E) to an (n colors) x 3 array,
+    with missing colors gray
+    '''
+    return np.array([[int(c[i:i+2], 16) for i in [1, 3, 5]] if isinstance(c, str) and len(c) == 7
+                     else missing_team_rgb for c in hex_colors], dtype=np.uint8).reshape(-1, 3)
+
+def get_game_colors(game_ids, df_lgl_T, df_team_info):
+    '''
+    Given game_ids, the team league game logs of their season
+    and the team info, returns the away and home team colors (COLOR1)
+    of each game, as (n games) x 3 arrays
+    '''
+    team_colors = df_team_info.set_index('TEAM_ID')['COLOR1']
+    is_away = df_lgl_T['MATCHUP'].str.contains('@')
+    away_ids = df_lgl_T[is_away].drop_duplicates('GAME_ID').set_index('GAME_ID')['TEAM_ID']
+    home_ids = df_lgl_T[~is_away].drop_duplicates('GAME_ID').set_index('GAME_ID')['TEAM_ID']
+
+    return (hex_to_rgb(team_colors.reindex(away_ids.reindex(game_ids)).values),
+            hex_to_rgb(team_colors.reindex(home_ids.reindex(game_ids)).values))
+
+def draw_sparklines(margin_matrix, away_rgb, home_rgb):
+    '''
+    Rasterizes every game's away - home margin (one row of margin_matrix each)
+    as a filled sparkline, shaded in the away team's color when they lead
+    and the home team's color when they trail, all games at once.
+    Returns an (n games) x height x width x 3 array of pixels.
+    '''
+    n_games, n_grid = margin_matrix.shape
+    width, height = tile_width*tile_scale, tile_height*tile_scale
+
+    # each pixel column's margin, interpolated between grid points
+    x = (np.arange(width) + 0.5)/width*(n_grid - 1)
+    i_left = np.minimum(x.astype(int), n_grid - 2)
+    frac = x - i_left
+    margins = margin_matrix[:, i_left]*(1 - frac) + margin_matrix[:, i_left + 1]*frac
+
+    # each pixel row's height above the zero line, and the margin's height in each column
+    y = height/2 - (np.arange(height) + 0.5)
+    margin_y = np.clip(margins/tile_max_margin, -1, 1)*height/2
+
+    above = (y[None, :, None] > 0) & (y[None, :, None] < margin_y[:, None, :])
+    below = (y[None, :, None] < 0) & (y[None, :, None] > margin_y[:, None, :])
+    on_zero = (np.abs(y) < 0.5*tile_scale)[None, :, None]
+
+    pixels = np.empty((n_games, height, width, 3), dtype=np.uint8)
+    pixels[:] = background_rgb
+    pixels[np.broadcast_to(on_zero, above.shape)] = zero_line_rgb
+    pixels[above] = np.broadcast_to(away_rgb[:, None, None, :], pixels.shape)[above]
+    pixels[below] = np.broadcast_to(home_rgb[:, None, None, :], pixels.shape)[below]
+
+    return pixels
+
+def make_sprite_sheet(tiles, ncols=sheet_ncols):
+    '''
+    Lays out an (n tiles) x height x width x 3 array of tiles
+    in rows of ncols, returning the sheet's RGBA pixels
+    '''
+    n_tiles, height, width, _ = tiles.shape
+    nrows = max(1, -(-n_tiles // ncols))
+
+    padded = np.empty((nrows*ncols, height, width, 3), dtype=np.uint8)
+    padded[:] = background_rgb
+    padded[:n_tiles] = tiles
+
+    sheet = (padded.reshape(nrows, ncols, height, width, 3)
+             .transpose(0, 2, 1, 3, 4)
+             .reshape(nrows*height, ncols*width, 3))
+    alpha = np.full(sheet.shape[:2] + (1,), 255, dtype=np.uint8)
+    return np.concatenate((sheet, alpha), axis=2)
+
+def get_sheet_fpaths(season_str, season_type='Regular Season', data_dir=margins_dir):
+    '''
+    Paths of a season's saved sprite sheet image and its index
+    '''
+    fname = 'sparklines_{}{}'.format(season_str, get_season_suffix(season_type))
+    return os.path.join(data_dir, f'{fname}.{sheet_format}'), os.path.join(data_dir, f'{fname}.json')
+
+def build_sprite_sheet(season_str, season_type, df_lgl_T, df_team_info):
+    '''
+    Draws a season's sparklines (see draw_sparklines) as one sprite sheet,
+    returning the sheet's image bytes and its index
+    (the game_ids in tile order, and the tile layout)
+    '''
+    game_ids, margin_matrix = load_margin_matrix(season_str, season_type)
+    away_rgb, home_rgb = get_game_colors(game_ids, df_lgl_T, df_team_info)
+
+    sheet = make_sprite_sheet(draw_sparklines(margin_matrix, away_rgb, home_rgb))
+    sheet_bytes = encode_rgba(sheet, sheet_format)
+
+    index = {'game_ids': [str(g) for g in game_ids],
+             'ncols': sheet_ncols,
+             'tile_width': tile_width,
+             'tile_height': tile_height,
+             'version': hashlib.sha1(sheet_bytes).hexdigest()[:12]}
+
+    return sheet_bytes, index
+
+def save_sprite_sheet(season_str, season_type, df_lgl_T, df_team_info, data_dir=margins_dir):
+    '''
+    Builds a season's sprite sheet (see build_sprite_sheet),
+    saving it and its index to data_dir
+    '''
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+        print('making data directory: {}'.format(os.path.abspath(data_dir)))
+
+    sheet_bytes, index = build_sprite_sheet(season_str, season_type, df_lgl_T, df_team_info)
+
+    fpath_sheet, fpath_index = get_sheet_fpaths(season_str, season_type, data_dir)
+    print(f'saving to... {fpath_sheet}')
+    with open(fpath_sheet, 'wb') as f:
+        f.write(sheet_bytes)
+    # the index is written last, as the app reads the sheet it points to
+    with open(fpath_index, 'w') as f:
+        json.dump(index, f)
+
+@lru_cache(maxsize=16)
+def _load_sprite_sheet(season_str, season_type, file_version):
+
+    fpath_sheet, fpath_index = get_sheet_fpaths(season_str, season_type)
+    if file_version is None:
+        df_lgl_T_all, _ = get_lgls([season_str])
+        sheet_bytes, index = build_sprite_sheet(season_str, season_type,
+                                                df_lgl_T_all[df_lgl_T_all['season_type'] == season_type],
+                                                pd.read_csv('data/df_team_info.csv'))
+    else:
+        with open(fpath_index) as f:
+            index = json.load(f)
+        with open(fpath_sheet, 'rb') as f:
+            sheet_bytes = f.read()
+
+    index['i_tiles'] = {game_id: i for i, game_id in enumerate(index['game_ids'])}
+    return sheet_bytes, index
+
+def load_sprite_sheet(season_str, season_type='Regular Season', build_missing=True):
+    '''
+    Loads a season's saved sprite sheet image bytes and index
+    (with i_tiles, each game_id's tile number added),
+    building it instead if it hasn't been saved (and build_missing),
+    or returning None, None if it can't be (the season has no play by plays).
+    The app only reads saved sheets: building one takes seconds.
+    '''
+    _, fpath_index = get_sheet_fpaths(season_str, season_type)
+    if os.path.exists(fpath_index):
+        fstat = os.stat(fpath_index)
+        return _load_sprite_sheet(season_str, season_type, (fstat.st_size, fstat.st_mtime_ns))
+
+    if not build_missing or not os.path.isdir('data/pbps/{}{}'.format(season_str, get_season_suffix(season_type))):
+        return None, None
+    return _load_sprite_sheet(season_str, season_type, None)
+
+def make_gallery_tiles(season_str, season_type, game_ids, game_strs, input_id='gallery_game_id'):
+    '''
+    Makes the gallery's tiles for the given games (in order) and their labels,
+    each showing its piece of the season's sprite sheet,
+    and setting the input input_id to its game_id when clicked.
+    Games without a sparkline get an empty tile.
+    Only saved sheets are shown (see data/update_all_data.py).
+    '''
+    _, index = load_sprite_sheet(season_str, season_type, build_missing=False)
+    if index is None:
+        return ui.markdown('No game gallery available for this season yet.')
+
+    slug = {v: k for k, v in season_type_slugs.items()}[season_type]
+    sheet_url = f'/sparklines/{season_str}/{slug}.{sheet_format}?v={index["version"]}'
+    ncols, width, height = index['ncols'], index['tile_width'], index['tile_height']
+    nrows = -(-len(index['game_ids']) // ncols)
+
+    # the styles shared by all tiles are set once, so each tile only carries its position
+    style = ui.tags.style(
+        f'.spark-gallery {{display: flex; flex-wrap: wrap; gap: 4px; max-height: 400px; overflow-y: auto;}}'
+        f'.spark-tile {{cursor: pointer; padding: 2px; width: {width + 6}px; font-size: 9px; line-height: 1.2;}}'
+        f'.spark {{width: {width}px; height: {height}px; border: 1px solid #eee; '
+        f'background: url({sheet_url}) no-repeat; background-size: {ncols*width}px {nrows*height}px;}}'
+        f'.spark.missing {{background: none;}}')
+
+    tiles = []
+    for game_id, game_str in zip(game_ids, game_strs):
+        i_tile = index['i_tiles'].get(game_id)
+        if i_tile is None:
+            spark = ui.div(class_='spark missing')
+        else:
+            spark = ui.div(class_='spark',
+                           style=f'background-position: -{(i_tile % ncols)*width}px -{(i_tile // ncols)*height}px')
+        tiles.append(ui.div(spark, game_str, class_='spark-tile', title=game_str, data_game_id=game_id))
+
+    # one click handler for the whole gallery
+    onclick = ("var tile = event.target.closest('.spark-tile'); "
+               f"if (tile) Shiny.setInputValue('{input_id}', tile.dataset.gameId, {{priority: 'event'}});")
+
+    return ui.TagList(style, ui.div(*tiles, class_='spark-gallery', onclick=onclick))
+
+def make_sparkline_route():
+    '''
+    Makes the starlette route serving the saved sprite sheets
+    (versioned urls, so they're cached for a long time)
+    '''
+
+    # a plain function, which starlette runs in a thread, as it reads files
+    def sparkline_sheet(request):
+
+        season_type = season_type_slugs.get(request.path_params['season_type'])
+        sheet_bytes = None
+        if season_type is not None:
+            sheet_bytes, _ = load_sprite_sheet(request.path_params['season_str'], season_type,
+                                               build_missing=False)
+
+        if sheet_bytes is None:
+            return Response('sprite sheet not found', status_code=404)
+
+        return Response(sheet_bytes, media_type=f'image/{sheet_format}',
+                        headers={'Cache-Control': sheet_cache_control})
+
+    return Route('/sparklines/{season_str}/{season_type}.' + sheet_format, sparkline_sheet)
+
+
+if __name__ == '__main__':
+
+    import time
+
+    season_str = '2023-24'
+    df_team_info = pd.read_csv('data/df_team_info.csv')
+    df_lgl_T_all, _ = get_lgls([season_str])
+
+    for season_type in ['Regular Season', 'Playoffs']:
+        t_start = time.time()
+        save_sprite_sheet(season_str, season_type,
+                          df_lgl_T_all[df_lgl_T_all['season_type'] == season_type], df_team_info)
+        print('{} ({:.2f} s)'.format(season_type, time.time() - t_start))
@@ -0,0 +1,286 @@
+'''
+Utility functions for reconstructing player stints from a game's play by play
+(PlayByPlayV2 substitution and scoring events), in the same format as the
+GameRotation endpoint's dataframes (df_gr), for games where GameRotation
+gave NaN point differentials (the flagged games of pull_and_save_df_grs),
+and as a cross-check of the GameRotation data.
+
+The play by play doesn't list who starts each period, so a player is taken
+to be on the floor at the start of a period if their first event of the period
+(a play, or being subbed out) isn't being subbed in. Stints are then the
+spans between a player coming on (start of a period, or subbed in) and going off
+(subbed out, or end of a period), joined across period breaks.
+
+Like GameRotation (and on_off_utils), point differentials count scoring plays
+happening at the same game clock time as a substitution (i.e. free throws)
+for the players on the floor before the substitution. Player points are
+counted in event order, so they go to whoever scored them.
+'''
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from load_data_utils import get_pbp, get_pbps, get_grs, get_season_suffix
+from plot_utils import convert_to_times
+
+
+# columns of the GameRotation dataframes, in order
+gr_columns = ['GAME_ID', 'TEAM_ID', 'TEAM_CITY', 'TEAM_NAME', 'PERSON_ID',
+              'PLAYER_FIRST', 'PLAYER_LAST', 'IN_TIME_REAL', 'OUT_TIME_REAL',
+              'PLAYER_PTS', 'PT_DIFF', 'USG_PCT', 'h_a']
+
+# events that don't show who's on the floor
+# (timeouts, ejections, period start/end, replays)
+off_floor_event_types = [9, 11, 12, 13, 18]
+
+# fouls (EVENTMSGTYPE 6) that can be called on players on the bench (technicals)
+bench_foul_action_types = [11, 12, 13, 16, 18, 19, 25, 30]
+
+# PERSONxTYPE of home and away players
+home_person_type, away_person_type = 4, 5
+
+# games in a season's game rotation directory whose stints were
+# reconstructed from the play by play (read by pull_and_save_df_grs,
+# which pulls them again until GameRotation has them)
+pbp_stints_fname = 'pbp_stint_games.json'
+
+
+def get_player_events(df_pbp):
+    '''
+    Given a play by play dataframe, returns the (row, player, team, person type)
+    of every player taking part in an event that shows they're on the floor
+    (substitutions excluded)
+    '''
+    event_types = df_pbp['EVENTMSGTYPE'].values
+    on_floor = ~np.isin(event_types, off_floor_event_types + [8]) & \
+               ~((event_types == 6) & np.isin(df_pbp['EVENTMSGACTIONTYPE'].values, bench_foul_action_types))
+
+    rows, players, teams, person_types = [], [], [], []
+    for k in [1, 2, 3]:
+        person_type = df_pbp[f'PERSON{k}TYPE'].fillna(0).values
+        is_player = on_floor & np.isin(person_type, [home_person_type, away_person_type])
+        rows.append(np.flatnonzero(is_player))
+        players.append(df_pbp[f'PLAYER{k}_ID'].values[is_player].astype(np.int64))
+        teams.append(df_pbp[f'PLAYER{k}_TEAM_ID'].values[is_player].astype(np.int64))
+        person_types.append(person_type[is_player])
+
+    return (np.concatenate(rows), np.concatenate(players),
+            np.concatenate(teams), np.concatenate(person_types))
+
+def get_pbp_stints(df_pbp):
+    '''
+    Given a game's play by play dataframe (see load_data_utils.get_pbp),
+    reconstructs its player stints (see the top of this file),
+    returning a dataframe like the game's GameRotation dataframe (see load_data_utils.get_gr),
+    with in/out times, point differential and player points of every stint
+    (USG_PCT isn't available from the play by play, and is NaN)
+    '''
+    df_pbp = df_pbp.reset_index(drop=True)
+    n_rows = len(df_pbp)
+    if n_rows == 0:
+        return pd.DataFrame(columns=gr_columns)
+
+    periods = df_pbp['PERIOD'].values
+    clock = df_pbp['PCTIMESTRING'].str.split(':', expand=True).astype(int)
+    times = convert_to_times(periods, clock[0].values, clock[1].values)
+
+    # home - away margin after each event, and points scored at each event
+    margins = df_pbp['SCOREMARGIN'].ffill().fillna(0).values
+    event_pts = np.abs(np.diff(margins, prepend=0))
+
+    # and after all events at the same game clock time
+    margins_at_time = margins[np.searchsorted(times, times, side='right') - 1]
+
+    # first and last rows of each period
+    period_first = np.flatnonzero(np.diff(periods, prepend=-1) != 0)
+    period_last = np.append(period_first[1:] - 1, n_rows - 1)
+
+    # players coming on (1) and going off (0) the floor through substitutions,
+    # and taking part in plays (-1)
+    is_sub = df_pbp['EVENTMSGTYPE'].values == 8
+    sub_rows = np.flatnonzero(is_sub)
+    play_rows, play_players, play_teams, play_person_types = get_player_events(df_pbp)
+
+    rows = np.concatenate((sub_rows, sub_rows, play_rows))
+    players = np.concatenate((df_pbp['PLAYER2_ID'].values[is_sub].astype(np.int64),
+                              df_pbp['PLAYER1_ID'].values[is_sub].astype(np.int64),
+                              play_players))
+    teams = np.concatenate((df_pbp['PLAYER2_TEAM_ID'].values[is_sub].astype(np.int64),
+                            df_pbp['PLAYER1_TEAM_ID'].values[is_sub].astype(np.int64),
+                            play_teams))
+    kinds = np.concatenate((np.ones(len(sub_rows), dtype=int),
+                            np.zeros(len(sub_rows), dtype=int),
+                            -np.ones(len(play_rows), dtype=int)))
+
+    i_sort = np.lexsort((rows, players))
+    rows, players, teams, kinds = rows[i_sort], players[i_sort], teams[i_sort], kinds[i_sort]
+    row_periods = periods[rows]
+
+    # each player's events in each period
+    new_group = np.concatenate(([True], (players[1:] != players[:-1]) | (row_periods[1:] != row_periods[:-1])))
+    i_first = np.flatnonzero(new_group)
+    i_group = np.cumsum(new_group) - 1
+
+    # on at the start of the period if not first subbed in,
+    # on at the end if last subbed in (or never subbed, but on at the start)
+    is_toggle = kinds >= 0
+    i_last_toggle = np.full(len(i_first), -1)
+    np.maximum.at(i_last_toggle, i_group[is_toggle], np.flatnonzero(is_toggle))
+    on_at_start = kinds[i_first] != 1
+    on_at_end = np.where(i_last_toggle >= 0, kinds[np.maximum(i_last_toggle, 0)] == 1, on_at_start)
+
+    i_period = np.searchsorted(periods[period_first], row_periods[i_first])
+    group_first_rows, group_last_rows = period_first[i_period], period_last[i_period]
+
+    # every player's on (1) / off (0) toggles, in order
+    t_rows = np.concatenate((group_first_rows[on_at_start], rows[is_toggle], group_last_rows[on_at_end]))
+    t_players = np.concatenate((players[i_first][on_at_start], players[is_toggle], players[i_first][on_at_end]))
+    t_teams = np.concatenate((teams[i_first][on_at_start], teams[is_toggle], teams[i_first][on_at_end]))
+    t_kinds = np.concatenate((np.ones(on_at_start.sum(), dtype=int), kinds[is_toggle],
+                              np.zeros(on_at_end.sum(), dtype=int)))
+    i_sort = np.lexsort((1 - t_kinds, t_rows, t_players))
+    t_rows, t_players, t_teams, t_kinds = t_rows[i_sort], t_players[i_sort], t_teams[i_sort], t_kinds[i_sort]
+
+    # stints are a player coming on followed by going off
+    # (skipping any toggles that don't pair up)
+    is_stint = (t_kinds[:-1] == 1) & (t_kinds[1:] == 0) & (t_players[:-1] == t_players[1:])
+    in_rows, out_rows = t_rows[:-1][is_stint], t_rows[1:][is_stint]
+    stint_players, stint_teams = t_players[:-1][is_stint], t_teams[:-1][is_stint]
+
+    # join stints continuing across a period break
+    in_times, out_times = times[in_rows], times[out_rows]
+    new_stint = np.concatenate(([True], (stint_players[1:] != stint_players[:-1]) | \
+                                        (in_times[1:] != out_times[:-1])))
+    i_stint_first = np.flatnonzero(new_stint)
+    i_stint_last = np.append(i_stint_first[1:] - 1, len(new_stint) - 1)
+    in_rows, out_rows = in_rows[i_stint_first], out_rows[i_stint_last]
+    stint_players, stint_teams = stint_players[i_stint_first], stint_teams[i_stint_first]
+
+    # home and away teams, from the players' person types
+    home_team_id = play_teams[play_person_types == home_person_type][0]
+    is_home = stint_teams == home_team_id
+
+    # points scored by each player between their in and out rows
+    # (running totals of each player's points, keyed by player then row)
+    scorers = df_pbp['PLAYER1_ID'].fillna(0).values.astype(np.int64)
+    is_score = event_pts > 0
+    score_keys = scorers[is_score]*n_rows + np.flatnonzero(is_score)
+    i_sort = np.argsort(score_keys)
+    score_keys = score_keys[i_sort]
+    cum_pts = np.concatenate(([0], np.cumsum(event_pts[is_score][i_sort])))
+    pts_in = cum_pts[np.searchsorted(score_keys, stint_players*n_rows + in_rows, side='right')]
+    pts_out = cum_pts[np.searchsorted(score_keys, stint_players*n_rows + out_rows, side='right')]
+
+    # player and team names
+    df_names = pd.concat([df_pbp[[f'PLAYER{k}_ID', f'PLAYER{k}_NAME', f'PLAYER{k}_TEAM_CITY', f'PLAYER{k}_TEAM_NICKNAME']]
+                          .set_axis(['PERSON_ID', 'PLAYER_NAME', 'TEAM_CITY', 'TEAM_NAME'], axis=1)
+                          for k in [1, 2, 3]]).dropna().drop_duplicates('PERSON_ID')
+    df_names = df_names.set_index(df_names['PERSON_ID'].astype(np.int64)).reindex(stint_players)
+    first_last = df_names['PLAYER_NAME'].str.split(' ', n=1, expand=True).reindex(columns=[0, 1])
+
+    df_gr = pd.DataFrame({'GAME_ID': df_pbp['GAME_ID'].iloc[0],
+                          'TEAM_ID': stint_teams,
+                          'TEAM_CITY': df_names['TEAM_CITY'].values,
+                          'TEAM_NAME': df_names['TEAM_NAME'].values,
+                          'PERSON_ID': stint_players,
+                          'PLAYER_FIRST': first_last[0].values,
+                          'PLAYER_LAST': first_last[1].fillna('').values,
+                          'IN_TIME_REAL': np.round(times[in_rows]*600),
+                          'OUT_TIME_REAL': np.round(times[out_rows]*600),
+                          'PLAYER_PTS': (pts_out - pts_in).astype(int),
+                          'PT_DIFF': np.where(is_home, 1, -1)*(margins_at_time[out_rows] - margins_at_time[in_rows]) + 0.0,
+                          'USG_PCT': np.nan,
+                          'h_a': np.where(is_home, 'home', 'away')})
+    df_gr['GAME_ID'] = df_gr['GAME_ID'].astype('string')
+
+    # away team first, like GameRotation
+    return (df_gr
+            .sort_values(['h_a', 'PERSON_ID', 'IN_TIME_REAL'], kind='stable')
+            .reset_index(drop=True))
+
+def compare_stints(df_gr, df_gr_pbp):
+    '''
+    Cross-checks a game's GameRotation stints (df_gr) against the stints
+    reconstructed from its play by play (df_gr_pbp, see get_pbp_stints),
+    returning each player's number of stints, minutes, point differential
+    and points from both (_gr and _pbp columns), and their differences
+    (players missing from one side count as zeros)
+    '''
+    stats = []
+    for df in [df_gr, df_gr_pbp]:
+        stats.append(df.assign(minutes=(df['OUT_TIME_REAL'] - df['IN_TIME_REAL'])/600)
+                     .groupby(['GAME_ID', 'TEAM_ID', 'PERSON_ID'])
+                     .agg(stints=('minutes', 'size'), minutes=('minutes', 'sum'),
+                          pt_diff=('PT_DIFF', 'sum'), pts=('PLAYER_PTS', 'sum')))
+
+    df_compare = stats[0].join(stats[1], how='outer', lsuffix='_gr', rsuffix='_pbp').fillna(0)
+    for col in ['stints', 'minutes', 'pt_diff', 'pts']:
+        df_compare[f'{col}_diff'] = df_compare[f'{col}_pbp'] - df_compare[f'{col}_gr']
+
+    return df_compare.reset_index()
+
+def get_season_stint_check(season_str, season_type='Regular Season', game_ids=None):
+    '''
+    Cross-checks (see compare_stints) every saved game of a season
+    that has both a game rotation and a play by play (or the given game_ids),
+    returning one row per player per game
+    '''
+    df_grs = get_grs(season_str, game_ids, season_type=season_type)
+    df_pbps = get_pbps(season_str, sorted(df_grs['GAME_ID'].unique()), season_type=season_type)
+
+    df_gr_pbp = pd.concat([get_pbp_stints(df_pbp) for _, df_pbp in df_pbps.groupby('GAME_ID', sort=False)],
+                          ignore_index=True)
+
+    return compare_stints(df_grs[df_grs['GAME_ID'].isin(df_gr_pbp['GAME_ID'])], df_gr_pbp)
+
+def save_pbp_stints(season_str, season_type='Regular Season', game_ids=[],
+                    data_dir='data/'):
+    '''
+    Reconstructs the stints of games without a usable GameRotation
+    (i.e. the flagged games returned by pull_and_save_df_grs) from their saved
+    play by plays, and saves them as the games' game rotation files,
+    noting them in the season's pbp_stints_fname, so that they're pulled again
+    from GameRotation in later updates. Returns the game_ids saved.
+    '''
+    suffix = get_season_suffix(season_type)
+    season_dir = os.path.join(data_dir, f'game_rotations/{season_str}{suffix}')
+    fpath_games = os.path.join(season_dir, pbp_stints_fname)
+
+    pbp_stint_games = []
+    if os.path.exists(fpath_games):
+        with open(fpath_games) as f:
+            pbp_stint_games = json.load(f)
+
+    saved_ids = []
+    for game_id in game_ids:
+
+        df_pbp = get_pbp(season_str, game_id, season_type)
+        if len(df_pbp) == 0:
+            print(f'no play by play for {game_id}, not reconstructing its stints')
+            continue
+
+        df_gr = get_pbp_stints(df_pbp)
+        cur_fname = f'df_gr_{game_id}.csv'
+        print(f'saving stints from the play by play to {cur_fname}...')
+        df_gr.to_csv(os.path.join(season_dir, cur_fname))
+        saved_ids.append(game_id)
+
+    with open(fpath_games, 'w') as f:
+        json.dump(sorted(set(pbp_stint_games) | set(saved_ids)), f)
+
+    return saved_ids
+
+
+if __name__ == '__main__':
+
+    import time
+
+    for season_type in ['Regular Season', 'Playoffs']:
+        t_start = time.time()
+        df_check = get_season_stint_check('2023-24', season_type)
+        print('{} ({:.2f} s): {} player games'.format(season_type, time.time() - t_start, len(df_check)))
+        for col in ['stints', 'minutes', 'pt_diff', 'pts']:
+            print('  {}: {:.1%} match, mean abs diff {:.2f}'.format(
+                col, np.mean(np.abs(df_check[f'{col}_diff']) < 0.05), np.mean(np.abs(df_check[f'{col}_diff']))))
@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# the app's modules import each other, and read data/, relative to the app's directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+
+
+@pytest.fixture(autouse=True)
+def in_app_dir(monkeypatch):
+    monkeypatch.chdir(app_dir)
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from load_data_utils import get_gr, get_grs, get_pbp, get_pbps
+
+# the first games of a season's playoffs, plus one that isn't saved
+season_str, season_type = '2023-24', 'Playoffs'
+game_ids = ['0042300101', '0042300102', '0042300103']
+
+
+def test_batches_match_single_games():
+
+    df_gr = get_grs(season_str, game_ids + ['0042300199'], season_type=season_type)
+    df_gr_single = pd.concat([get_gr(season_str, game_id, season_type=season_type) for game_id in game_ids])
+    assert df_gr.reset_index(drop=True).equals(df_gr_single.reset_index(drop=True))
+
+    df_pbp = get_pbps(season_str, game_ids, season_type=season_type)
+    df_pbp_single = pd.concat([get_pbp(season_str, game_id, season_type=season_type) for game_id in game_ids])
+    assert df_pbp.reset_index(drop=True).equals(df_pbp_single.reset_index(drop=True))
+
+def test_chunks_and_columns():
+
+    df_gr = get_grs(season_str, game_ids, season_type=season_type)
+
+    # chunks of whole games, adding up to the same rows
+    chunks = list(get_grs(season_str, game_ids, season_type=season_type, chunksize=2))
+    assert [list(chunk['GAME_ID'].unique()) for chunk in chunks] == [game_ids[:2], game_ids[2:]]
+    assert pd.concat(chunks).reset_index(drop=True).equals(df_gr.reset_index(drop=True))
+
+    # only the columns asked for (and GAME_ID), with names joined in from the ids
+    df_names = get_grs(season_str, game_ids, season_type=season_type, columns=['PLAYER_LAST'])
+    assert list(df_names.columns) == ['GAME_ID', 'PLAYER_LAST']
+    assert df_names['PLAYER_LAST'].tolist() == df_gr['PLAYER_LAST'].tolist()
+
+    df_pbp = get_pbps(season_str, game_ids, season_type=season_type, columns=['PERIOD', 'SCOREMARGIN'])
+    assert list(df_pbp.columns) == ['GAME_ID', 'PERIOD', 'SCOREMARGIN']
+    assert df_pbp['SCOREMARGIN'].dtype == float
@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import pandas as pd
+
+from dim_utils import has_names, normalize_season_data
+from load_data_utils import get_gr, get_pbp
+
+season_str, season_type = '2023-24', 'Playoffs'
+app_data_dir = os.path.abspath('data')
+game_ids = ['0042300101', '0042300102']
+
+
+def copy_games(tmp_path):
+    '''
+    Copies a few saved games (with their names) into tmp_path/data, returning their paths
+    '''
+    fpaths = {}
+    for data_subdir, fprefix in [('pbps', 'df_pbp_'), ('game_rotations', 'df_gr_')]:
+        os.makedirs(tmp_path/'data'/data_subdir/'2023-24_po')
+        for game_id in game_ids:
+            fname = os.path.join(data_subdir, '2023-24_po', f'{fprefix}{game_id}.csv')
+            shutil.copy(os.path.join(app_data_dir, fname), tmp_path/'data'/fname)
+            fpaths[(data_subdir, game_id)] = str(tmp_path/'data'/fname)
+    return fpaths
+
+
+def test_normalize_then_join_back(tmp_path, monkeypatch):
+
+    fpaths = copy_games(tmp_path)
+    monkeypatch.chdir(tmp_path)
+
+    dfs_pbp = [get_pbp(season_str, game_id, season_type) for game_id in game_ids]
+    dfs_gr = [get_gr(season_str, game_id, season_type) for game_id in game_ids]
+
+    assert normalize_season_data(season_str, season_type) == 4
+    assert not any(has_names(fpath, 'pbp' if data_subdir == 'pbps' else 'gr')
+                   for (data_subdir, _), fpath in fpaths.items())
+    assert os.path.getsize(fpaths[('pbps', game_ids[0])]) < os.path.getsize(
+        os.path.join(app_data_dir, 'pbps', '2023-24_po', f'df_pbp_{game_ids[0]}.csv'))
+
+    # the loaders join back exactly the names that were saved
+    for game_id, df_pbp, df_gr in zip(game_ids, dfs_pbp, dfs_gr):
+        pd.testing.assert_frame_equal(get_pbp(season_str, game_id, season_type), df_pbp)
+        pd.testing.assert_frame_equal(get_gr(season_str, game_id, season_type), df_gr)
+
+    # and nothing is left to normalize
+    assert normalize_season_data(season_str, season_type) == 0
+
+def test_files_with_other_names_are_kept(tmp_path, monkeypatch):
+
+    fpaths = copy_games(tmp_path)
+    monkeypatch.chdir(tmp_path)
+
+    # a player listed under another name than in the first game
+    fpath = fpaths[('game_rotations', game_ids[1])]
+    df_gr = pd.read_csv(fpath, index_col=0, dtype=str, keep_default_na=False)
+    df_gr.loc[df_gr.index[0], 'PLAYER_LAST'] = 'Renamed'
+    df_gr.to_csv(fpath)
+
+    assert normalize_season_data(season_str, season_type) == 3
+    assert has_names(fpath, 'gr')
+    assert get_gr(season_str, game_ids[1], season_type)['PLAYER_LAST'].iloc[0] == 'Renamed'
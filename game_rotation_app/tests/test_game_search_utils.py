@@ -0,0 +1,52 @@
+import numpy as np
+
+import game_search_utils
+from game_search_utils import get_game_features, save_game_features, search_games
+from on_off_utils import game_time_offset
+
+# home - away margins after each scoring event, and each game's end (in minutes)
+game_margins = {'0022300001': ([0, -5, -12, -3, 2, 1], 48),      # home comeback from 12 down
+                '0022300002': ([0, -3, -10, -7], 48),            # away wire to wire
+                '0022300003': ([0, 2, 0, -2, 3, -1, 0, 4], 53)}  # back and forth, into OT
+
+
+def get_margin_timelines(season_str, season_type='Regular Season'):
+
+    game_ids = np.array(list(game_margins))
+    game_ends = np.array([end for _, end in game_margins.values()], dtype=float)
+    event_times = np.concatenate([i*game_time_offset + np.linspace(0, end - 1, len(margins))
+                                  for i, (margins, end) in enumerate(game_margins.values())])
+    margins = np.concatenate([margins for margins, _ in game_margins.values()]).astype(float)
+    return game_ids, game_ends, event_times, margins
+
+
+def test_game_features(monkeypatch):
+
+    monkeypatch.setattr(game_search_utils, 'get_margin_timelines', get_margin_timelines)
+    features = get_game_features('2023-24')
+
+    assert features['deficit_overcome'].tolist() == [12, 0, 2]
+    assert features['lead_changes'].tolist() == [1, 0, 4]
+    assert features['ties'].tolist() == [0, 0, 2]
+    assert features['n_ot'].tolist() == [0, 0, 1]
+    assert features['max_lead'].tolist() == [12, 10, 4]
+    assert features['final_margin'].tolist() == [1, -7, 4]
+    assert features['final_margin_abs'].tolist() == [1, 7, 4]
+
+def test_search_filters(monkeypatch, tmp_path):
+
+    monkeypatch.setattr(game_search_utils, 'get_margin_timelines', get_margin_timelines)
+    monkeypatch.chdir(tmp_path)
+    save_game_features('2023-24')
+
+    def search(**kwargs):
+        return search_games('2023-24', **kwargs)[0].tolist()
+
+    assert search(order_by='deficit_overcome') == ['0022300001', '0022300003', '0022300002']
+    assert search(min_deficit_overcome=5) == ['0022300001']
+    assert search(ot_only=True) == ['0022300003']
+    assert search(min_lead_changes=1, order_by='lead_changes') == ['0022300003', '0022300001']
+    assert search(max_final_margin=4, order_by='final_margin_abs') == ['0022300001', '0022300003']
+
+    # only among the given games, in their order (games without features dropped)
+    assert search(game_ids=['0022300003', '0022300099', '0022300002']) == ['0022300003', '0022300002']
@@ -0,0 +1,49 @@
+import os
+import shutil
+
+import pandas as pd
+
+from leaderboard_utils import (build_aggregates, read_aggregates, rebuild_leaderboards,
+                               update_leaderboards, sum_cols)
+
+season_str, season_type = '2023-24', 'Playoffs'
+app_gr_dir = os.path.abspath('data/game_rotations/2023-24_po')
+game_ids = ['0042300101', '0042300102', '0042300103']
+
+
+def test_fold_matches_rebuild(tmp_path, monkeypatch):
+
+    # a season directory of a few saved games, read relative to tmp_path
+    gr_dir = tmp_path/'data'/'game_rotations'/'2023-24_po'
+    os.makedirs(gr_dir)
+    monkeypatch.chdir(tmp_path)
+    lb_dir = str(tmp_path/'leaderboards')
+
+    def save_game(game_id, df_gr=None):
+        if df_gr is None:
+            shutil.copy(os.path.join(app_gr_dir, f'df_gr_{game_id}.csv'), gr_dir)
+        else:
+            df_gr.to_csv(gr_dir/f'df_gr_{game_id}.csv')
+
+    save_game(game_ids[0])
+    save_game(game_ids[1])
+    assert update_leaderboards(season_str, season_type, lb_dir) == 2
+
+    # a new game, a changed game (its last stint dropped), and a removed game
+    save_game(game_ids[2])
+    df_gr = pd.read_csv(gr_dir/f'df_gr_{game_ids[0]}.csv', index_col=0, dtype={'GAME_ID': 'string'})
+    save_game(game_ids[0], df_gr.iloc[:-1])
+    os.remove(gr_dir/f'df_gr_{game_ids[1]}.csv')
+    assert update_leaderboards(season_str, season_type, lb_dir) == 3
+    assert update_leaderboards(season_str, season_type, lb_dir) == 0
+
+    _, df_players, df_teams, game_versions = read_aggregates(season_str, season_type, lb_dir)
+    _, df_players_built, df_teams_built, game_versions_built = build_aggregates(season_str, season_type)
+    assert game_versions == game_versions_built
+
+    num_cols = ['games'] + sum_cols
+    pd.testing.assert_frame_equal(df_players.sort_index()[['PLAYER_NAME'] + num_cols],
+                                  df_players_built.sort_index()[['PLAYER_NAME'] + num_cols], check_dtype=False)
+    pd.testing.assert_frame_equal(df_teams.sort_index()[num_cols],
+                                  df_teams_built.sort_index()[num_cols], check_dtype=False)
+    assert rebuild_leaderboards(season_str, season_type, lb_dir) < 1e-9
@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pandas as pd
+
+from load_data_utils import LeagueGameLogStore
+
+# the game log pulling scripts are in data/ (see data/update_all_data.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+from lgls.get_lgls import save_full_lgl, append_lgl
+
+season_str = '2023-24'
+
+
+def make_lgl(days, n_per_day=2, pts=100):
+    '''
+    A game log with n_per_day games on each day of October 2023, sorted by date
+    '''
+    return pd.DataFrame({'GAME_ID': [f'00223{day:03d}{i:02d}' for day in days for i in range(n_per_day)],
+                         'GAME_DATE': [f'2023-10-{day:02d}' for day in days for _ in range(n_per_day)],
+                         'PTS': pts})
+
+def save_lgls(data_dir, days, suffix=''):
+    fpaths = {}
+    for let in ['T', 'P']:
+        fpaths[let] = os.path.join(data_dir, 'lgls', f'df_lgl_{let}_{season_str}{suffix}.csv')
+        save_full_lgl(make_lgl(days), fpaths[let])
+    return fpaths
+
+
+def test_append_then_refresh(tmp_path, monkeypatch):
+
+    data_dir = str(tmp_path)
+    os.makedirs(os.path.join(data_dir, 'lgls'))
+    fpaths = save_lgls(data_dir, range(1, 6))
+
+    lgl_store = LeagueGameLogStore([season_str], data_dir)
+    file_states = lgl_store.get_file_states()
+    assert len(lgl_store.get_lgls()[0]) == 10 and not lgl_store.refresh()
+
+    # the nightly pull: a few days before the last saved date on, with a stat correction and a new day
+    df_pulled = make_lgl(range(3, 7))
+    df_pulled.loc[df_pulled['GAME_DATE'] == '2023-10-03', 'PTS'] = 101
+    assert append_lgl(df_pulled, fpaths['T'], '2023-10-03') == 12
+
+    # only the changed rows are read
+    def read_whole_lgl(*args):
+        raise AssertionError('the whole game log was read again')
+
+    monkeypatch.setattr(lgl_store, 'read_lgl', read_whole_lgl)
+    assert lgl_store.get_file_states() != file_states
+    assert lgl_store.refresh()
+    monkeypatch.undo()
+
+    df_lgl_T, df_lgl_P = lgl_store.get_lgls()
+    assert df_lgl_T.equals(LeagueGameLogStore([season_str], data_dir).get_lgls()[0])
+    assert df_lgl_T['GAME_DATE'].tolist() == make_lgl(range(1, 7))['GAME_DATE'].tolist()
+    assert df_lgl_T.loc[df_lgl_T['GAME_DATE'] == '2023-10-03', 'PTS'].tolist() == [101, 101]
+    assert df_lgl_T.index.tolist() == list(range(12))
+    assert len(df_lgl_P) == 10
+
+def test_bad_pulls_keep_saved_rows(tmp_path):
+
+    data_dir = str(tmp_path)
+    os.makedirs(os.path.join(data_dir, 'lgls'))
+    fpaths = save_lgls(data_dir, range(1, 6))
+    lgl_store = LeagueGameLogStore([season_str], data_dir)
+
+    # an empty pull, and one missing a saved date, leave the file as it is
+    assert append_lgl(make_lgl([]), fpaths['T'], '2023-10-03') == 10
+    assert append_lgl(make_lgl([3, 5, 6]), fpaths['T'], '2023-10-03') == 10
+    assert not lgl_store.refresh()
+    assert len(lgl_store.get_lgls()[0]) == 10
+
+def test_new_game_logs_are_picked_up(tmp_path):
+
+    data_dir = str(tmp_path)
+    os.makedirs(os.path.join(data_dir, 'lgls'))
+    save_lgls(data_dir, range(1, 6))
+    lgl_store = LeagueGameLogStore([season_str], data_dir)
+    file_states = lgl_store.get_file_states()
+
+    # the season's first playoff night
+    save_lgls(data_dir, [20], suffix='_po')
+    assert lgl_store.get_file_states() != file_states
+    assert lgl_store.refresh()
+
+    df_lgl_T, df_lgl_P = lgl_store.get_lgls()
+    assert df_lgl_T['season_type'].tolist() == ['Regular Season']*10 + ['Playoffs']*2
+    assert len(df_lgl_P) == 12
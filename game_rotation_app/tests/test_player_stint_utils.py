@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import numpy as np
+
+from player_stint_utils import (build_player_stints, get_player_stints, get_player_stints_fpath,
+                                get_stint_players, load_player_stints, update_player_stints)
+
+season_str = '2023-24'
+season_type = 'Playoffs'
+app_gr_dir = os.path.abspath('data/game_rotations/2023-24_po')
+game_ids = ['0042300101', '0042300102', '0042300103']
+
+
+def test_incremental_stints_match_rebuild(tmp_path, monkeypatch):
+
+    gr_dir = tmp_path/'data'/'game_rotations'/'2023-24_po'
+    os.makedirs(gr_dir)
+    monkeypatch.chdir(tmp_path)
+
+    def save_game(game_id):
+        shutil.copy(os.path.join(app_gr_dir, f'df_gr_{game_id}.csv'), gr_dir)
+
+    save_game(game_ids[0])
+    save_game(game_ids[1])
+
+    # the nightly update only reads the new, changed and removed games
+    assert update_player_stints(season_str, season_type) == 2
+    save_game(game_ids[2])
+    assert update_player_stints(season_str, season_type) == 1
+    assert update_player_stints(season_str, season_type) == 0
+    fpath_0 = gr_dir/f'df_gr_{game_ids[0]}.csv'
+    os.utime(fpath_0, ns=(os.stat(fpath_0).st_atime_ns, os.stat(fpath_0).st_mtime_ns + 10**9))
+    assert update_player_stints(season_str, season_type) == 1
+    save_game('0042300104')
+    assert update_player_stints(season_str, season_type) == 1
+    os.remove(gr_dir/'df_gr_0042300104.csv')
+    assert update_player_stints(season_str, season_type) == 1
+
+    assert os.path.exists(get_player_stints_fpath(season_str, season_type))
+    stints = load_player_stints(season_str, season_type)
+    stints_rebuilt = build_player_stints(season_str, season_type)
+    assert sorted(stints) == sorted(stints_rebuilt)
+    for key in stints:
+        assert np.array_equal(stints[key], stints_rebuilt[key], equal_nan=stints[key].dtype.kind == 'f'), key
+    assert list(stints['game_ids']) == game_ids
+
+    # a player's stints are their slice, by game then time
+    df_players = get_stint_players(season_str, season_type)
+    assert df_players['stints'].sum() == len(stints['game'])
+    person_id = df_players['person_id'].iloc[0]
+    player_stints = get_player_stints(season_str, season_type, person_id)
+    assert len(player_stints['game_id']) == df_players['stints'].iloc[0]
+    assert len(set(player_stints['game_id'])) == df_players['games'].iloc[0] == len(game_ids)
+    order = np.lexsort((player_stints['in_time'], player_stints['game_id']))
+    assert np.array_equal(order, np.arange(len(order)))
+    assert (player_stints['out_time'] > player_stints['in_time']).all()
+    assert len(get_player_stints(season_str, season_type, 1)['game_id']) == 0
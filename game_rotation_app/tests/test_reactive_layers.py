@@ -0,0 +1,179 @@
+'''
+Checks that the server's data loading is layered into reactive calcs
+(see app.py's server), so that each input change only reruns the calcs
+downstream of it: a plot setting only restyles the plot, the opponent
+filter only refilters the team's games, and so on.
+
+The server is run in a shiny session without a browser, setting its inputs
+as the browser would, and counting the calls of its calcs
+and of the (faked) game figure builds.
+'''
+
+import asyncio
+from collections import Counter
+from functools import wraps
+
+import pytest
+from shiny import App, reactive
+from shiny._connection import MockConnection
+from shiny.reactive._core import lock
+from shiny.session import session_context
+
+
+# the outputs the browser reports as visible (shiny only computes those)
+visible_outputs = ['plot', 'away_box', 'home_box']
+
+layered_calcs = ['lgls', 'lgl_index', 'season_games', 'team1_games', 'filtered_games',
+                 'game_info', 'game_box', 'plot_settings']
+
+
+class CountingReactive:
+    '''
+    Stands in for shiny's reactive module in app.py,
+    counting the calls of every calc (by name) it makes,
+    and keeping the extended tasks it makes
+    '''
+    def __init__(self, counts):
+        self.counts = counts
+        self.tasks = []
+
+    def __getattr__(self, name):
+        return getattr(reactive, name)
+
+    def counted(self, func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self.counts[func.__name__] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    def calc(self, func):
+        return reactive.calc(self.counted(func))
+
+    def poll(self, *args, **kwargs):
+        return lambda func: reactive.poll(*args, **kwargs)(self.counted(func))
+
+    def extended_task(self, func):
+        task = reactive.extended_task(func)
+        self.tasks.append(task)
+        return task
+
+
+class ServerRun:
+    '''
+    The app's server, running in a shiny session without a browser
+    '''
+    def __init__(self, app_module, counting_reactive, init_inputs):
+        self.session = App(app_module.app_ui, app_module.server)._create_session(MockConnection())
+        clientdata = {f'.clientdata_output_{output_id}_hidden': False for output_id in visible_outputs}
+        clientdata.update({'.clientdata_url_search': '', '.clientdata_pixelratio': 1,
+                           '.clientdata_output_plot_width': 1200})
+        with session_context(self.session):
+            self.session._manage_inputs({**init_inputs, **clientdata})
+            app_module.server(self.session.input, self.session.output, self.session)
+        self.counts = counting_reactive.counts
+        self.tasks = counting_reactive.tasks
+
+    async def set_inputs(self, **inputs):
+        '''
+        Sets inputs as the browser would, returning the calls they caused
+        '''
+        counts_before = Counter(self.counts)
+        with session_context(self.session):
+            self.session._manage_inputs(inputs)
+            await reactive.flush()
+
+        # the plot renders in the background (see app.py's plot_task),
+        # and its output is flushed once it's done
+        while True:
+            async with lock():
+                with reactive.isolate():
+                    if all(task.status() != 'running' for task in self.tasks):
+                        break
+            await asyncio.sleep(0.01)
+
+        return self.counts - counts_before
+
+
+@pytest.fixture(scope='module')
+def app_module():
+    import app
+    return app
+
+@pytest.fixture
+def server_run(app_module, monkeypatch):
+
+    counts = Counter()
+    counting_reactive = CountingReactive(counts)
+    monkeypatch.setattr(app_module, 'reactive', counting_reactive)
+
+    # the game figures are only counted, not built, and nothing is prefetched
+    def get_governed_img(*args, **kwargs):
+        counts['figure'] += 1
+        return b'img', 'full'
+
+    monkeypatch.setattr(app_module, 'get_governed_img', get_governed_img)
+    monkeypatch.setattr(app_module, 'prefetch_games', lambda *args, **kwargs: None)
+
+    from load_test import init_inputs
+    return ServerRun(app_module, counting_reactive, init_inputs)
+
+@pytest.fixture
+def playoff_games(app_module):
+    '''
+    The first season's playoff games, as (game_id, away team, home team)
+    '''
+    idx = app_module.get_lgl_index(*app_module.get_cur_lgls())
+    rows = idx.get_season_games(app_module.season_strs[0], 'Playoffs')
+    return list(zip(idx.game_ids[rows], idx.away_tms[rows], idx.home_tms[rows]))
+
+
+def test_layered_calcs(server_run, playoff_games):
+
+    game_id, tm1, tm2 = playoff_games[0]
+    other_game_id, _, _ = next(game for game in playoff_games[1:] if tm1 in game[1:])
+
+    async def run():
+
+        # the first flush runs every calc once
+        calls = await server_run.set_inputs()
+        for name in layered_calcs:
+            assert calls[name] == 1, name
+
+        # picking a team reruns the team's filters, but not the season's games
+        calls = await server_run.set_inputs(team1=tm1)
+        assert calls['team1_games'] == 1 and calls['filtered_games'] == 1
+        assert calls['season_games'] == 0 and calls['lgls'] == 0
+
+        # picking a game only loads that game
+        calls = await server_run.set_inputs(game_id=game_id)
+        assert calls['game_info'] == 1 and calls['game_box'] == 1 and calls['figure'] == 1
+        for name in ['lgls', 'lgl_index', 'season_games', 'team1_games', 'filtered_games', 'plot_settings']:
+            assert calls[name] == 0, name
+
+        # a plot setting only restyles the plot
+        calls = await server_run.set_inputs(plot_cmap_name='PuOr_r')
+        assert calls['plot_settings'] == 1 and calls['figure'] == 1
+        for name in ['lgls', 'lgl_index', 'season_games', 'team1_games', 'filtered_games',
+                     'game_info', 'game_box']:
+            assert calls[name] == 0, name
+
+        # an opponent only refilters the team's games, leaving the game as it is
+        calls = await server_run.set_inputs(team2=tm2)
+        assert calls['filtered_games'] == 1
+        for name in ['lgls', 'lgl_index', 'season_games', 'team1_games',
+                     'game_info', 'game_box', 'plot_settings', 'figure']:
+            assert calls[name] == 0, name
+
+        # and another game reloads only it
+        calls = await server_run.set_inputs(game_id=other_game_id)
+        assert calls['game_info'] == 1 and calls['game_box'] == 1 and calls['figure'] == 1
+        for name in ['lgls', 'lgl_index', 'season_games', 'team1_games', 'filtered_games', 'plot_settings']:
+            assert calls[name] == 0, name
+
+        # nothing changing reruns nothing
+        assert sum((await server_run.set_inputs()).values()) == 0
+
+    asyncio.run(run())
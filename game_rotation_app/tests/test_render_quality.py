@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+import socket
+import subprocess
+
+import pytest
+
+from render_quality import QualityGovernor, max_latency_secs, quality_levels
+
+
+def test_latency_counts_from_request():
+
+    governor = QualityGovernor(enabled=True)
+    governor.last_step -= 60
+
+    # requests that waited (i.e. behind other sessions' renders) before rendering quickly
+    for _ in range(10):
+        with governor.request(time.monotonic() - 2*max_latency_secs):
+            pass
+
+    assert governor.latency > max_latency_secs
+    assert governor.update_level() == quality_levels[1]
+
+def test_steps_down_under_load():
+    '''
+    Drives the app with load_test.py's simulated sessions,
+    which fails unless the app rendered plots at a lower quality
+    '''
+    pytest.importorskip('websockets')
+    pytest.importorskip('psutil')
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    env = {**os.environ, 'ROTATION_QUALITY_GOVERNOR': '1'}
+    proc = subprocess.run([sys.executable, 'load_test.py', '--sessions', '16', '--actions', '4',
+                           '--think-secs', '0.5', '--port', str(port), '--expect-step-down'],
+                          env=env, capture_output=True, text=True, timeout=600)
+    assert proc.returncode == 0, proc.stdout[-2000:] + proc.stderr[-2000:]
@@ -0,0 +1,13 @@
+import pytest
+
+from rotation_endpoint import get_render_params
+
+
+@pytest.mark.parametrize('scale', ['nan', 'NaN', 'inf', '-inf', 'infinity', 'abc', ''])
+def test_invalid_scale(scale):
+    assert get_render_params({'scale': scale}) is None
+
+def test_scale_rounded_and_clamped():
+    assert get_render_params({'scale': '1.6'})[1][2] == 1.5
+    assert get_render_params({'scale': '0.1'})[1][2] == 1
+    assert get_render_params({'scale': '1e9'})[1][2] == 2
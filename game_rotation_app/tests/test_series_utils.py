@@ -0,0 +1,16 @@
+from load_data_utils import get_lgls, season_strs
+from series_utils import get_playoff_series, series_columns
+
+
+def test_playoff_series():
+
+    df_lgl_T, _ = get_lgls(season_strs[:1])
+    df_series = get_playoff_series(df_lgl_T, season_strs[0])
+    assert list(df_series.columns) == series_columns
+    assert len(df_series) > 0
+
+    # a season without playoff games (yet) still has the columns
+    df_series = get_playoff_series(df_lgl_T[df_lgl_T['season_type'] != 'Playoffs'], season_strs[0])
+    assert list(df_series.columns) == series_columns
+    assert len(df_series) == 0
+    assert len(df_series[df_series['series_id'] == 'BOS-MIA']) == 0
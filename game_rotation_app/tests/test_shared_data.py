@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+from shared_data import SharedLeagueGameLogs, get_lgl_version, write_shared_lgls
+
+
+def make_lgls(n_games):
+    df_lgl_T = pd.DataFrame({'GAME_ID': [f'00223{i:05d}' for i in range(n_games)], 'PTS': range(n_games)})
+    df_lgl_P = pd.DataFrame({'GAME_ID': df_lgl_T['GAME_ID'].repeat(2).values, 'MIN': 24})
+    return df_lgl_T, df_lgl_P
+
+
+def test_workers_move_to_new_versions(tmp_path):
+
+    shared_dir = str(tmp_path)
+    assert write_shared_lgls(*make_lgls(3), shared_dir) == 1
+
+    lgl_store = SharedLeagueGameLogs(shared_dir)
+    df_lgl_T, df_lgl_P = lgl_store.get_lgls()
+    assert len(df_lgl_T) == 3 and len(df_lgl_P) == 6
+    assert not lgl_store.refresh()
+
+    # the nightly update's new rows
+    assert write_shared_lgls(*make_lgls(5), shared_dir) == 2
+    assert lgl_store.get_file_states() == 2
+    assert lgl_store.refresh()
+    assert len(lgl_store.get_lgls()[0]) == 5
+
+    # only the last two versions are kept
+    write_shared_lgls(*make_lgls(6), shared_dir)
+    assert get_lgl_version(shared_dir) == 3
+    assert sorted(d for d in os.listdir(shared_dir) if os.path.isdir(os.path.join(shared_dir, d))) == ['v2', 'v3']
+    assert lgl_store.refresh() and len(lgl_store.get_lgls()[0]) == 6
+
+    # while the frames still mapped from a removed version stay readable
+    assert df_lgl_T['PTS'].tolist() == [0, 1, 2]
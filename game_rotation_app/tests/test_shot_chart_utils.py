@@ -0,0 +1,50 @@
+import os
+import shutil
+
+import numpy as np
+
+from shot_chart_utils import (get_shooters, get_shot_bins, get_shot_chart, has_shot_data,
+                              load_shot_bins, update_shot_bins)
+
+season_str = '2023-24'
+app_pbpstats_dir = os.path.abspath('data/pbpstats/pbp/2023-24_RegularSeason')
+game_ids = ['0022300001', '0022300002', '0022300003']
+
+
+def test_incremental_bins_match_rebuild(tmp_path, monkeypatch):
+
+    pbpstats_dir = tmp_path/'data'/'pbpstats'/'pbp'/'2023-24_RegularSeason'
+    os.makedirs(pbpstats_dir)
+    monkeypatch.chdir(tmp_path)
+
+    def save_game(game_id):
+        shutil.copy(os.path.join(app_pbpstats_dir, f'df_pbp_{game_id}.csv'), pbpstats_dir)
+
+    save_game(game_ids[0])
+    save_game(game_ids[1])
+
+    # the app only reads saved bins
+    assert load_shot_bins(season_str, build_missing=False) is None
+    assert not has_shot_data(season_str, build_missing=False) and has_shot_data(season_str)
+    attempts, _ = get_shot_chart(season_str, build_missing=False)
+    assert attempts.sum() == 0 and len(get_shooters(season_str, build_missing=False)) == 0
+
+    # the nightly update only bins the new game
+    assert update_shot_bins(season_str) == 2
+    save_game(game_ids[2])
+    assert update_shot_bins(season_str) == 1
+    assert update_shot_bins(season_str) == 0
+
+    bins = load_shot_bins(season_str, build_missing=False)
+    bins_rebuilt = get_shot_bins(season_str)
+    assert sorted(bins) == sorted(bins_rebuilt)
+    for key in bins:
+        assert np.array_equal(bins[key], bins_rebuilt[key]), key
+    assert sorted(set(bins['game_ids'])) == game_ids
+
+    # and the charts sum them up
+    attempts, makes = get_shot_chart(season_str, game_id=game_ids[2], build_missing=False)
+    assert attempts.sum() == bins['attempts'][bins['game_ids'] == game_ids[2]].sum() > 0
+    assert (makes <= attempts).all()
+    df_shooters = get_shooters(season_str, build_missing=False)
+    assert df_shooters['attempts'].sum() == bins['attempts'].sum()
@@ -0,0 +1,16 @@
+import sparkline_utils
+from sparkline_utils import load_sprite_sheet, make_gallery_tiles
+
+
+def test_gallery_only_reads_saved_sheets(tmp_path, monkeypatch):
+
+    # no saved sheets, and building one fails the test
+    monkeypatch.setattr(sparkline_utils, 'get_sheet_fpaths', lambda season_str, season_type:
+                        (str(tmp_path / 'sheet.webp'), str(tmp_path / 'sheet_index.json')))
+    def build_sprite_sheet(*args, **kwargs):
+        raise AssertionError('built a sprite sheet')
+    monkeypatch.setattr(sparkline_utils, 'build_sprite_sheet', build_sprite_sheet)
+
+    assert load_sprite_sheet('2023-24', 'Playoffs', build_missing=False) == (None, None)
+    tiles = make_gallery_tiles('2023-24', 'Playoffs', ['0042300401'], ['06-06 DAL @ BOS'])
+    assert 'No game gallery available' in str(tiles)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from stint_utils import get_pbp_stints, get_season_stint_check, home_person_type, away_person_type
+
+home_id, away_id = 1610612738, 1610612748
+players = {101: ('Home One', home_id), 102: ('Home Two', home_id), 201: ('Away One', away_id)}
+
+
+def make_pbp(events):
+    '''
+    A play by play of (clock, event type, margin after, [player ids]) events in the 1st period
+    '''
+    rows = []
+    for clock, event_type, margin, player_ids in events:
+        row = {'GAME_ID': '0042300101', 'PERIOD': 1, 'PCTIMESTRING': clock,
+               'EVENTMSGTYPE': event_type, 'EVENTMSGACTIONTYPE': 1, 'SCOREMARGIN': margin}
+        for k in [1, 2, 3]:
+            p_id = player_ids[k - 1] if k <= len(player_ids) else None
+            name, team_id = players.get(p_id, (None, None))
+            row.update({f'PERSON{k}TYPE': (0 if p_id is None else
+                                           home_person_type if team_id == home_id else away_person_type),
+                        f'PLAYER{k}_ID': p_id, f'PLAYER{k}_NAME': name, f'PLAYER{k}_TEAM_ID': team_id,
+                        f'PLAYER{k}_TEAM_CITY': None if p_id is None else 'City',
+                        f'PLAYER{k}_TEAM_NICKNAME': None if p_id is None else 'Team'})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def test_pbp_stints():
+
+    df_pbp = make_pbp([('12:00', 12, np.nan, []),
+                       ('10:00', 1, 2, [101]),
+                       ('8:00', 1, 0, [201]),
+                       # subbed out at the same game clock time as the away team's free throw,
+                       # which still counts for the home player going off
+                       ('6:00', 8, np.nan, [101, 102]),
+                       ('6:00', 3, -1, [201]),
+                       ('4:00', 1, 2, [102]),
+                       ('0:00', 13, np.nan, [])])
+
+    df_gr = get_pbp_stints(df_pbp)
+
+    assert df_gr['h_a'].tolist() == ['away', 'home', 'home']
+    assert df_gr['PERSON_ID'].tolist() == [201, 101, 102]
+    assert df_gr['IN_TIME_REAL'].tolist() == [0, 0, 3600]
+    assert df_gr['OUT_TIME_REAL'].tolist() == [7200, 3600, 7200]
+    assert df_gr['PT_DIFF'].tolist() == [-2, -1, 3]
+    assert df_gr['PLAYER_PTS'].tolist() == [3, 2, 3]
+    assert df_gr['PLAYER_LAST'].tolist() == ['One', 'One', 'Two']
+    assert df_gr['USG_PCT'].isna().all()
+
+def test_matches_game_rotations():
+
+    # reconstructed stints of saved games match GameRotation's, up to rounding of the times
+    df_compare = get_season_stint_check('2023-24', 'Playoffs', ['0042300101', '0042300102'])
+    assert len(df_compare) > 0
+    assert (df_compare['stints_diff'] == 0).all()
+    assert (df_compare['pt_diff_diff'] == 0).all() and (df_compare['pts_diff'] == 0).all()
+    assert df_compare['minutes_diff'].abs().max() < 0.05